@@ -0,0 +1,305 @@
+"""
+PTalkPTIT - Headless load generator
+Mở N client WebSocket giống ESP32 cùng lúc, mỗi client phát lại file WAV theo thời gian thực (ADPCM như firmware)
+và đi theo cùng state machine với ws_receiver của ptalkptit_sim.py. Đo độ trễ mỗi lượt tính từ lúc hết tiếng nói:
+    eos → PROCESSING_START, eos → byte audio đầu tiên, eos → TTS_END
+
+    python sim/loadgen.py --url ws://localhost:8000/ws?codec=adpcm --clients 20 --turns 5 --wav data/ref1.wav
+    python sim/ptalkptit_sim.py --headless --clients 20 --wav data/
+"""
+import asyncio
+import argparse
+import math
+import random
+import time
+import wave
+from array import array
+from pathlib import Path
+
+import websockets
+
+from ptalkptit_sim import (
+    WEBSOCKET_SERVER_HOST, WEBSOCKET_SERVER_PORT, I2S_SAMPLE_RATE, I2S_READ_CHUNK_SIZE, State, ADPCMState, adpcm_encode_block,
+)
+
+DEFAULT_URL = f"ws://{WEBSOCKET_SERVER_HOST}:{WEBSOCKET_SERVER_PORT}/ws?codec=adpcm"
+FRAME_SAMPLES = I2S_READ_CHUNK_SIZE // 2  # 512 mẫu / frame như mic_task
+FRAME_SECONDS = FRAME_SAMPLES / I2S_SAMPLE_RATE
+# adpcm_encode_block nhân 3.0 để bù mic yếu của robot; file WAV đã đủ mức nên chia lại trước khi mã hóa
+ENCODER_GAIN = 3.0
+
+METRICS = (
+    ("processing_start", "eos → PROCESSING_START"),
+    ("first_audio", "eos → first audio byte"),
+    ("tts_end", "eos → TTS_END"),
+)
+
+# ===============================================================
+# 1. AUDIO: đọc WAV và mã hóa sẵn ADPCM
+# ===============================================================
+
+def read_wav_samples(path: Path) -> array:
+    with wave.open(str(path), "rb") as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1 or wf.getframerate() != I2S_SAMPLE_RATE:
+            raise ValueError(f"{path}: cần WAV PCM16 mono {I2S_SAMPLE_RATE} Hz")
+        samples = array("h")
+        samples.frombytes(wf.readframes(wf.getnframes()))
+    return samples
+
+
+def encode_frames(samples, state: ADPCMState, gain: float) -> list:
+    scale = gain / ENCODER_GAIN
+    frames = []
+    for start in range(0, len(samples), FRAME_SAMPLES):
+        chunk = samples[start:start + FRAME_SAMPLES]
+        if len(chunk) < FRAME_SAMPLES:
+            chunk = list(chunk) + [0] * (FRAME_SAMPLES - len(chunk))
+        frames.append(adpcm_encode_block([s * scale for s in chunk], state))
+    return frames
+
+
+class Utterance:
+    """
+    Một file WAV đã mã hóa sẵn từ encoder reset (server reset decoder sau mỗi TTS_END, client reset encoder),
+    nên mọi client dùng chung được. Gồm tiếng nói + `tail_seconds` im lặng để server endpoint.
+    `end_state` là trạng thái encoder sau frame cuối, dùng khi phải gửi thêm im lặng.
+    """
+    def __init__(self, path: Path, tail_seconds: float, gain: float):
+        self.path = path
+        state = ADPCMState()
+        samples = read_wav_samples(path)
+        self.speech_frames = encode_frames(samples, state, gain)
+        tail = array("h", [0] * int(tail_seconds * I2S_SAMPLE_RATE))
+        self.tail_frames = encode_frames(tail, state, gain)
+        self.end_state = state
+        self.duration = len(samples) / I2S_SAMPLE_RATE
+
+
+def load_utterances(paths, tail_seconds: float, gain: float) -> list:
+    files = []
+    for path in map(Path, paths):
+        files += sorted(path.glob("*.wav")) if path.is_dir() else [path]
+    if not files:
+        raise ValueError("Không có file WAV nào")
+    return [Utterance(path, tail_seconds, gain) for path in files]
+
+# ===============================================================
+# 2. CLIENT: một robot ảo
+# ===============================================================
+
+class TurnTimeout(Exception):
+    pass
+
+
+class Stats:
+    """Kết quả dùng chung của mọi client."""
+    def __init__(self):
+        self.latencies = {key: [] for key, _ in METRICS}
+        self.turns_ok = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.barge_ins = 0
+        self.audio_seconds = 0.0
+
+
+class HeadlessClient:
+    """
+    State machine giống ws_receiver: PROCESSING_START → WAITING (ngừng gửi mic), byte audio đầu → PLAYING_RESPONSE,
+    TTS_END → reset encoder mic + STREAMING, BARGE_IN → STREAMING. Mỗi client có state riêng.
+    """
+    def __init__(self, client_id: int, url: str, utterances: list, stats: Stats, args):
+        self.client_id = client_id
+        # Mỗi robot ảo một device_id để server giữ context hội thoại riêng như thiết bị thật
+        self.url = f"{url}{'&' if '?' in url else '?'}device_id=loadgen-{client_id:03d}"
+        self.utterances = utterances
+        self.stats = stats
+        self.args = args
+        self.rng = random.Random(client_id)
+
+        self.state = State.STATE_DISCONNECTED_WS
+        self.turn = None
+        self.turn_done = asyncio.Event()
+
+    def log(self, message: str):
+        if self.args.verbose:
+            print(f"[C{self.client_id:03d}] {message}")
+
+    def set_state(self, s: State):
+        self.state = s
+        self.log(f"[STATE] -> {s.name}")
+
+    # --- Nhận (tương đương ws_receiver) ---
+    async def receiver(self, ws):
+        async for msg in ws:
+            now = time.perf_counter()
+            turn = self.turn
+            if isinstance(msg, str):
+                if msg == "PROCESSING_START":
+                    self.set_state(State.STATE_WAITING)
+                    if turn is not None and turn["eos"] is not None:
+                        turn.setdefault("processing_start", now - turn["eos"])
+                elif msg == "TTS_END":
+                    # Giống firmware: lượt sau encoder mic bắt đầu lại từ trạng thái reset (Utterance mã hóa sẵn như vậy)
+                    self.set_state(State.STATE_STREAMING)
+                    if turn is not None and turn["eos"] is not None:
+                        turn["tts_end"] = now - turn["eos"]
+                    self.turn_done.set()
+                elif msg == "BARGE_IN":
+                    self.stats.barge_ins += 1
+                    self.set_state(State.STATE_STREAMING)
+                # LISTENING và mã cảm xúc ("00"/"01"/"10") không ảnh hưởng tới phép đo
+            else:
+                if self.state != State.STATE_PLAYING_RESPONSE:
+                    self.set_state(State.STATE_PLAYING_RESPONSE)
+                    if turn is not None and turn["eos"] is not None:
+                        turn.setdefault("first_audio", now - turn["eos"])
+                if turn is not None:
+                    # IMA ADPCM: 2 mẫu mỗi byte
+                    turn["audio_samples"] += len(msg) * 2
+
+    # --- Gửi (tương đương mic_task + ws_sender) ---
+    async def send_utterance(self, ws, utterance: Utterance):
+        turn = self.turn
+        next_send = time.perf_counter()
+        tail_state = ADPCMState()
+        tail_state.predictor, tail_state.index = utterance.end_state.predictor, utterance.end_state.index
+        silence = [0] * FRAME_SAMPLES
+
+        frames = iter(utterance.speech_frames + utterance.tail_frames)
+        sent = 0
+        deadline = next_send + utterance.duration + self.args.timeout
+        while self.state == State.STATE_STREAMING:
+            frame = next(frames, None)
+            if frame is None:
+                # Hết đoạn im lặng dựng sẵn mà server chưa endpoint: tiếp tục gửi im lặng như mic thật
+                if time.perf_counter() > deadline:
+                    raise TurnTimeout("server không endpoint")
+                frame = adpcm_encode_block(silence, tail_state)
+            await ws.send(frame)
+            sent += 1
+            if sent == len(utterance.speech_frames):
+                turn["eos"] = time.perf_counter()
+            # Giữ nhịp thời gian thực theo mốc tuyệt đối để không trôi dần
+            next_send += FRAME_SECONDS
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def run_turn(self, ws, index: int):
+        utterance = self.rng.choice(self.utterances)
+        self.turn = {"eos": None, "audio_samples": 0}
+        self.turn_done.clear()
+        self.log(f"turn {index}: {utterance.path.name}")
+
+        await self.send_utterance(ws, utterance)
+        try:
+            await asyncio.wait_for(self.turn_done.wait(), timeout=self.args.timeout)
+        except asyncio.TimeoutError:
+            raise TurnTimeout("không nhận được TTS_END")
+
+        turn = self.turn
+        for key, _ in METRICS:
+            if key in turn:
+                self.stats.latencies[key].append(turn[key])
+        self.stats.audio_seconds += turn["audio_samples"] / I2S_SAMPLE_RATE
+        self.stats.turns_ok += 1
+
+    async def run(self):
+        await asyncio.sleep(self.client_id * self.args.ramp)
+        done = 0
+        while done < self.args.turns:
+            try:
+                async with websockets.connect(self.url, ping_interval=None, max_size=None) as ws:
+                    self.set_state(State.STATE_STREAMING)
+                    receiver = asyncio.create_task(self.receiver(ws))
+                    try:
+                        while done < self.args.turns:
+                            turn = asyncio.create_task(self.run_turn(ws, done))
+                            finished, _ = await asyncio.wait([turn, receiver], return_when=asyncio.FIRST_COMPLETED)
+                            if turn not in finished:
+                                turn.cancel()
+                                raise ConnectionError("server đóng kết nối")
+                            # Lượt lỗi raise tại đây và được tính một lần ở except bên dưới
+                            turn.result()
+                            done += 1
+                            await asyncio.sleep(self.rng.uniform(0, self.args.think))
+                    finally:
+                        receiver.cancel()
+            except TurnTimeout as e:
+                # Encoder/decoder có thể đã lệch nhau: kết nối lại để cả hai cùng reset
+                self.stats.timeouts += 1
+                done += 1
+                print(f"[C{self.client_id:03d}] ⚠️  Turn timeout ({e}), reconnecting")
+            except (OSError, websockets.WebSocketException) as e:
+                self.stats.errors += 1
+                done += 1
+                print(f"[C{self.client_id:03d}] ❌ WS error: {e!r}")
+                await asyncio.sleep(1.0)
+        self.set_state(State.STATE_DISCONNECTED_WS)
+
+# ===============================================================
+# 3. REPORT
+# ===============================================================
+
+def percentile(values, p: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def print_report(stats: Stats, clients: int, wall: float):
+    print("\n" + " LOAD REPORT ".center(72, "="))
+    print(f"  clients={clients}  turns ok={stats.turns_ok}  timeouts={stats.timeouts}  "
+          f"errors={stats.errors}  barge-ins={stats.barge_ins}")
+    print(f"  wall {wall:.1f}s  |  {stats.turns_ok / wall:.2f} turns/s  |  "
+          f"{stats.audio_seconds:.1f}s response audio received")
+    print(f"\n  {'metric (ms)':<26}{'n':>6}{'p50':>8}{'p90':>8}{'p95':>8}{'p99':>8}{'max':>8}")
+    for key, label in METRICS:
+        values = stats.latencies[key]
+        if not values:
+            print(f"  {label:<26}{0:>6}")
+            continue
+        row = "".join(f"{percentile(values, p) * 1000:>8.0f}" for p in (50, 90, 95, 99, 100))
+        print(f"  {label:<26}{len(values):>6}{row}")
+    print("=" * 72)
+
+# ===============================================================
+# 4. MAIN
+# ===============================================================
+
+async def run_load(args) -> Stats:
+    utterances = load_utterances(args.wav, args.tail, args.gain)
+    print(f"🎙️  {len(utterances)} file WAV, {args.clients} client × {args.turns} lượt → {args.url}")
+    stats = Stats()
+    clients = [HeadlessClient(i, args.url, utterances, stats, args) for i in range(args.clients)]
+    start = time.perf_counter()
+    await asyncio.gather(*(client.run() for client in clients))
+    print_report(stats, args.clients, time.perf_counter() - start)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless multi-device load generator for the voice server.")
+    parser.add_argument("--url", type=str, default=DEFAULT_URL, help="Endpoint WebSocket (device_id được thêm vào)")
+    parser.add_argument("--wav", nargs="+", required=True, help="File WAV PCM16 mono 16 kHz hoặc thư mục chứa chúng")
+    parser.add_argument("--clients", type=int, default=10, help="Số robot ảo kết nối cùng lúc")
+    parser.add_argument("--turns", type=int, default=5, help="Số lượt hội thoại mỗi client")
+    parser.add_argument("--ramp", type=float, default=0.5, help="Giãn cách (giây) giữa lúc các client bắt đầu")
+    parser.add_argument("--think", type=float, default=2.0, help="Nghỉ ngẫu nhiên tối đa (giây) giữa hai lượt")
+    parser.add_argument("--tail", type=float, default=2.0, help="Im lặng (giây) gửi sau tiếng nói để server endpoint")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Thời gian chờ tối đa (giây) cho một lượt")
+    parser.add_argument("--gain", type=float, default=1.0, help="Hệ số khuếch đại file WAV trước khi mã hóa")
+    parser.add_argument("--verbose", action="store_true", help="In chuyển trạng thái của từng client")
+    args = parser.parse_args(argv)
+
+    try:
+        stats = asyncio.run(run_load(args))
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt, stopping...")
+        return 130
+    return 0 if stats.turns_ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,13 +4,23 @@ import time
 import random
 import struct
 import os
+import sys
 import queue
+import uuid
 from enum import Enum
 
 import websockets
-import pyaudio
-import tkinter as tk
-from PIL import Image, ImageTk
+
+# Audio / giao diện chỉ cần khi chạy mô phỏng với mic thật; chế độ --headless (loadgen.py) không dùng
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+try:
+    import tkinter as tk
+    from PIL import Image, ImageTk
+except ImportError:
+    tk = Image = ImageTk = None
 
 # ===============================================================
 # 1. CẤU HÌNH (tương đương main.cpp)
@@ -22,7 +32,8 @@ EMOJI_DIR = r"C:\Users\LEGION\Desktop\ptit\talk_robot\resource\emoji_gif"
 # WebSocket server
 WEBSOCKET_SERVER_HOST = "13.239.36.114"
 WEBSOCKET_SERVER_PORT = 8000
-WEBSOCKET_SERVER_PATH = "/ws"
+DEVICE_ID = "sim-" + uuid.uuid4().hex[:8]  # server giữ context hội thoại riêng theo device_id
+WEBSOCKET_SERVER_PATH = f"/ws?codec=adpcm&device_id={DEVICE_ID}"  # server giải mã/mã hóa IMA ADPCM
 SERVER_URL = f"ws://{WEBSOCKET_SERVER_HOST}:{WEBSOCKET_SERVER_PORT}{WEBSOCKET_SERVER_PATH}"
 
 TIMEOUT_MS = 20000
@@ -286,10 +297,14 @@ def get_state():
 
 emotion_lock = threading.Lock()
 
-def set_emotion(e: int):
-    global emotion
+# Server gửi mã cảm xúc trước khi trả lời xong: khi đã có thì bỏ GIF "suy nghĩ" và hiện cảm xúc luôn
+emotion_received = False
+
+def set_emotion(e: int, received: bool = False):
+    global emotion, emotion_received
     with emotion_lock:
         emotion = e
+        emotion_received = received
     print(f"[EMOTION] -> {e}")
 
 def get_emotion():
@@ -386,7 +401,7 @@ class EmojiDisplay(threading.Thread):
                 self.current_mode = mode
                 self.current_file = STUNNED_GIF
 
-        elif s == State.STATE_WAITING:
+        elif s == State.STATE_WAITING and not emotion_received:
             mode = "thinking"
             if self.current_mode != mode or self.current_frames is None:
                 self.current_frames = self.load_gif_frames(THINKING_GIF)
@@ -395,7 +410,7 @@ class EmojiDisplay(threading.Thread):
                 self.current_file = THINKING_GIF
 
         else:
-            # STREAMING / PLAYING_RESPONSE: hiển thị emotion hiện tại
+            # STREAMING / PLAYING_RESPONSE, hoặc WAITING khi đã nhận mã cảm xúc: hiển thị emotion hiện tại
             mode = "emotion"
             e = get_emotion()
             gif_file = EMOTION_GIF.get(e, EMOTION_GIF[EMOTION_NEUTRAL])
@@ -558,6 +573,16 @@ async def ws_receiver(ws):
             elif text_msg == "TTS_END":
                 print("End of TTS. Returning to streaming mode.")
                 # playback_buffer_flush: đã phát realtime nên bỏ qua
+                # Giống firmware: reset encoder mic để khớp decoder phía server
+                adpcm_mic_state.predictor = 0
+                adpcm_mic_state.index = 0
+                set_state(State.STATE_STREAMING)
+                set_emotion(EMOTION_NEUTRAL)
+
+            elif text_msg == "BARGE_IN":
+                print("Barge-in. Stopping playback.")
+                # Giống firmware: bỏ audio đang chờ phát, không reset encoder mic
+                clear_spk_ring_buffer()
                 set_state(State.STATE_STREAMING)
                 set_emotion(EMOTION_NEUTRAL)
 
@@ -567,11 +592,11 @@ async def ws_receiver(ws):
             else:
                 print("Received emotion details from server.")
                 if text_msg == "00":
-                    set_emotion(EMOTION_NEUTRAL)
+                    set_emotion(EMOTION_NEUTRAL, received=True)
                 elif text_msg == "01":
-                    set_emotion(EMOTION_HAPPY)
+                    set_emotion(EMOTION_HAPPY, received=True)
                 elif text_msg == "10":
-                    set_emotion(EMOTION_SAD)
+                    set_emotion(EMOTION_SAD, received=True)
                 else:
                     # unknown emotion code
                     pass
@@ -658,6 +683,16 @@ async def ws_main_loop():
 def main():
     global running
 
+    if "--headless" in sys.argv[1:]:
+        # Không mic, không cửa sổ: N client phát lại file WAV (xem loadgen.py)
+        import loadgen
+        argv = [arg for arg in sys.argv[1:] if arg != "--headless"]
+        return loadgen.main(argv)
+
+    if pyaudio is None or tk is None:
+        print("Thiếu pyaudio / tkinter / Pillow. Cài đặt chúng hoặc chạy với --headless.")
+        return 1
+
     print("==============================================")
     print("  PTalkPTIT - ESP32 Client Simulator (Python)")
     print("==============================================")
@@ -685,4 +720,4 @@ def main():
         print("Simulator stopped.")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
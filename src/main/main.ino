@@ -27,7 +27,8 @@
 // MODIFIED: Changed to a mutable char array to hold the IP from WiFiManager
 char websocket_server_host[40] = "13.239.36.114"; // Default IP 13.239.36.114
 const uint16_t websocket_server_port = 8000;
-const char *websocket_server_path = "/ws";
+// server giải mã/mã hóa IMA ADPCM; device_id (MAC) để server giữ context hội thoại riêng cho từng robot
+char websocket_server_path[64] = "/ws?codec=adpcm";
 #define TIMEOUT_MS 20000
 
 // --- Chân cắm I2S (THEO SƠ ĐỒ MỚI ĐÃ SỬA LỖI) ---
@@ -118,6 +119,8 @@ extern VideoInfo *thinkingEmotion;
 
 // emotion variable to track current emotion state
 volatile uint8_t emotion = EMOTION_NEUTRAL;
+// Server gửi mã cảm xúc trước khi trả lời xong: khi đã có thì bỏ GIF "suy nghĩ" và hiện cảm xúc luôn
+volatile bool emotion_received = false;
 
 unsigned long lastReceivedTime = millis();
 
@@ -428,7 +431,7 @@ void display_task(void *pvParameters)
       // Draw the JPEG image
       TJpgDec.drawJpg(0, 0, jpg_data, jpg_size);
     }
-    else if (currentState == STATE_WAITING)
+    else if (currentState == STATE_WAITING && !emotion_received)
     {
       // thinking animation
       //  Check frame bounds for thinking animation
@@ -570,6 +573,7 @@ void onWebsocketMessage(WebsocketsMessage message)
       Serial.println("Server is processing. Pausing mic.");
       currentState = STATE_WAITING;
       emotion = EMOTION_NEUTRAL;
+      emotion_received = false;
       clearMicRingBuffer();
       clearSpkRingBuffer();
     }
@@ -590,6 +594,17 @@ void onWebsocketMessage(WebsocketsMessage message)
       currentState = STATE_STREAMING;
       emotion = EMOTION_NEUTRAL;
     }
+    else if (text_msg == "BARGE_IN")
+    {
+      // User spoke over the response: drop queued audio and keep capturing.
+      // Mic ADPCM state is NOT reset, the server decoder keeps running across barge-in.
+      Serial.println("Barge-in. Stopping playback.");
+      i2s_zero_dma_buffer(I2S_SPEAKER_PORT);
+      playback_buffer_fill = 0;
+      clearSpkRingBuffer();
+      currentState = STATE_STREAMING;
+      emotion = EMOTION_NEUTRAL;
+    }
     else if (text_msg == "LISTENING")
     {
       Serial.println("listening ");
@@ -601,14 +616,17 @@ void onWebsocketMessage(WebsocketsMessage message)
       if (text_msg == "00")
       {
         emotion = EMOTION_NEUTRAL;
+        emotion_received = true;
       }
       else if (text_msg == "01")
       {
         emotion = EMOTION_HAPPY;
+        emotion_received = true;
       }
       else if (text_msg == "10")
       {
         emotion = EMOTION_SAD;
+        emotion_received = true;
       }
       else
       {
@@ -832,6 +850,11 @@ void setup()
   Serial.println("IP address: " + WiFi.localIP().toString());
   Serial.println("WebSocket Server IP: " + String(websocket_server_host));
 
+  String device_id = WiFi.macAddress();
+  device_id.replace(":", "");
+  snprintf(websocket_server_path, sizeof(websocket_server_path), "/ws?codec=adpcm&device_id=%s", device_id.c_str());
+  Serial.println("WebSocket path: " + String(websocket_server_path));
+
   // --- Initialize Display fully ---
   tft.fillScreen(TFT_BLACK);
   TJpgDec.setJpgScale(1);
@@ -0,0 +1,172 @@
+"""
+IMA ADPCM Codec (4-bit, mono) tương thích với firmware ESP32 và simulator
+Dùng audioop (C) khi có; nếu không có thì dùng bảng tra tính sẵn
+"""
+import sys
+
+try:
+    # audioop có sẵn tới Python 3.12, từ 3.13 cài gói "audioop-lts"
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+INDEX_TABLE = [
+    -1, -1, -1, -1, 2, 4, 6, 8,
+    -1, -1, -1, -1, 2, 4, 6, 8
+]
+
+STEP_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14,
+    16, 17, 19, 21, 23, 25, 28, 31,
+    34, 37, 41, 45, 50, 55, 60, 66,
+    73, 80, 88, 97, 107, 118, 130, 143,
+    157, 173, 190, 209, 230, 253, 279, 307,
+    337, 371, 408, 449, 494, 544, 598, 658,
+    724, 796, 876, 963, 1060, 1166, 1282, 1411,
+    1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024,
+    3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484,
+    7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899,
+    15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+]
+
+# Firmware đặt mẫu đầu tiên ở nibble thấp, audioop đặt ở nibble cao → đảo nibble bằng bytes.translate
+_NIBBLE_SWAP = bytes(((b & 0x0F) << 4) | (b >> 4) for b in range(256))
+
+# Bảng tra cho bản fallback: độ lệch có dấu và index kế tiếp cho mỗi cặp (index, nibble)
+_DIFF = [[0] * 16 for _ in range(89)]
+_NEXT_INDEX = [[0] * 16 for _ in range(89)]
+for _index, _step in enumerate(STEP_TABLE):
+    for _nibble in range(16):
+        _diffq = _step >> 3
+        if _nibble & 4:
+            _diffq += _step
+        if _nibble & 2:
+            _diffq += _step >> 1
+        if _nibble & 1:
+            _diffq += _step >> 2
+        _DIFF[_index][_nibble] = -_diffq if _nibble & 8 else _diffq
+        _NEXT_INDEX[_index][_nibble] = min(88, max(0, _index + INDEX_TABLE[_nibble]))
+
+
+def _decode_table(data: bytes, predictor: int, index: int):
+    out = [0] * (len(data) * 2)
+    pos = 0
+    for byte in data:
+        for nibble in (byte & 0x0F, byte >> 4):
+            predictor += _DIFF[index][nibble]
+            predictor = 32767 if predictor > 32767 else (-32768 if predictor < -32768 else predictor)
+            index = _NEXT_INDEX[index][nibble]
+            out[pos] = predictor
+            pos += 1
+    return out, predictor, index
+
+
+def _encode_table(samples, predictor: int, index: int):
+    out = bytearray((len(samples) + 1) // 2)
+    low = None
+    pos = 0
+    for sample in samples:
+        step = STEP_TABLE[index]
+        diff = sample - predictor
+        nibble = 0
+        if diff < 0:
+            nibble = 8
+            diff = -diff
+        if diff >= step:
+            nibble |= 4
+            diff -= step
+        if diff >= step >> 1:
+            nibble |= 2
+            diff -= step >> 1
+        if diff >= step >> 2:
+            nibble |= 1
+        predictor += _DIFF[index][nibble]
+        predictor = 32767 if predictor > 32767 else (-32768 if predictor < -32768 else predictor)
+        index = _NEXT_INDEX[index][nibble]
+        if low is None:
+            low = nibble
+        else:
+            out[pos] = low | (nibble << 4)
+            pos += 1
+            low = None
+    if low is not None:
+        out[pos] = low
+    return bytes(out), predictor, index
+
+
+class AdpcmCodec:
+    """Giữ state encoder (downlink) và decoder (uplink) của một kết nối."""
+    def __init__(self):
+        self._enc_state = None
+        self._dec_state = None
+        # Phần dư chưa đủ một byte ADPCM (1 mẫu lẻ) của lần encode() trước, ghép vào đầu lần sau
+        self._enc_pending = b""
+        if audioop is None:
+            print("⚠️  audioop không khả dụng, ADPCM dùng bản Python chậm hơn (pip install audioop-lts)")
+
+    def reset_encoder(self):
+        self._enc_state = None
+        self._enc_pending = b""
+
+    def reset_decoder(self):
+        self._dec_state = None
+
+    def decode(self, data) -> bytes:
+        """ADPCM → PCM16 little-endian (2 mẫu mỗi byte)."""
+        data = bytes(data)
+        if audioop is not None:
+            pcm, self._dec_state = audioop.adpcm2lin(data.translate(_NIBBLE_SWAP), 2, self._dec_state)
+            return pcm
+        predictor, index = self._dec_state or (0, 0)
+        samples, predictor, index = _decode_table(data, predictor, index)
+        self._dec_state = (predictor, index)
+        return _pack_pcm16(samples)
+
+    def encode(self, pcm) -> bytes:
+        """
+        PCM16 little-endian → ADPCM (4 bit mỗi mẫu). Mỗi byte chứa 2 mẫu nên chỉ mã hóa số mẫu chẵn;
+        mẫu lẻ cuối khối được giữ lại cho lần gọi sau, hết luồng thì gọi flush_encoder().
+        """
+        pcm = self._enc_pending + bytes(pcm)
+        even = len(pcm) - len(pcm) % 4
+        self._enc_pending = pcm[even:]
+        return self._encode(pcm[:even])
+
+    def flush_encoder(self) -> bytes:
+        """Mã hóa mẫu lẻ còn giữ, đệm bằng chính mẫu đó cho đủ byte. Gọi một lần ở cuối luồng audio."""
+        pending, self._enc_pending = self._enc_pending, b""
+        if len(pending) < 2:
+            return b""
+        return self._encode(pending[:2] * 2)
+
+    def _encode(self, pcm: bytes) -> bytes:
+        if not pcm:
+            return b""
+        if audioop is not None:
+            adpcm, self._enc_state = audioop.lin2adpcm(pcm, 2, self._enc_state)
+            return adpcm.translate(_NIBBLE_SWAP)
+        predictor, index = self._enc_state or (0, 0)
+        data, predictor, index = _encode_table(_unpack_pcm16(pcm), predictor, index)
+        self._enc_state = (predictor, index)
+        return data
+
+
+def _pack_pcm16(samples) -> bytes:
+    import array
+    buf = array.array("h", samples)
+    if sys.byteorder != "little":
+        buf.byteswap()
+    return buf.tobytes()
+
+
+def _unpack_pcm16(pcm: bytes):
+    import array
+    buf = array.array("h")
+    buf.frombytes(pcm[:len(pcm) - len(pcm) % 2])
+    if sys.byteorder != "little":
+        buf.byteswap()
+    return buf
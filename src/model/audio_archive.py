@@ -0,0 +1,79 @@
+"""
+Utterance Archive Sink
+Ghi các câu nói ra file WAV trên một thread nền, tên file không trùng và có giới hạn số file
+"""
+import os
+import queue
+import threading
+import uuid
+import wave
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from settings import server_settings as cfg
+
+
+class AudioArchiveSink:
+    def __init__(self, folder: str = None, max_files: int = None, queue_size: int = None,
+                 sample_rate: int = 16000, sample_width: int = 2, channels: int = 1):
+        self.folder = Path(folder or cfg.ARCHIVE_DIR)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_files = max_files or cfg.ARCHIVE_MAX_FILES
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.dropped = 0
+        self.written = 0
+        # Tên file bắt đầu bằng timestamp nên sắp xếp theo tên cũng là theo thời gian
+        self._files = deque(sorted(str(p) for p in self.folder.glob("recording_*.wav")))
+        self._queue = queue.Queue(maxsize=queue_size or cfg.ARCHIVE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._writer_loop, name="audio-archive", daemon=True)
+        self._thread.start()
+
+    def _make_filename(self, session_id: str) -> Path:
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+        safe_session = "".join(ch for ch in session_id if ch.isalnum() or ch in "-_") or "default"
+        return self.folder / f"recording_{timestamp}_{safe_session}_{uuid.uuid4().hex[:8]}.wav"
+
+    def submit(self, audio_data: bytes, session_id: str = "default"):
+        """Không chặn: đưa câu nói vào hàng đợi ghi, bỏ qua nếu hàng đợi đầy."""
+        try:
+            self._queue.put_nowait((bytes(audio_data), session_id))
+        except queue.Full:
+            self.dropped += 1
+            print("⚠️  Archive queue full, utterance not saved")
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            audio_data, session_id = item
+            filename = self._make_filename(session_id)
+            try:
+                with wave.open(str(filename), 'wb') as wf:
+                    wf.setnchannels(self.channels)
+                    wf.setsampwidth(self.sample_width)
+                    wf.setframerate(self.sample_rate)
+                    wf.writeframes(audio_data)
+                self.written += 1
+                self._files.append(str(filename))
+                self._rotate()
+            except Exception as e:
+                print(f"Error saving WAV file: {e}")
+
+    def _rotate(self):
+        while len(self._files) > self.max_files:
+            oldest = self._files.popleft()
+            try:
+                os.remove(oldest)
+            except OSError as e:
+                print(f"⚠️  Failed to remove old recording {oldest}: {e}")
+
+    def stats(self) -> dict:
+        return {"written": self.written, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
@@ -0,0 +1,172 @@
+"""
+Per-connection Audio Buffers
+Bộ đệm cấp phát trước cho pre-roll và câu nói, ghi qua memoryview, có giới hạn độ dài và thống kê bộ nhớ
+"""
+import threading
+
+
+class PreRollRing:
+    """Vòng đệm N frame gần nhất trước khi phát hiện tiếng nói (thay cho deque các bytes)."""
+    def __init__(self, frame_bytes: int, frames: int):
+        self.frame_bytes = frame_bytes
+        self.frames = frames
+        self._buf = bytearray(frame_bytes * frames)
+        self._view = memoryview(self._buf)
+        self._next = 0
+        self._count = 0
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buf)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, frame):
+        start = self._next * self.frame_bytes
+        self._view[start:start + self.frame_bytes] = frame
+        self._next = (self._next + 1) % self.frames
+        self._count = min(self._count + 1, self.frames)
+
+    def chunks(self):
+        """Các memoryview frame từ cũ nhất đến mới nhất."""
+        first = (self._next - self._count) % self.frames
+        for i in range(self._count):
+            start = ((first + i) % self.frames) * self.frame_bytes
+            yield self._view[start:start + self.frame_bytes]
+
+    def clear(self):
+        self._next = 0
+        self._count = 0
+
+
+class UtteranceBuffer:
+    """Bộ đệm tuyến tính có dung lượng cố định cho một câu nói."""
+    def __init__(self, capacity_bytes: int):
+        self._buf = bytearray(capacity_bytes)
+        self._view = memoryview(self._buf)
+        self.length = 0
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._buf)
+
+    @property
+    def is_full(self) -> bool:
+        return self.length >= len(self._buf)
+
+    def append(self, data) -> bool:
+        """Ghi thêm dữ liệu, trả về False nếu bộ đệm đã đầy (phần dư bị cắt bỏ)."""
+        size = len(data)
+        room = len(self._buf) - self.length
+        if size > room:
+            self._view[self.length:] = memoryview(data)[:room]
+            self.length = len(self._buf)
+            return False
+        self._view[self.length:self.length + size] = data
+        self.length += size
+        return True
+
+    def view(self) -> memoryview:
+        return self._view[:self.length]
+
+    def clear(self):
+        self.length = 0
+
+
+class ConnectionAudioBuffers:
+    """Nhóm bộ đệm audio của một kết nối, kèm thống kê bộ nhớ toàn server."""
+    _lock = threading.Lock()
+    total_allocated = 0
+    active_connections = 0
+
+    def __init__(self, frame_bytes: int, pre_roll_frames: int, max_utterance_frames: int):
+        self.pre_roll = PreRollRing(frame_bytes, pre_roll_frames)
+        # Câu nói gồm cả pre-roll được chép sang lúc bắt đầu ghi
+        self.utterance = UtteranceBuffer(frame_bytes * (pre_roll_frames + max_utterance_frames))
+        self._released = False
+        with ConnectionAudioBuffers._lock:
+            ConnectionAudioBuffers.total_allocated += self.nbytes
+            ConnectionAudioBuffers.active_connections += 1
+
+    @property
+    def nbytes(self) -> int:
+        return self.pre_roll.nbytes + self.utterance.nbytes
+
+    def start_utterance(self):
+        self.utterance.clear()
+        for frame in self.pre_roll.chunks():
+            self.utterance.append(frame)
+
+    def reset(self):
+        self.utterance.clear()
+        self.pre_roll.clear()
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        with ConnectionAudioBuffers._lock:
+            ConnectionAudioBuffers.total_allocated -= self.nbytes
+            ConnectionAudioBuffers.active_connections -= 1
+
+    def stats(self) -> dict:
+        return {"allocated_bytes": self.nbytes, "utterance_bytes": self.utterance.length}
+
+    @classmethod
+    def global_stats(cls) -> dict:
+        return {"allocated_bytes": cls.total_allocated, "connections": cls.active_connections}
+
+
+class FrameAssembler:
+    """Cắt payload WebSocket kích thước bất kỳ thành các frame VAD, giữ phần dư sang message sau.
+
+    Frame nằm trọn trong payload được trả về dạng memoryview (không copy); chỉ frame ghép
+    từ phần dư của message trước mới được chép vào bộ đệm carry (hai bộ đệm luân phiên).
+    Các frame trả về chỉ hợp lệ cho tới lần gọi feed() tiếp theo.
+    """
+    def __init__(self, frame_bytes: int):
+        self.frame_bytes = frame_bytes
+        self._carry = [memoryview(bytearray(frame_bytes)), memoryview(bytearray(frame_bytes))]
+        self._active = 0
+        self._carry_len = 0
+        self.total_bytes = 0
+        self.total_frames = 0
+
+    @property
+    def pending_bytes(self) -> int:
+        return self._carry_len
+
+    def feed(self, payload) -> list:
+        view = memoryview(payload).cast("B")
+        self.total_bytes += len(view)
+        frames = []
+        fb = self.frame_bytes
+
+        if self._carry_len:
+            carry = self._carry[self._active]
+            take = min(fb - self._carry_len, len(view))
+            carry[self._carry_len:self._carry_len + take] = view[:take]
+            self._carry_len += take
+            view = view[take:]
+            if self._carry_len < fb:
+                return frames
+            frames.append(carry)
+            # Phần dư tiếp theo ghi vào bộ đệm còn lại để không đè lên frame vừa trả về
+            self._active ^= 1
+            self._carry_len = 0
+
+        full = len(view) - len(view) % fb
+        for offset in range(0, full, fb):
+            frames.append(view[offset:offset + fb])
+
+        rest = len(view) - full
+        if rest:
+            self._carry[self._active][:rest] = view[full:]
+            self._carry_len = rest
+
+        self.total_frames += len(frames)
+        return frames
+
+    def reset(self):
+        self._carry_len = 0
@@ -2,13 +2,55 @@
 import google.generativeai as genai
 from google.generativeai import types
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
-import asyncio
+import re
 
 # Định nghĩa các hằng số cho mã cảm xúc để dễ quản lý
 EMOTION_NEUTRAL = "00"
 EMOTION_HAPPY = "01"
 EMOTION_SAD = "10"
 
+EMOTION_CODE_MAP = {"HAPPY": EMOTION_HAPPY, "SAD": EMOTION_SAD, "NEUTRAL": EMOTION_NEUTRAL}
+EMOTION_KEY_MAP = {code: key for key, code in EMOTION_CODE_MAP.items()}
+
+
+class InlineEmotionTag:
+    """
+    Tách nhãn cảm xúc [HAPPY] / [SAD] / [NEUTRAL] mà LLM viết ở đầu câu trả lời (llm_settings.EMOTION_MODE = "inline").
+    Nhận từng đoạn text đang stream; giữ lại phần đầu cho đến khi đọc được nhãn rồi trả phần còn lại cho câu trả lời.
+    Không có nhãn hợp lệ thì coi là Neutral và giữ nguyên văn bản.
+    """
+    _TAG = re.compile(r"^\s*\[(HAPPY|SAD|NEUTRAL)\]\s*", re.IGNORECASE)
+    _MAX_PREFIX_CHARS = 24
+
+    def __init__(self):
+        self.emotion_code = None
+        self._buffer = ""
+
+    def feed(self, text: str) -> str:
+        if self.emotion_code is not None:
+            return text
+        self._buffer += text
+        match = self._TAG.match(self._buffer)
+        if match:
+            self.emotion_code = EMOTION_CODE_MAP[match.group(1).upper()]
+            rest = self._buffer[match.end():]
+        elif ("]" in self._buffer or len(self._buffer) > self._MAX_PREFIX_CHARS
+              or (self._buffer.strip() and not self._buffer.lstrip().startswith("["))):
+            self.emotion_code = EMOTION_NEUTRAL
+            rest = self._buffer
+        else:
+            # Chưa đủ ký tự để biết có nhãn hay không
+            return ""
+        self._buffer = ""
+        return rest
+
+    def flush(self) -> str:
+        """Câu trả lời kết thúc khi vẫn chưa đọc xong nhãn."""
+        if self.emotion_code is None:
+            self.emotion_code = EMOTION_NEUTRAL
+        rest, self._buffer = self._buffer, ""
+        return rest
+
 class EmotionManager:
     """
     Quản lý việc phát hiện cảm xúc và tối ưu hóa prompt.
@@ -90,60 +132,60 @@ class EmotionManager:
         if detected_emotion_key == "NEUTRAL": return ("GỢI Ý KHI CÙNG NHAU HỌC BÀI:\n• Tớ đang là một người bạn cùng học, phải thật kiên nhẫn.\n• Khi bạn hỏi bài, tớ không được trả lời ngay. Hãy gợi ý từng bước một.\n• Dùng những câu hỏi để bạn tự suy nghĩ: 'Theo cậu thì bước tiếp theo là gì?', 'Cậu thử nghĩ xem...'.\n• Luôn khuyến khích bạn: 'Cậu làm được mà!', 'Chúng mình cùng làm nhé!'.\n• Giữ giọng nói hồn nhiên, tò mò như một bạn học thật sự.")
         return ""
 
-    async def _detect_emotion_by_llm(self, user_message: str) -> str:
-        if not self.llm_client:
-            print("⚠️ LLM client not available for emotion detection, defaulting to Neutral.")
-            return EMOTION_NEUTRAL
-        
+    def inline_instructions(self) -> str:
+        """Phần prompt cho chế độ "inline": LLM tự phân loại cảm xúc và trả lời theo gợi ý tương ứng trong cùng một lần gọi."""
+        return "\n".join([
+            "PHÂN LOẠI CẢM XÚC: Trước khi trả lời, hãy xác định cảm xúc chính trong câu của Cậu và viết đúng MỘT nhãn "
+            "ở ngay đầu câu trả lời: [HAPPY], [SAD] hoặc [NEUTRAL]. Sau nhãn mới là câu trả lời, làm theo gợi ý của nhãn đó:",
+            "[HAPPY] " + self._get_optimization_hint("HAPPY"),
+            "[SAD] " + self._get_optimization_hint("SAD"),
+            "[NEUTRAL] " + self._get_optimization_hint("NEUTRAL"),
+        ])
+
+    def match_keywords(self, user_message: str) -> str:
+        """Mã cảm xúc theo từ khóa, hoặc None nếu không từ khóa nào khớp."""
+        message_lower = user_message.lower()
+        for key in ("HAPPY", "SAD", "NEUTRAL"):
+            if any(keyword in message_lower for keyword in self.emotion_keywords[key]):
+                return EMOTION_CODE_MAP[key]
+        return None
+
+    def hint_for(self, emotion_code: str) -> str:
+        return self._get_optimization_hint(EMOTION_KEY_MAP.get(emotion_code, "NEUTRAL"))
+
+    def _emotion_prompt(self, user_message: str) -> str:
         # [CẢI TIẾN QUAN TRỌNG] Sử dụng một prompt có ngữ cảnh rõ ràng hơn
-        prompt = (
+        return (
             "Bạn là một chuyên gia phân loại văn bản. "
             "Nhiệm vụ của bạn là đọc câu của người dùng và phân loại cảm xúc chính. "
             f"Dưới đây là câu cần phân tích:\n\"{user_message}\"\n\n"
             "Chỉ trả lời bằng MỘT trong ba từ sau: Happy, Sad, Neutral."
         )
-        
+
+    def detect_by_llm(self, user_message: str) -> str:
+        """Phân loại cảm xúc bằng một lần gọi LLM riêng (chế độ "separate"), gọi từ pipeline worker thread."""
+        if not self.llm_client:
+            print("⚠️ LLM client not available for emotion detection, defaulting to Neutral.")
+            return EMOTION_NEUTRAL
         try:
-            generation_config = {"temperature": 0.1, "max_output_tokens": 5}
-            
-            response = await self.llm_client.generate_content_async(
-                contents=[prompt],
-                generation_config=generation_config,
+            response = self.llm_client.generate_content(
+                contents=[self._emotion_prompt(user_message)],
+                generation_config={"temperature": 0.1, "max_output_tokens": 5},
                 safety_settings=self.safety_settings
             )
-
-            if not response.parts:
-                block_reason = "Unknown"
-                if response.prompt_feedback and hasattr(response.prompt_feedback, 'block_reason'):
-                    block_reason = response.prompt_feedback.block_reason.name
-                print(f"⚠️ LLM emotion detection was blocked by safety filters (Reason: {block_reason}). Defaulting to Neutral.")
-                return EMOTION_NEUTRAL
-
-            result_text = response.text.strip().lower()
-            if "happy" in result_text: return EMOTION_HAPPY
-            elif "sad" in result_text: return EMOTION_SAD
-            else: return EMOTION_NEUTRAL
-            
+            return self._parse_emotion_response(response)
         except Exception as e:
             print(f"❌ An unexpected error occurred during LLM emotion detection: {e}")
             return EMOTION_NEUTRAL
 
-    async def analyze(self, user_message: str) -> tuple[str, str]:
-        detected_emotion_key = ""
-        message_lower = user_message.lower()
-        if any(keyword in message_lower for keyword in self.emotion_keywords["HAPPY"]): detected_emotion_key = "HAPPY"
-        elif any(keyword in message_lower for keyword in self.emotion_keywords["SAD"]): detected_emotion_key = "SAD"
-        elif any(keyword in message_lower for keyword in self.emotion_keywords["NEUTRAL"]): detected_emotion_key = "NEUTRAL"
-        
-        if detected_emotion_key:
-            optimization_hint = self._get_optimization_hint(detected_emotion_key)
-            emotion_code_map = {"HAPPY": EMOTION_HAPPY, "SAD": EMOTION_SAD, "NEUTRAL": EMOTION_NEUTRAL}
-            emotion_code = emotion_code_map.get(detected_emotion_key, EMOTION_NEUTRAL)
-            return emotion_code, optimization_hint
-        else:
-            print("  ... No keywords matched, using LLM for emotion detection.")
-            emotion_code = await self._detect_emotion_by_llm(user_message)
-            emotion_key_map = {EMOTION_HAPPY: "HAPPY", EMOTION_SAD: "SAD", EMOTION_NEUTRAL: "NEUTRAL"}
-            llm_detected_key = emotion_key_map.get(emotion_code, "NEUTRAL")
-            optimization_hint = self._get_optimization_hint(llm_detected_key)
-            return emotion_code, optimization_hint
\ No newline at end of file
+    def _parse_emotion_response(self, response) -> str:
+        if not response.parts:
+            block_reason = "Unknown"
+            if response.prompt_feedback and hasattr(response.prompt_feedback, 'block_reason'):
+                block_reason = response.prompt_feedback.block_reason.name
+            print(f"⚠️ LLM emotion detection was blocked by safety filters (Reason: {block_reason}). Defaulting to Neutral.")
+            return EMOTION_NEUTRAL
+        result_text = response.text.strip().lower()
+        if "happy" in result_text: return EMOTION_HAPPY
+        elif "sad" in result_text: return EMOTION_SAD
+        else: return EMOTION_NEUTRAL
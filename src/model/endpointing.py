@@ -0,0 +1,115 @@
+"""
+Adaptive Endpointing
+Quyết định hết lượt nói từ xu hướng xác suất VAD, năng lượng, độ dài câu và transcript streaming,
+thay cho cửa sổ im lặng cố định 750 ms
+"""
+import re
+from collections import deque
+
+from settings import server_settings as cfg
+
+ENDPOINT_NONE = "none"
+ENDPOINT_PROVISIONAL = "provisional"
+ENDPOINT_FINAL = "final"
+
+# Câu kết thúc bằng từ nối / từ đệm thường là trẻ còn đang nghĩ tiếp
+INCOMPLETE_ENDINGS = {
+    "và", "với", "thì", "là", "mà", "nhưng", "rồi", "của", "cho", "để", "nên", "vì", "hay", "hoặc",
+    "còn", "cái", "con", "ừm", "ờm", "à", "ơ", "ờ", "thế", "kiểu",
+}
+# Tiểu từ cuối câu tiếng Việt cho thấy câu đã trọn ý
+COMPLETE_ENDINGS = {
+    "không", "nhé", "nhỉ", "ạ", "chưa", "hả", "đi", "nha", "nhá", "đó", "đấy", "vậy", "thôi", "cậu", "bạn",
+}
+_WORD = re.compile(r"\w+", flags=re.UNICODE)
+
+
+class EndpointConfig:
+    """Ngưỡng endpointing, mặc định lấy từ server_settings và có thể ghi đè theo device_id."""
+    FIELDS = {
+        "min_silence_frames": "ENDPOINT_MIN_SILENCE_FRAMES",
+        "base_silence_frames": "ENDPOINT_BASE_SILENCE_FRAMES",
+        "max_silence_frames": "ENDPOINT_MAX_SILENCE_FRAMES",
+        "short_utterance_frames": "ENDPOINT_SHORT_UTTERANCE_FRAMES",
+        "provisional_frames": "ENDPOINT_PROVISIONAL_FRAMES",
+        "sharp_drop_bonus": "ENDPOINT_SHARP_DROP_BONUS",
+        "hesitation_penalty": "ENDPOINT_HESITATION_PENALTY",
+        "incomplete_penalty": "ENDPOINT_INCOMPLETE_PENALTY",
+        "complete_bonus": "ENDPOINT_COMPLETE_BONUS",
+        "residual_energy_ratio": "ENDPOINT_RESIDUAL_ENERGY_RATIO",
+    }
+
+    def __init__(self, **overrides):
+        for field, setting in self.FIELDS.items():
+            setattr(self, field, overrides.get(field, getattr(cfg, setting)))
+
+    @classmethod
+    def for_device(cls, device_id: str = None) -> "EndpointConfig":
+        return cls(**cfg.ENDPOINT_DEVICE_OVERRIDES.get(device_id or "", {}))
+
+
+class AdaptiveEndpointer:
+    """Theo dõi một câu nói; update() được gọi cho mỗi frame sau khi đã bắt đầu ghi âm."""
+    def __init__(self, config: EndpointConfig = None, speech_threshold: float = 0.5):
+        self.config = config or EndpointConfig()
+        self.speech_threshold = speech_threshold
+        self.reset()
+
+    def reset(self):
+        self.speech_frames = 0
+        self.silence_run = 0
+        self.speech_energy = 0.0
+        self.required_silence = self.config.base_silence_frames
+        self._recent_probs = deque(maxlen=5)
+        self._silence_probs = []
+        self._silence_energy = []
+        self._provisional_sent = False
+
+    def required_silence_frames(self, partial_text: str = None) -> int:
+        c = self.config
+        required = c.min_silence_frames if self.speech_frames < c.short_utterance_frames else c.base_silence_frames
+
+        if self._silence_probs:
+            # Xác suất trước khoảng lặng cao và rơi thẳng xuống gần 0 → kết thúc dứt khoát
+            onset = self._silence_probs[0]
+            peak = max(self._recent_probs) if self._recent_probs else 1.0
+            if peak > 0.8 and onset < 0.1:
+                required -= c.sharp_drop_bonus
+            # Xác suất lơ lửng dưới ngưỡng hoặc vẫn còn năng lượng → đang ngập ngừng
+            hovering = sum(1 for p in self._silence_probs if p > self.speech_threshold * 0.4)
+            residual = (sum(self._silence_energy) / len(self._silence_energy)) / self.speech_energy \
+                if self.speech_energy > 0 and self._silence_energy else 0.0
+            if hovering * 2 >= len(self._silence_probs) or residual > c.residual_energy_ratio:
+                required += c.hesitation_penalty
+
+        if partial_text:
+            words = _WORD.findall(partial_text.lower())
+            if words and words[-1] in INCOMPLETE_ENDINGS:
+                required += c.incomplete_penalty
+            elif (words and words[-1] in COMPLETE_ENDINGS) or partial_text.rstrip()[-1:] in ".?!":
+                required -= c.complete_bonus
+
+        return max(c.min_silence_frames, min(c.max_silence_frames, required))
+
+    def update(self, prob: float, rms: float, partial_text: str = None) -> str:
+        if prob > self.speech_threshold:
+            self.speech_frames += 1
+            self.silence_run = 0
+            # Trung bình động năng lượng của phần có tiếng nói
+            self.speech_energy += (rms - self.speech_energy) / self.speech_frames
+            self._recent_probs.append(prob)
+            self._silence_probs = []
+            self._silence_energy = []
+            self._provisional_sent = False
+            return ENDPOINT_NONE
+
+        self.silence_run += 1
+        self._silence_probs.append(prob)
+        self._silence_energy.append(rms)
+        self.required_silence = self.required_silence_frames(partial_text)
+        if self.silence_run >= self.required_silence:
+            return ENDPOINT_FINAL
+        if not self._provisional_sent and self.silence_run >= self.config.provisional_frames:
+            self._provisional_sent = True
+            return ENDPOINT_PROVISIONAL
+        return ENDPOINT_NONE
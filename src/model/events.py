@@ -0,0 +1,40 @@
+"""
+Pipeline Events
+Sự kiện có kiểu của một lượt hội thoại, được phát ra ngay khi từng phần sẵn sàng (VoiceAssistantPipeline.process_stream,
+PipelineWorkerPool.events). Là namedtuple nên đi qua được process worker (pickle).
+"""
+from collections import namedtuple
+
+TranscriptPartial = namedtuple("TranscriptPartial", "text")   # transcript tạm của streaming STT (phía server)
+TranscriptFinal = namedtuple("TranscriptFinal", "text")       # transcript cuối cùng đưa vào LLM
+Emotion = namedtuple("Emotion", "code")                       # "00" / "01" / "10", trước khi LLM trả lời xong
+ResponseDelta = namedtuple("ResponseDelta", "text")           # một câu của câu trả lời, ngay trước audio của câu đó
+AudioChunk = namedtuple("AudioChunk", "pcm sample_rate")      # PCM16 mono của một đoạn TTS
+StageTiming = namedtuple("StageTiming", "stage value")        # thời gian (giây) hoặc RTF của một bước, cho metrics
+Done = namedtuple("Done", "input_text response_text emotion processing_time first_audio_time")
+Error = namedtuple("Error", "message")
+
+EVENT_TYPES = {
+    TranscriptPartial: "transcript_partial",
+    TranscriptFinal: "transcript_final",
+    Emotion: "emotion",
+    ResponseDelta: "response_delta",
+    AudioChunk: "audio_chunk",
+    StageTiming: "stage_timing",
+    Done: "done",
+    Error: "error",
+}
+
+# Sự kiện gửi cho client đăng ký nhận (ws://.../ws?events=1); audio đã đi bằng binary, timing chỉ dành cho metrics
+CLIENT_EVENTS = (TranscriptPartial, TranscriptFinal, Emotion, ResponseDelta, Done, Error)
+
+
+def event_type(event) -> str:
+    return EVENT_TYPES[type(event)]
+
+
+def to_client_message(event):
+    """Dict JSON gửi cho client, hoặc None nếu loại sự kiện này không được chuyển tiếp."""
+    if not isinstance(event, CLIENT_EVENTS):
+        return None
+    return {"type": event_type(event), **event._asdict()}
@@ -2,38 +2,118 @@ import os
 import json
 import time
 import re
+import threading
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple, Any
-import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import google.generativeai as genai
 from google.generativeai import types
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
 from settings import llm_settings as cfg
-from .emotion_manager import EmotionManager, EMOTION_NEUTRAL
+from .emotion_manager import EmotionManager, InlineEmotionTag, EMOTION_NEUTRAL
+from .session_manager import SessionManager
+from .rag_index import BM25Index, PersistentRAGIndex
+from .rag_vector import SentenceEmbedder, VectorIndex, reciprocal_rank_fusion
+
+
+SAFE_REPLY = "Xin lỗi, tớ đang bị mệt một chút. Cậu thử lại sau nhé."
+
+
+class SentenceSplitter:
+    """Cắt dòng token đang stream thành câu hoàn chỉnh theo dấu câu (. ! ? … ;)."""
+    _BOUNDARY = re.compile(r"[.!?…;]+[\"'”)]*(?=\s|$)")
+
+    def __init__(self, min_chars: int = None):
+        self.min_chars = cfg.STREAM_MIN_SENTENCE_CHARS if min_chars is None else min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in self._BOUNDARY.finditer(self._buffer):
+            end = match.end()
+            # Dấu câu ở cuối buffer có thể là "..." chưa xong, đợi thêm token
+            if end == len(self._buffer):
+                break
+            candidate = self._buffer[start:end].strip()
+            # Câu quá ngắn ("Dạ.") được gộp với câu sau để TTS không phải chạy nhiều đoạn vụn
+            if len(candidate) >= self.min_chars:
+                sentences.append(candidate)
+                start = end
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        rest = self._buffer.strip()
+        self._buffer = ""
+        return [rest] if rest else []
 
 
 class SimpleRAG:
-    # --- Class SimpleRAG giữ nguyên ---
+    """
+    Tìm chunk liên quan trong các file *.txt của `folder` bằng BM25 (chỉ mục trên đĩa nếu RAG_PERSIST_INDEX),
+    embedding hoặc cả hai theo RAG_BACKEND.
+    """
     def __init__(
         self,
         folder: str,
         chunk_size: int = None,
-        overlap: int = None
+        overlap: int = None,
+        index_dir: str = None
     ):
         self.folder = Path(folder)
         self.chunk_size = chunk_size or cfg.RAG_CHUNK_SIZE
         self.overlap = overlap or cfg.RAG_CHUNK_OVERLAP
         self.chunks: List[Tuple[str, str]] = []
+        self.index = BM25Index()
+        self.store = None
+        self.vector = None
+        if cfg.RAG_PERSIST_INDEX:
+            self.store = PersistentRAGIndex(index_dir or cfg.RAG_INDEX_DIR, self.folder, self.chunk_size, self.overlap)
         self._loaded = False
+        self._load_lock = threading.Lock()
 
-    def _tokenize(self, s: str) -> List[str]:
-        return re.findall(r"\w+", s.lower(), flags=re.UNICODE)
-
-    def _load(self):
+    def load(self):
         if self._loaded:
             return
+        # Nhiều pipeline worker có thể cùng gửi truy vấn đầu tiên
+        with self._load_lock:
+            if not self._loaded:
+                if self.store is not None:
+                    self._open_store()
+                else:
+                    if cfg.RAG_BACKEND != "bm25":
+                        print(f"  ⚠️  RAG_BACKEND={cfg.RAG_BACKEND} cần RAG_PERSIST_INDEX=1, dùng BM25")
+                    self._load_folder()
+
+    def _open_store(self):
+        t0 = time.perf_counter()
+        counts = self.store.open().update()
+        stats = self.store.stats()
+        print(f"  📚 RAG index: {stats['chunks']} chunks / {stats['files']} file / {stats['segments']} segment "
+              f"(+{counts['added']} ~{counts['changed']} -{counts['removed']}) trong {time.perf_counter() - t0:.2f}s")
+        if cfg.RAG_BACKEND in ("vector", "hybrid"):
+            self._open_vector()
+        self._loaded = True
+
+    def _open_vector(self):
+        try:
+            embedder = SentenceEmbedder()
+        except (ImportError, OSError) as e:
+            # Thiếu thư viện / model: vẫn trả lời được bằng BM25
+            print(f"  ⚠️  Không tải được model embedding ({e}), RAG dùng BM25")
+            return
+        t0 = time.perf_counter()
+        self.vector = VectorIndex(self.store, embedder)
+        embedded = self.vector.sync()
+        stats = self.vector.stats()
+        print(f"  🧭 RAG vector ({cfg.RAG_BACKEND}): {stats['vectors']} x {stats['dim']} {stats['dtype']}, "
+              f"embed {embedded} chunks mới trong {time.perf_counter() - t0:.2f}s")
+
+    def _load_folder(self):
         if not self.folder.exists():
             self.folder.mkdir(parents=True, exist_ok=True)
             self._loaded = True
@@ -51,47 +131,56 @@ class SimpleRAG:
                 doc_count += 1
             except Exception as e:
                 print(f"  ⚠️  Error loading {file_path}: {e}")
+        t0 = time.perf_counter()
+        self.index.build(chunk for _, chunk in self.chunks)
+        print(f"  📚 RAG: {len(self.chunks)} chunks từ {doc_count} file, "
+              f"index {len(self.index.postings)} token trong {time.perf_counter() - t0:.2f}s")
         self._loaded = True
 
     def search(self, query: str, top_k: int = None) -> List[Dict[str, any]]:
-        self._load()
-        if not self.chunks:
-            return []
+        self.load()
         top_k = top_k or cfg.RAG_TOP_K
-        q_tokens = set(self._tokenize(query))
-        scored = []
-        for src, chunk in self.chunks:
-            c_tokens = set(self._tokenize(chunk))
-            score = len(q_tokens & c_tokens)
-            if score > 0:
-                scored.append((score, src, chunk))
-        scored.sort(key=lambda t: t[0], reverse=True)
+        if self.vector is not None:
+            # Một snapshot cho cả truy vấn: id của BM25, vector và nội dung chunk cùng thuộc một bộ segment
+            snapshot = self.vector.snapshot
+            hits = [(score, *self.store.chunk(doc_id, snapshot.index))
+                    for score, doc_id in self._dense_search(query, top_k, snapshot)]
+        elif self.store is not None:
+            hits = self.store.search(query, top_k)
+        else:
+            hits = [(score, *self.chunks[doc_id]) for score, doc_id in self.index.search(query, top_k)]
         results = []
-        for score, src, chunk in scored[:top_k]:
+        for score, src, chunk in hits:
             results.append({
                 "source": Path(src).name,
-                "score": int(score),
+                "score": round(score, 3),
                 "text": chunk
             })
         return results
 
+    def _dense_search(self, query: str, top_k: int, snapshot) -> List[Tuple[float, int]]:
+        if cfg.RAG_BACKEND != "hybrid":
+            return self.vector.search_ids(query, top_k, snapshot)
+        candidates = max(top_k, cfg.RAG_HYBRID_CANDIDATES)
+        return reciprocal_rank_fusion([
+            self.store.search_ids(query, candidates, snapshot.index),
+            self.vector.search_ids(query, candidates, snapshot),
+        ], top_k)
+
 
 class ChatHistory:
-    # --- Class ChatHistory giữ nguyên ---
-    def __init__(self, history_dir: str = None):
+    """Context hội thoại theo từng thiết bị (SessionManager, có TTL + LRU) và log toàn bộ ra history.json."""
+    def __init__(self, history_dir: str = None, sessions: SessionManager = None):
         self.history_dir = Path(history_dir or cfg.HISTORY_DIR)
         self.history_dir.mkdir(parents=True, exist_ok=True)
         self.history_file = self.history_dir / "history.json"
-        self.memory: Dict[str, List[Dict]] = {}
+        self.sessions = sessions or SessionManager()
 
     def add(self, session_id: str, role: str, text: str, emotion_code: Optional[str] = None):
-        messages = self.memory.setdefault(session_id, [])
         new_message = {"role": role, "content": text, "timestamp": time.time()}
         if emotion_code:
             new_message["emotion"] = emotion_code
-        messages.append(new_message)
-        if len(messages) > cfg.MAX_HISTORY_TURNS * 2:
-            self.memory[session_id] = messages[-cfg.MAX_HISTORY_TURNS * 2:]
+        self.sessions.append(session_id, new_message)
         try:
             log_entry = {"session_id": session_id, **new_message}
             with open(self.history_file, "a", encoding="utf-8") as f:
@@ -100,7 +189,7 @@ class ChatHistory:
             print(f"⚠️  Failed to save history: {e}")
 
     def get_history(self, session_id: str) -> List[Dict]:
-        return self.memory.get(session_id, [])
+        return self.sessions.history(session_id)
 
 
 class LLMEngine:
@@ -111,6 +200,7 @@ class LLMEngine:
         self.history = ChatHistory()
         self._initialize_client()
         self.emotion_manager = EmotionManager(self.client)
+        self._prepare_pool = ThreadPoolExecutor(max_workers=cfg.PREPARE_WORKERS, thread_name_prefix="llm-prepare")
 
     def _initialize_client(self):
         api_key = cfg.GEMINI_API_KEY
@@ -138,18 +228,30 @@ class LLMEngine:
             out.append({'role': role, 'parts': [text]})
         return out
 
-    def chat(
-        self,
-        text: str,
-        session_id: str = "default",
-        use_rag: bool = True
-    ) -> Tuple[str, Dict[str, Any]]:
-        self.history.add(session_id, "user", text)
-        emotion_code, optimization_hint = asyncio.run(self.emotion_manager.analyze(text))
+    def _prepare_request(self, text: str, session_id: str, use_rag: bool, commit: bool = True):
+        """Ghi lượt user vào lịch sử (nếu commit), phân tích cảm xúc song song với tìm RAG và dựng nội dung gửi Gemini.
+        Trả về (contents_for_api, emotion_code, timings) với timings là thời gian (giây) từng bước.
+        emotion_code là None khi cảm xúc sẽ do chính câu trả lời mang theo (EMOTION_MODE="inline")."""
+        if commit:
+            self.history.add(session_id, "user", text)
+        timings = {}
+        rag_future = self._prepare_pool.submit(self._timed_rag_search, text) if use_rag else None
+
+        t0 = time.perf_counter()
+        emotion_code = self.emotion_manager.match_keywords(text)
+        if emotion_code is not None:
+            optimization_hint = self.emotion_manager.hint_for(emotion_code)
+        elif cfg.EMOTION_MODE == "inline":
+            optimization_hint = self.emotion_manager.inline_instructions()
+        else:
+            print("  ... No keywords matched, using LLM for emotion detection.")
+            emotion_code = self.emotion_manager.detect_by_llm(text)
+            optimization_hint = self.emotion_manager.hint_for(emotion_code)
+        timings["emotion"] = time.perf_counter() - t0
 
         rag_context = ""
-        if use_rag:
-            docs = self.rag.search(text)
+        if rag_future is not None:
+            docs, timings["rag"] = rag_future.result()
             if docs:
                 rag_context = self._format_rag_context(docs)
 
@@ -158,33 +260,53 @@ class LLMEngine:
         ).strip()
         
         history = self.history.get_history(session_id)
-        gemini_history = self._format_history_for_gemini(history[:-1])
-        
+        gemini_history = self._format_history_for_gemini(history[:-1] if commit else history)
+
+        contents_for_api = [
+            {'role': 'user', 'parts': [enhanced_prompt]},
+            {'role': 'model', 'parts': ["Dạ vâng ạ. Tớ đã hiểu rồi."]},
+        ] + gemini_history + [{'role': 'user', 'parts': [text]}]
+        return contents_for_api, emotion_code, timings
+
+    def _timed_rag_search(self, text: str):
+        t0 = time.perf_counter()
+        docs = self.rag.search(text)
+        return docs, time.perf_counter() - t0
+
+    def _generation_kwargs(self) -> Dict[str, Any]:
         generation_config = types.GenerationConfig(
             temperature=cfg.TEMPERATURE,
             max_output_tokens=cfg.MAX_OUTPUT_TOKENS,
             top_p=cfg.TOP_P,
             top_k=cfg.TOP_K,
         )
+        # [SỬA LỖI] Định nghĩa và truyền các cài đặt an toàn vào API
+        safety_settings = {
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+        return {"generation_config": generation_config, "safety_settings": safety_settings}
 
-        try:
-            contents_for_api = [
-                {'role': 'user', 'parts': [enhanced_prompt]},
-                {'role': 'model', 'parts': ["Dạ vâng ạ. Tớ đã hiểu rồi."]},
-            ] + gemini_history + [{'role': 'user', 'parts': [text]}]
-            
-            # [SỬA LỖI] Định nghĩa và truyền các cài đặt an toàn vào API
-            safety_settings = {
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-            }
+    def commit_turn(self, session_id: str, user_text: str, reply: str, emotion_code: Optional[str] = None):
+        """Ghi một lượt hội thoại đã sinh với commit=False (vd. sinh suy đoán) sau khi được xác nhận."""
+        self.history.add(session_id, "user", user_text)
+        self.history.add(session_id, "assistant", reply, emotion_code=emotion_code)
 
+    def chat(
+        self,
+        text: str,
+        session_id: str = "default",
+        use_rag: bool = True,
+        commit: bool = True
+    ) -> Tuple[str, Dict[str, Any]]:
+        contents_for_api, emotion_code, _ = self._prepare_request(text, session_id, use_rag, commit)
+
+        try:
             response = self.client.generate_content(
                 contents=contents_for_api,
-                generation_config=generation_config,
-                safety_settings=safety_settings  # Thêm tham số này vào
+                **self._generation_kwargs()
             )
 
             # [CẢI TIẾN] Kiểm tra kỹ hơn trước khi truy cập `response.text`
@@ -196,7 +318,12 @@ class LLMEngine:
                 raise ValueError(f"Response from Gemini was blocked. Finish reason: {finish_reason}")
 
             reply = response.text
-            self.history.add(session_id, "assistant", reply, emotion_code=emotion_code)
+            if emotion_code is None:
+                tag = InlineEmotionTag()
+                reply = (tag.feed(reply) + tag.flush()).strip()
+                emotion_code = tag.emotion_code
+            if commit:
+                self.history.add(session_id, "assistant", reply, emotion_code=emotion_code)
             
             result_json = {"user_chat": text, "bot_chat": reply, "emotion": emotion_code}
             return reply, result_json
@@ -205,8 +332,98 @@ class LLMEngine:
             # Khối `except` này bây giờ sẽ bắt được cả lỗi do bị chặn
             print(f"❌ LLM Error: {e}")
             
-            safe_msg = "Xin lỗi, tớ đang bị mệt một chút. Cậu thử lại sau nhé."
-            self.history.add(session_id, "assistant", safe_msg, emotion_code=EMOTION_NEUTRAL)
+            safe_msg = SAFE_REPLY
+            if commit:
+                self.history.add(session_id, "assistant", safe_msg, emotion_code=EMOTION_NEUTRAL)
             
             error_json = {"user_chat": text, "bot_chat": safe_msg, "emotion": EMOTION_NEUTRAL}
-            return safe_msg, error_json
\ No newline at end of file
+            return safe_msg, error_json
+
+    def chat_stream(
+        self,
+        text: str,
+        session_id: str = "default",
+        use_rag: bool = True,
+        commit: bool = True
+    ):
+        """
+        Streaming chat: gọi Gemini với stream=True và cắt câu theo dấu câu tiếng Việt.
+        Yield ("emotion", code) trước khi gọi API (hoặc ngay khi đọc được nhãn cảm xúc ở đầu câu trả lời với
+        EMOTION_MODE="inline"), sau đó ("sentence", câu) cho từng câu hoàn chỉnh,
+        cuối cùng ("done", result_json) khi đã ghi lịch sử.
+        Xen giữa là ("timing", {"stage": ..., "value": giây}) cho emotion, rag, llm_first_token, llm_total.
+        Với commit=False lịch sử không bị thay đổi; gọi commit_turn() khi muốn giữ lượt này.
+        """
+        contents_for_api, emotion_code, timings = self._prepare_request(text, session_id, use_rag, commit)
+        for stage, seconds in timings.items():
+            yield "timing", {"stage": stage, "value": seconds}
+        inline_tag = None
+        if emotion_code is None:
+            inline_tag = InlineEmotionTag()
+        else:
+            yield "emotion", emotion_code
+
+        splitter = SentenceSplitter()
+        reply_parts: List[str] = []
+        first_token = False
+        request_start = time.perf_counter()
+        try:
+            response = self.client.generate_content(
+                contents=contents_for_api,
+                stream=True,
+                **self._generation_kwargs()
+            )
+            for chunk in response:
+                if not chunk.parts:
+                    continue
+                if not first_token:
+                    first_token = True
+                    yield "timing", {"stage": "llm_first_token", "value": time.perf_counter() - request_start}
+                chunk_text = chunk.text
+                if inline_tag is not None and emotion_code is None:
+                    chunk_text = inline_tag.feed(chunk_text)
+                    if inline_tag.emotion_code is None:
+                        continue
+                    emotion_code = inline_tag.emotion_code
+                    yield "emotion", emotion_code
+                if not chunk_text:
+                    continue
+                reply_parts.append(chunk_text)
+                for sentence in splitter.feed(chunk_text):
+                    yield "sentence", sentence
+            if inline_tag is not None and emotion_code is None:
+                # Câu trả lời kết thúc trước khi đọc xong nhãn
+                rest = inline_tag.flush()
+                emotion_code = inline_tag.emotion_code
+                yield "emotion", emotion_code
+                if rest.strip():
+                    reply_parts.append(rest)
+                    for sentence in splitter.feed(rest):
+                        yield "sentence", sentence
+            if not reply_parts:
+                finish_reason = "UNKNOWN"
+                if hasattr(response, 'prompt_feedback') and response.prompt_feedback:
+                    finish_reason = response.prompt_feedback.block_reason.name
+                raise ValueError(f"Response from Gemini was blocked. Finish reason: {finish_reason}")
+            for sentence in splitter.flush():
+                yield "sentence", sentence
+            reply = "".join(reply_parts).strip()
+            yield "timing", {"stage": "llm_total", "value": time.perf_counter() - request_start}
+        except Exception as e:
+            print(f"❌ LLM Error: {e}")
+            if reply_parts:
+                # Đã gửi một phần câu trả lời, giữ phần đó làm phản hồi
+                for sentence in splitter.flush():
+                    yield "sentence", sentence
+                reply = "".join(reply_parts).strip()
+            else:
+                if emotion_code is None:
+                    # Lỗi trước khi đọc được nhãn cảm xúc (EMOTION_MODE="inline")
+                    yield "emotion", EMOTION_NEUTRAL
+                emotion_code = EMOTION_NEUTRAL
+                reply = SAFE_REPLY
+                yield "sentence", reply
+
+        if commit:
+            self.history.add(session_id, "assistant", reply, emotion_code=emotion_code)
+        yield "done", {"user_chat": text, "bot_chat": reply, "emotion": emotion_code}
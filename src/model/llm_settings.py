@@ -11,6 +11,24 @@ RAG_DIR = ROOT_DIR / "rag_docs"
 RAG_CHUNK_SIZE = 500
 RAG_CHUNK_OVERLAP = 50
 RAG_TOP_K = 3
+RAG_BM25_K1 = 1.2   # Độ bão hòa theo số lần token xuất hiện trong chunk
+RAG_BM25_B = 0.75   # Mức chuẩn hóa theo độ dài chunk
+# Chỉ mục lưu trên đĩa, cập nhật tăng dần theo mtime + sha1 của từng file (0 = xây lại trong bộ nhớ mỗi lần khởi động)
+RAG_PERSIST_INDEX = os.getenv("RAG_PERSIST_INDEX", "1") == "1"
+RAG_INDEX_DIR = Path(os.getenv("RAG_INDEX_DIR", str(ROOT_DIR / "rag_index")))
+RAG_INDEX_MAX_SEGMENTS = 8            # Nhiều segment hơn thì gộp lại
+RAG_INDEX_COMPACT_DEAD_RATIO = 0.25   # Tỉ lệ chunk đã tombstone (file bị sửa / xóa) để kích hoạt gộp
+# "bm25": khớp từ khóa; "vector": embedding (cần sentence-transformers + RAG_PERSIST_INDEX);
+# "hybrid": trộn thứ hạng BM25 và vector bằng Reciprocal Rank Fusion
+RAG_BACKEND = os.getenv("RAG_BACKEND", "bm25")
+RAG_EMBED_MODEL_DIR = Path(os.getenv("RAG_EMBED_MODEL_DIR", str(ROOT_DIR / "models" / "multilingual-e5-small")))
+RAG_EMBED_QUERY_PREFIX = "query: "      # Tiền tố theo cách huấn luyện của họ model E5; model khác thì để ""
+RAG_EMBED_PASSAGE_PREFIX = "passage: "
+RAG_EMBED_BATCH_SIZE = 32
+# "int8": nhỏ hơn 4 lần (RAM + đĩa) nhưng mỗi truy vấn chậm hơn ~2-3 lần do NumPy phải ép kiểu
+RAG_VECTOR_DTYPE = "float32"
+RAG_HYBRID_CANDIDATES = 20              # Số ứng viên mỗi bên trước khi trộn
+RAG_RRF_K = 60
 
 
 HISTORY_DIR = ROOT_DIR / "chat_history"
@@ -18,6 +36,14 @@ SUMMARY_DIR = HISTORY_DIR / "summaries" # [MỚI] Thư mục lưu trữ tóm t
 MAX_HISTORY_TURNS = 10  # Số lượt hội thoại gần nhất được giữ lại trong context
 SUMMARY_THRESHOLD = 20 # [MỚI] Ngưỡng để kích hoạt tóm tắt (20 lượt = 10 của user, 10 của bot)
 
+# ===== Session Manager =====
+# Mỗi thiết bị (device_id gửi lúc kết nối WebSocket) có lịch sử hội thoại riêng trong bộ nhớ.
+# Với PIPELINE_EXECUTOR="process" mỗi worker process giữ bảng phiên riêng của nó; PipelineWorkerPool luôn gửi
+# các lượt của cùng một session_id tới cùng một process nên lịch sử của một thiết bị không bị chia đôi.
+SESSION_TTL_SEC = int(os.getenv("SESSION_TTL_SEC", "1800"))      # Không nói gì quá lâu → bắt đầu hội thoại mới
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_MAX_MEMORY_BYTES = 32 * 1024 * 1024  # Tổng dung lượng lịch sử; vượt quá thì xóa phiên ít dùng nhất
+
 ROLE_PROMPT = (
     "QUY TẮC VÀNG: BẠN LÀ MỘT CẬU BÉ 6 TUỔI TÊN LÀ 'LISA', đang học lớp 1. Bạn rất tò mò, tốt bụng và hơi ngây ngô. Bạn đang nói chuyện với một người bạn thân cùng tuổi."
     "\n1. XƯNG HÔ: Luôn luôn xưng là 'Tớ' và gọi người bạn là 'Cậu'."
@@ -55,4 +81,21 @@ SUMMARY_PROMPT = (
 TEMPERATURE = 0.7
 MAX_OUTPUT_TOKENS = 1024
 TOP_P = 0.95
-TOP_K = 40
\ No newline at end of file
+TOP_K = 40
+
+# ===== Emotion Settings =====
+# "inline": khi không từ khóa nào khớp, chính request trả lời của Gemini ghi kèm nhãn cảm xúc ([HAPPY]/[SAD]/[NEUTRAL])
+#           ở đầu câu trả lời, không tốn thêm một lượt gọi API trước khi sinh câu trả lời.
+# "separate": gọi Gemini riêng để phân loại cảm xúc (chạy song song với RAG) rồi mới sinh câu trả lời.
+EMOTION_MODE = os.getenv("EMOTION_MODE", "inline")
+PREPARE_WORKERS = 4  # Thread tìm RAG song song với phân tích cảm xúc, dùng chung cho các pipeline worker
+
+# ===== Streaming Settings =====
+STREAM_RESPONSE = True          # Pipeline stream câu trả lời theo từng câu sang TTS
+STREAM_MIN_SENTENCE_CHARS = 12  # Câu ngắn hơn sẽ được gộp với câu sau
+
+# ===== Trace Replay =====
+# File .ptrace (hoặc thư mục trace) ghi bởi server với TRACE_CAPTURE=1: LLM được thay bằng câu trả lời đã ghi,
+# không gọi Gemini. Dùng cùng tools/replay_trace.py để đo VAD/STT/TTS trên lưu lượng thật.
+LLM_STUB_TRACE = os.getenv("LLM_STUB_TRACE", "")
+LLM_STUB_REPLAY_LATENCY = os.getenv("LLM_STUB_REPLAY_LATENCY", "1") == "1"  # Giữ nguyên độ trễ LLM đã ghi
@@ -0,0 +1,144 @@
+"""
+Metrics
+Counter / Gauge / Histogram tối giản, xuất ra định dạng text của Prometheus cho endpoint /metrics.
+"""
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+# Bucket mặc định (giây), phủ từ một frame VAD (~1 ms) đến một lượt pipeline dài
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Real-time factor: < 1 là tổng hợp nhanh hơn thời gian phát
+RTF_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Giá trị chỉ tăng."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self._value)}"]
+
+
+class Gauge:
+    """Giá trị tăng/giảm tự do, hoặc đọc từ `fn` tại thời điểm scrape (độ dài hàng đợi...)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, fn: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self._fn = fn
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = float(value)
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def samples(self) -> List[str]:
+        value = self._value
+        if self._fn is not None:
+            try:
+                value = float(self._fn())
+            except Exception:
+                value = math.nan
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Histogram:
+    """Phân bố giá trị theo bucket cộng dồn (le), kèm _sum và _count."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+            self._sum += value
+            self._count += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(total)}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Danh sách metric theo tên; render() trả về nội dung cho GET /metrics."""
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric đã tồn tại: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def gauge(self, name: str, documentation: str, fn: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, fn))
+
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+# Registry dùng chung của server
+REGISTRY = MetricsRegistry()
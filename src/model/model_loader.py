@@ -0,0 +1,196 @@
+"""
+Model Loader
+Tải mọi model từ thư mục local (không cần mạng), song song trên nhiều thread, rồi chạy warm-up trước khi báo sẵn sàng.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from settings import server_settings as cfg
+from settings import stt_settings as stt_cfg
+from modules.resources import apply_torch_threads, pin_current_thread, threads_for
+
+
+def load_vad_session(model_path=None):
+    """Silero VAD bản ONNX chạy bằng onnxruntime (1 thread, batch do BatchedVADService gom)."""
+    path = Path(model_path or cfg.VAD_MODEL_PATH)
+    if not path.exists():
+        if not cfg.ALLOW_MODEL_DOWNLOAD:
+            raise FileNotFoundError(
+                f"Không tìm thấy Silero VAD ONNX tại {path}. "
+                "Chép silero_vad.onnx vào đây hoặc đặt ALLOW_MODEL_DOWNLOAD=1"
+            )
+        import torch
+        print("  ⚠️  Tải Silero VAD qua torch.hub")
+        vad_model, _ = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False, onnx=True)
+        return vad_model.session
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads_for("vad")
+    options.inter_op_num_threads = 1
+    return onnxruntime.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def _load_stt():
+    from modules.stt import STTEngine
+    return STTEngine()
+
+
+def _load_streaming_stt():
+    from modules.stt_streaming import StreamingSTTEngine
+    return StreamingSTTEngine()
+
+
+def _load_tts():
+    from modules.tts import TTSEngine
+    return TTSEngine()
+
+
+def _load_llm():
+    from settings import llm_settings as llm_cfg
+    if llm_cfg.LLM_STUB_TRACE:
+        from modules.trace import TraceReplyLLM
+        return TraceReplyLLM(llm_cfg.LLM_STUB_TRACE, replay_latency=llm_cfg.LLM_STUB_REPLAY_LATENCY)
+    from modules.llm import LLMEngine
+    return LLMEngine()
+
+
+# Tên model → hàm tải; các model này độc lập với nhau
+_LOADERS = {
+    "vad": load_vad_session,
+    "streaming_stt": _load_streaming_stt,
+    "stt": _load_stt,
+    "tts": _load_tts,
+    "llm": _load_llm,
+}
+
+
+class ModelLoader:
+    """
+    Tải VAD, STT (offline/streaming), TTS và LLM độc lập với nhau nên chạy song song,
+    sau đó warm-up từng model bằng dữ liệu tổng hợp. `timings` giữ thời gian (giây) từng bước.
+    """
+    def __init__(self, load_pipeline: bool = True, load_vad: bool = True, streaming_stt: bool = None,
+                 warmup: bool = None, vad_frame_samples: int = 480):
+        self.load_pipeline = load_pipeline
+        self.load_vad = load_vad
+        self.use_streaming_stt = (stt_cfg.STT_MODE == "streaming") if streaming_stt is None else streaming_stt
+        self.warmup_enabled = cfg.WARMUP_ENABLED if warmup is None else warmup
+        self.vad_frame_samples = vad_frame_samples
+        self.timings = {}
+        self.models = {}
+        self.ready = False
+
+        self.vad_session = None
+        self.pipeline = None
+        self.streaming_stt = None
+
+    def _load_one(self, name: str):
+        # Pool thread của onnxruntime được tạo lúc tải model và kế thừa affinity của thread tải
+        if name != "llm":
+            pin_current_thread(name)
+        return self._timed(f"load_{name}", _LOADERS[name])
+
+    def _timed(self, name: str, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        self.timings[name] = time.perf_counter() - start
+        return result
+
+    def required_models(self) -> list:
+        names = []
+        if self.load_vad:
+            names.append("vad")
+        if self.use_streaming_stt:
+            names.append("streaming_stt")
+        if self.load_pipeline:
+            names += ["stt", "tts", "llm"]
+        return names
+
+    def _load_models(self, names):
+        names = [name for name in names if name not in self.models]
+        if not names:
+            return
+        workers = len(names) if cfg.MODEL_LOAD_PARALLEL else 1
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="model-load") as executor:
+            futures = {name: executor.submit(self._load_one, name) for name in names}
+            # result() raise lại lỗi của thread tải model tương ứng
+            for name, future in futures.items():
+                self.models[name] = future.result()
+
+    def preload(self, names) -> "ModelLoader":
+        """Chỉ tải các model trong `names`, không warm-up; load() sau đó dùng lại chúng.
+        Launcher dùng để tải trọng số nặng ở process cha trước khi fork worker."""
+        self._load_models([name for name in names if name in self.required_models()])
+        return self
+
+    def load(self) -> "ModelLoader":
+        start = time.perf_counter()
+        self._load_models(self.required_models())
+
+        self.vad_session = self.models.get("vad")
+        self.streaming_stt = self.models.get("streaming_stt")
+        if self.load_pipeline:
+            apply_torch_threads()
+            from modules.pipeline import VoiceAssistantPipeline
+            self.pipeline = VoiceAssistantPipeline(
+                stt_engine=self.models["stt"], llm_engine=self.models["llm"], tts_engine=self.models["tts"]
+            )
+        self.timings["load_total"] = time.perf_counter() - start
+
+        if self.warmup_enabled:
+            self.warmup()
+        self.timings["total"] = time.perf_counter() - start
+        self.ready = True
+        self.log_summary()
+        return self
+
+    def warmup(self):
+        """Một lượt suy luận giả cho mỗi model để lần gọi thật đầu tiên không phải trả chi phí khởi tạo."""
+        # Nhiễu nhỏ cố định (seed 0) thay vì im lặng tuyệt đối để STT/VAD đi hết đường tính toán
+        noise = np.random.default_rng(0).normal(0.0, 0.01, stt_cfg.SAMPLE_RATE).astype(np.float32)
+        pcm16 = (noise * 32767).astype(np.int16).tobytes()
+
+        if self.vad_session is not None:
+            self._timed("warmup_vad", self._warmup_vad, noise)
+        if self.streaming_stt is not None:
+            self._timed("warmup_streaming_stt", self._warmup_streaming_stt, pcm16)
+        if self.pipeline is not None:
+            self._timed("warmup_stt", self.pipeline.stt_engine.transcribe_pcm, noise, stt_cfg.SAMPLE_RATE)
+            self._timed("warmup_tts", self._warmup_tts)
+            rag = getattr(self.pipeline.llm_engine, "rag", None)
+            if rag is not None:
+                # Mở chỉ mục RAG (và cập nhật file thay đổi) trước truy vấn đầu tiên
+                self._timed("warmup_rag", rag.load)
+
+    def _warmup_vad(self, noise: np.ndarray):
+        from modules.vad_service import SileroBatchRunner
+        runner = SileroBatchRunner(self.vad_session, stt_cfg.SAMPLE_RATE)
+        frame = noise[:self.vad_frame_samples]
+        # Batch 1 và batch lớn để onnxruntime cấp phát sẵn buffer cho cả hai trường hợp
+        for batch in (1, min(8, cfg.VAD_MAX_BATCH)):
+            runner.run(np.tile(frame, (batch, 1)), [runner.new_state() for _ in range(batch)])
+
+    def _warmup_streaming_stt(self, pcm16: bytes):
+        session = self.streaming_stt.create_session()
+        session.feed(pcm16)
+        session.finish().result(timeout=60)
+
+    def _warmup_tts(self):
+        # Cũng nạp sẵn prompt của giọng mặc định vào cache
+        for _ in self.pipeline.tts_engine.synthesize_stream(cfg.WARMUP_TTS_TEXT):
+            pass
+
+    def log_summary(self):
+        print("\n" + "=" * 60)
+        print("⏱️  Thời gian khởi động model")
+        for name, seconds in self.timings.items():
+            print(f"  {name:<24} {seconds:8.2f}s")
+        print("=" * 60 + "\n")
+
+
+def load_pipeline():
+    """Pipeline đã warm-up cho process worker của PipelineWorkerPool (không cần VAD)."""
+    return ModelLoader(load_pipeline=True, load_vad=False, streaming_stt=False).load().pipeline
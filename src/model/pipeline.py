@@ -1,6 +1,8 @@
 import time
 import sys
 import json
+import queue
+import threading
 from pathlib import Path
 from typing import Optional
 
@@ -11,33 +13,81 @@ sys.path.append(str(ROOT_DIR))
 from modules.stt import STTEngine
 from modules.tts import TTSEngine
 from modules.llm import LLMEngine
+from modules.events import (
+    TranscriptFinal, Emotion, ResponseDelta, AudioChunk, StageTiming, Done, Error,
+)
+from settings import llm_settings as llm_cfg
+from settings import tts_settings as tts_cfg
 
 class VoiceAssistantPipeline:
-    def __init__(self):
+    def __init__(self, stt_engine: STTEngine = None, llm_engine: LLMEngine = None, tts_engine: TTSEngine = None):
+        """Các engine có thể được tải sẵn (song song) bởi modules.model_loader và truyền vào."""
         print("\n" + "="*60)
         print("🚀 Khởi tạo Voice Assistant Pipeline")
         print("="*60 + "\n")
         
-        self.stt_engine = STTEngine()
-        self.llm_engine = LLMEngine()
-        self.tts_engine = TTSEngine()
+        self.stt_engine = stt_engine or STTEngine()
+        self.llm_engine = llm_engine or LLMEngine()
+        self.tts_engine = tts_engine or TTSEngine()
         
         print("\n" + "="*60)
         print("✅ Pipeline đã sẵn sàng!")
         print("="*60 + "\n")
     
-    def process(self, audio_input_path: str, session_id: str = "default") -> dict:
+    def _synthesize_timed(self, text: str):
+        """TTS một câu: yield AudioChunk kèm StageTiming cho từng đoạn và real-time factor của cả câu."""
+        synth_seconds = 0.0
+        audio_bytes = 0
+        chunk_start = time.perf_counter()
+        for pcm in self.tts_engine.synthesize_stream(text):
+            chunk_seconds = time.perf_counter() - chunk_start
+            synth_seconds += chunk_seconds
+            audio_bytes += len(pcm)
+            yield StageTiming("tts_chunk", chunk_seconds)
+            yield AudioChunk(pcm, tts_cfg.OUTPUT_SAMPLE_RATE)
+            chunk_start = time.perf_counter()
+        audio_seconds = audio_bytes / 2 / tts_cfg.OUTPUT_SAMPLE_RATE
+        if audio_seconds > 0:
+            yield StageTiming("tts_rtf", synth_seconds / audio_seconds)
+
+    def _transcribe(self, audio_input_path, audio_pcm, sample_rate: int, input_text: Optional[str] = None) -> str:
+        if input_text is not None:
+            # Transcript đã có sẵn từ streaming STT phía server
+            print(f"📍 BƯỚC 1: Bỏ qua STT, dùng transcript streaming: {input_text}\n")
+            return input_text
+        print("📍 BƯỚC 1: Speech to Text (dùng GPU)")
+        print("-" * 60)
+        if audio_pcm is not None:
+            input_text = self.stt_engine.transcribe(audio_pcm, sample_rate=sample_rate)
+        else:
+            input_text = self.stt_engine.transcribe(audio_input_path)
+        print(f"✓ Chuyển đổi thành văn bản: {input_text}\n")
+        return input_text
+
+    def process(
+        self,
+        audio_input_path: Optional[str] = None,
+        session_id: str = "default",
+        audio_pcm=None,
+        sample_rate: int = 16000,
+        input_text: Optional[str] = None
+    ) -> dict:
+        """Chạy pipeline từ file WAV, PCM16 bytes / mảng NumPy (`audio_pcm`) hoặc transcript có sẵn (`input_text`)."""
+        if audio_pcm is None and not audio_input_path and input_text is None:
+            raise ValueError("Cần truyền audio_input_path, audio_pcm hoặc input_text")
         start_time = time.time()
         
         print("\n" + "🔄 " + "="*58)
-        print(f"BẮT ĐẦU PIPELINE VỚI FILE AUDIO: {audio_input_path}")
+        if input_text is not None:
+            print(f"BẮT ĐẦU PIPELINE VỚI TRANSCRIPT: {input_text}")
+        elif audio_pcm is not None:
+            print(f"BẮT ĐẦU PIPELINE VỚI AUDIO TRONG BỘ NHỚ: {len(audio_pcm)} phần tử @ {sample_rate} Hz")
+        else:
+            print(f"BẮT ĐẦU PIPELINE VỚI FILE AUDIO: {audio_input_path}")
         print("="*60 + "\n")
         
         # Step 1: STT
-        print("📍 BƯỚC 1: Speech to Text (dùng GPU)")
-        print("-" * 60)
-        input_text = self.stt_engine.transcribe(audio_input_path)
-        print(f"✓ Chuyển đổi thành văn bản: {input_text}\n")
+        input_text = self._transcribe(audio_input_path, audio_pcm, sample_rate, input_text)
         
         # Step 2: LLM
         print("📍 BƯỚC 2: Xử lý ngôn ngữ (API) & Phân tích cảm xúc")
@@ -61,11 +111,138 @@ class VoiceAssistantPipeline:
         return {
             "input_text": input_text,                  # Đoạn văn bản đầu vào từ STT
             "response_text": response_text,            # Đoạn văn bản phản hồi từ LLM   
-            "output_audio": output_audio_path,         # Đường dẫn file âm thanh đầu ra từ TTS
+            "output_audio": output_audio_path,         # File âm thanh riêng của job này, người gọi xóa sau khi dùng
             "processing_time": processing_time,        # Thời gian xử lý tổng cộng
             "emotion_details": emotion_details         # Chi tiết phân tích cảm xúc
         }
 
+    def _llm_producer(self, input_text: str, session_id: str, out_queue: queue.Queue, stop_event: threading.Event,
+                      commit_history: bool = True):
+        """Chạy trên thread riêng: đẩy từng câu của LLM vào hàng đợi trong khi TTS đang đọc câu trước."""
+        try:
+            for item in self.llm_engine.chat_stream(input_text, session_id=session_id, commit=commit_history):
+                if stop_event.is_set():
+                    # Lượt này đã bị hủy (barge-in), bỏ phần còn lại của câu trả lời
+                    break
+                out_queue.put(item)
+        except Exception as e:
+            out_queue.put(("error", e))
+        finally:
+            out_queue.put(None)
+
+    def process_stream(
+        self,
+        audio_input_path: Optional[str] = None,
+        session_id: str = "default",
+        audio_pcm=None,
+        sample_rate: int = 16000,
+        input_text: Optional[str] = None,
+        commit_history: bool = True,
+        tts_sentences: Optional[int] = None
+    ):
+        """
+        Giống process() nhưng là generator các sự kiện có kiểu (modules.events), mỗi sự kiện phát ra ngay khi có:
+          TranscriptFinal – văn bản STT (hoặc transcript streaming truyền vào)
+          Emotion         – mã cảm xúc, trước khi LLM trả lời để robot đổi biểu cảm sớm
+          ResponseDelta   – từng câu của LLM, ngay trước audio của câu đó
+          AudioChunk      – PCM16 mono tts_settings.OUTPUT_SAMPLE_RATE của từng đoạn TTS
+          StageTiming     – thời gian (giây) của stt, emotion, rag, llm_first_token, llm_total, tts_chunk
+                            và real-time factor tts_rtf, để server ghi metrics
+          Done            – câu trả lời đầy đủ và thời gian xử lý
+          Error           – lỗi trong lượt này (sự kiện cuối cùng)
+        Với llm_settings.STREAM_RESPONSE, LLM và TTS chạy chồng lên nhau theo từng câu.
+        commit_history=False dùng cho sinh suy đoán: lịch sử hội thoại chỉ được ghi khi gọi commit_turn().
+        tts_sentences=N chỉ tổng hợp N câu đầu, các câu sau chỉ có ResponseDelta (sinh suy đoán: phần còn lại
+        được đọc bằng speak() sau khi xác nhận, không tốn TTS cho câu trả lời có thể bị bỏ).
+        """
+        if audio_pcm is None and not audio_input_path and input_text is None:
+            raise ValueError("Cần truyền audio_input_path, audio_pcm hoặc input_text")
+        try:
+            yield from self._process_events(audio_input_path, session_id, audio_pcm, sample_rate, input_text,
+                                            commit_history, tts_sentences)
+        except Exception as e:
+            print(f"❌ Pipeline error: {e!r}")
+            yield Error(repr(e))
+
+    def _process_events(self, audio_input_path, session_id, audio_pcm, sample_rate, input_text, commit_history,
+                        tts_sentences=None):
+        start_time = time.time()
+        synthesized = 0
+
+        if input_text is None:
+            stt_start = time.perf_counter()
+            input_text = self._transcribe(audio_input_path, audio_pcm, sample_rate)
+            yield StageTiming("stt", time.perf_counter() - stt_start)
+        else:
+            input_text = self._transcribe(audio_input_path, audio_pcm, sample_rate, input_text)
+        yield TranscriptFinal(input_text)
+        first_audio_time = None
+
+        if llm_cfg.STREAM_RESPONSE:
+            sentences: queue.Queue = queue.Queue()
+            stop_event = threading.Event()
+            producer = threading.Thread(
+                target=self._llm_producer, args=(input_text, session_id, sentences, stop_event, commit_history),
+                daemon=True
+            )
+            producer.start()
+            response_text, emotion_code = "", None
+            try:
+                while True:
+                    item = sentences.get()
+                    if item is None:
+                        break
+                    kind, payload = item
+                    if kind == "emotion":
+                        emotion_code = payload
+                        yield Emotion(payload)
+                    elif kind == "sentence":
+                        print(f"✓ Câu từ LLM: {payload}")
+                        yield ResponseDelta(payload)
+                        if tts_sentences is not None and synthesized >= tts_sentences:
+                            continue
+                        synthesized += 1
+                        for event in self._synthesize_timed(payload):
+                            if first_audio_time is None and isinstance(event, AudioChunk):
+                                first_audio_time = time.time() - start_time
+                            yield event
+                    elif kind == "timing":
+                        yield StageTiming(payload["stage"], payload["value"])
+                    elif kind == "done":
+                        response_text, emotion_code = payload["bot_chat"], payload["emotion"]
+                    elif kind == "error":
+                        raise payload
+            finally:
+                # Generator bị đóng sớm (barge-in) hoặc lỗi → báo thread LLM dừng
+                stop_event.set()
+        else:
+            llm_start = time.perf_counter()
+            response_text, emotion_details = self.llm_engine.chat(
+                input_text, session_id=session_id, commit=commit_history
+            )
+            emotion_code = emotion_details.get("emotion")
+            yield StageTiming("llm_total", time.perf_counter() - llm_start)
+            print(f"✓ Phản hồi từ LLM: {response_text}")
+            yield Emotion(emotion_code)
+            yield ResponseDelta(response_text)
+            if tts_sentences is None or tts_sentences > 0:
+                for event in self._synthesize_timed(response_text):
+                    if first_audio_time is None and isinstance(event, AudioChunk):
+                        first_audio_time = time.time() - start_time
+                    yield event
+
+        processing_time = time.time() - start_time
+        print(f"✅ PIPELINE STREAM HOÀN TẤT trong {processing_time:.2f} giây (audio đầu tiên sau {first_audio_time or 0:.2f} giây)")
+        yield Done(input_text, response_text, emotion_code, processing_time, first_audio_time)
+
+    def speak(self, text: str):
+        """Generator AudioChunk / StageTiming của một câu, cho các câu process_stream(tts_sentences=N) chưa đọc."""
+        yield from self._synthesize_timed(text)
+
+    def commit_turn(self, session_id: str, input_text: str, response_text: str, emotion_code: Optional[str] = None):
+        """Ghi vào lịch sử một lượt đã chạy với commit_history=False."""
+        self.llm_engine.commit_turn(session_id, input_text, response_text, emotion_code)
+
 # === [PHẦN ĐÃ SỬA] Thêm điểm khởi đầu để chạy file độc lập ===
 if __name__ == '__main__':
     # Thư viện để đọc tham số từ dòng lệnh
@@ -0,0 +1,559 @@
+"""
+RAG Index
+Chỉ mục đảo (token → posting list) chấm điểm BM25 cho SimpleRAG.
+
+BM25Index: xây trong bộ nhớ một lần khi nạp tài liệu, mỗi posting lưu sẵn trọng số BM25.
+PersistentRAGIndex: cùng cách chấm điểm nhưng lưu trên đĩa theo segment (postings .npy mở bằng mmap, chunk là
+offset byte trong file nguồn), cập nhật tăng dần theo mtime + sha1 của từng file nên khởi động chỉ cần mở chỉ mục.
+
+Một truy vấn chỉ cộng posting của các token trong câu hỏi rồi lấy top-k bằng heap; chi phí theo độ dài posting,
+không theo số chunk.
+"""
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from settings import llm_settings as cfg
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: không có flock, chỉ một process được cập nhật chỉ mục
+    fcntl = None
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+INDEX_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = ".lock"
+_SEGMENT_ARRAYS = ("offsets", "doc_ids", "tfs", "lengths", "chunks")
+
+# Trạng thái đã mở của PersistentRAGIndex, thay bằng một phép gán duy nhất: một truy vấn chỉ đọc từ một snapshot
+# nên không bao giờ trộn segment mới với dead_ids / số chunk cũ
+IndexSnapshot = namedtuple("IndexSnapshot", "segments dead_ids num_live total_chunks")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+def _collect_postings(texts: Iterable[str]):
+    """token → ([chunk id], [tf]) và số token của từng chunk."""
+    term_docs: Dict[str, Tuple[List[int], List[int]]] = {}
+    lengths = []
+    for doc_id, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        lengths.append(sum(counts.values()))
+        for token, tf in counts.items():
+            ids, tfs = term_docs.setdefault(token, ([], []))
+            ids.append(doc_id)
+            tfs.append(tf)
+    return term_docs, lengths
+
+
+def _idf(num_docs: int, df: int) -> float:
+    return math.log(1.0 + (num_docs - df + 0.5) / (df + 0.5))
+
+
+def _top_k(candidates: np.ndarray, scores: np.ndarray, top_k: int) -> List[Tuple[float, int]]:
+    if len(candidates) > top_k:
+        # Token phổ biến cho hàng nghìn ứng viên: argpartition lọc còn top_k trước khi đưa vào heap
+        keep = np.argpartition(scores, len(scores) - top_k)[-top_k:]
+        candidates, scores = candidates[keep], scores[keep]
+    return heapq.nlargest(top_k, zip(scores.tolist(), candidates.tolist()), key=lambda item: item[0])
+
+
+class BM25Index:
+    """
+    postings[token] = (doc_ids int32 tăng dần, weights float32) với
+    weight = idf · tf·(k1+1) / (tf + k1·(1 − b + b·dl/avgdl)); idf thấp nên từ phổ biến ("là", "và") ít ảnh hưởng.
+    """
+    def __init__(self, k1: float = None, b: float = None):
+        self.k1 = cfg.RAG_BM25_K1 if k1 is None else k1
+        self.b = cfg.RAG_BM25_B if b is None else b
+        self.num_docs = 0
+        self.doc_freq: Dict[str, int] = {}
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def build(self, texts: Iterable[str]) -> "BM25Index":
+        term_docs, lengths = _collect_postings(texts)
+        self.num_docs = len(lengths)
+        self.doc_freq = {}
+        self.postings = {}
+        if not self.num_docs:
+            return self
+        lengths = np.asarray(lengths, dtype=np.float32)
+        avg_length = max(float(lengths.mean()), 1.0)
+        length_norm = self.k1 * (1.0 - self.b + self.b * lengths / avg_length)
+        for token, (ids, tfs) in term_docs.items():
+            ids = np.asarray(ids, dtype=np.int32)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            df = len(ids)
+            weights = _idf(self.num_docs, df) * tfs * (self.k1 + 1.0) / (tfs + length_norm[ids])
+            self.doc_freq[token] = df
+            self.postings[token] = (ids, weights.astype(np.float32))
+        return self
+
+    def search(self, query: str, top_k: int) -> List[Tuple[float, int]]:
+        """[(điểm, doc_id)] giảm dần theo điểm; chỉ chunk chứa ít nhất một token của câu hỏi."""
+        postings = [self.postings[token] for token in set(tokenize(query)) if token in self.postings]
+        if not postings or top_k <= 0:
+            return []
+        if len(postings) == 1:
+            candidates, scores = postings[0]
+        else:
+            # Mỗi doc_id chỉ xuất hiện một lần trong một posting nên cộng theo chỉ số là đủ
+            accumulator = np.zeros(self.num_docs, dtype=np.float32)
+            for ids, weights in postings:
+                accumulator[ids] += weights
+            candidates = np.flatnonzero(accumulator)
+            scores = accumulator[candidates]
+        return _top_k(candidates, scores, top_k)
+
+
+def chunk_spans(text: str, chunk_size: int, overlap: int):
+    """Yield (chunk, byte_start, byte_end) theo cùng cách cắt của SimpleRAG, offset tính trên UTF-8."""
+    step = max(1, chunk_size - overlap)
+    byte_pos = 0
+    prev = 0
+    for i in range(0, len(text), step):
+        byte_pos += len(text[prev:i].encode("utf-8"))
+        prev = i
+        chunk = text[i:i + chunk_size]
+        yield chunk, byte_pos, byte_pos + len(chunk.encode("utf-8"))
+
+
+class Segment:
+    """
+    Một segment bất biến trên đĩa. Posting của token thứ t là doc_ids/tfs[offsets[t]:offsets[t+1]];
+    chunks[i] = (file cục bộ, byte đầu, byte cuối). File bị xóa / thay đổi chỉ được đánh dấu "dead" (tombstone)
+    trong manifest cho đến lần compaction sau. `extras` là các mảng khác theo hàng chunk (vd. embedding của
+    rag_vector), được mang theo khi gộp segment.
+    """
+    def __init__(self, folder: Path, meta: dict):
+        self.name = meta["name"]
+        self.files: List[str] = meta["files"]
+        self.dead = set(meta.get("dead", []))
+        with open(folder / f"{self.name}.vocab.json", "r", encoding="utf-8") as f:
+            self.vocab = {token: term for term, token in enumerate(json.load(f))}
+        arrays = {key: np.load(folder / f"{self.name}.{key}.npy", mmap_mode="r") for key in _SEGMENT_ARRAYS}
+        self.offsets, self.doc_ids, self.tfs = arrays["offsets"], arrays["doc_ids"], arrays["tfs"]
+        self.lengths, self.chunks = arrays["lengths"], arrays["chunks"]
+        self.extras = {key: np.load(folder / f"{self.name}.{key}.npy", mmap_mode="r")
+                       for key in meta.get("extras", [])}
+        self.live = np.ones(len(self.chunks), dtype=bool)
+        if self.dead and len(self.chunks):
+            self.live = ~np.isin(self.chunks[:, 0], sorted(self.dead))
+        self.base = 0
+        self.length_norm = None
+
+    def posting(self, token: str):
+        term = self.vocab.get(token)
+        if term is None:
+            return None
+        start, end = int(self.offsets[term]), int(self.offsets[term + 1])
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    @staticmethod
+    def write(folder: Path, name: str, files: List[str], chunks: np.ndarray, lengths: np.ndarray,
+              term_docs: Dict[str, List[Tuple[np.ndarray, np.ndarray]]], extras: Dict[str, np.ndarray] = None):
+        """Ghi segment mới; term_docs[token] là các mảnh (ids, tfs) theo thứ tự id tăng dần."""
+        vocab = sorted(term_docs)
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_ids, tfs = [], []
+        for term, token in enumerate(vocab):
+            parts = term_docs[token]
+            doc_ids += [ids for ids, _ in parts]
+            tfs += [counts for _, counts in parts]
+            offsets[term + 1] = offsets[term] + sum(len(ids) for ids, _ in parts)
+        arrays = {
+            "offsets": offsets,
+            "doc_ids": np.concatenate(doc_ids).astype(np.int32) if doc_ids else np.zeros(0, dtype=np.int32),
+            # tf > 65535 trong một chunk 500 ký tự là không thể, uint16 đủ và nhẹ hơn một nửa
+            "tfs": np.concatenate(tfs).astype(np.uint16) if tfs else np.zeros(0, dtype=np.uint16),
+            "lengths": np.asarray(lengths, dtype=np.int32),
+            "chunks": np.asarray(chunks, dtype=np.int64).reshape(-1, 3),
+        }
+        for key, array in {**arrays, **(extras or {})}.items():
+            np.save(folder / f"{name}.{key}.npy", array)
+        with open(folder / f"{name}.vocab.json", "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        file_chunks = np.bincount(arrays["chunks"][:, 0], minlength=len(files)) if len(files) else []
+        return {"name": name, "files": files, "file_chunks": [int(n) for n in file_chunks], "dead": [],
+                "num_chunks": len(arrays["lengths"]), "extras": sorted(extras or {})}
+
+
+class PersistentRAGIndex:
+    """
+    Chỉ mục BM25 lưu ở `index_dir` cho các file *.txt trong `docs_dir`:
+      manifest.json          – tham số chunk, danh sách segment, mtime/size/sha1 và segment chứa từng file
+      <segment>.*.npy        – offsets / doc_ids / tfs / lengths / chunks (mmap khi mở)
+      <segment>.vocab.json   – token theo thứ tự term id
+    update() chỉ đọc lại file có mtime/size khác và hash khác, đưa chúng vào một segment mới; bản cũ bị tombstone.
+    Khi quá nhiều segment hoặc quá nhiều chunk chết, các segment được gộp lại từ postings (không tách token lại).
+    idf dùng df cộng trên mọi segment, kể cả chunk đã tombstone, cho đến lần compaction kế tiếp.
+    Nhiều process (worker của launcher / pool "process") có thể dùng chung một index_dir: mọi thay đổi chạy dưới
+    flock độc quyền trên index_dir/.lock và đọc lại manifest trước khi sửa, open() giữ khóa chia sẻ.
+    """
+    def __init__(self, index_dir, docs_dir, chunk_size: int = None, overlap: int = None,
+                 k1: float = None, b: float = None):
+        self.index_dir = Path(index_dir)
+        self.docs_dir = Path(docs_dir)
+        self.chunk_size = chunk_size or cfg.RAG_CHUNK_SIZE
+        self.overlap = overlap or cfg.RAG_CHUNK_OVERLAP
+        self.k1 = cfg.RAG_BM25_K1 if k1 is None else k1
+        self.b = cfg.RAG_BM25_B if b is None else b
+        self.manifest = self._empty_manifest()
+        self._snapshot = IndexSnapshot((), np.zeros(0, dtype=np.int64), 0, 0)
+
+    # ----- manifest -----
+    def _empty_manifest(self) -> dict:
+        return {"version": INDEX_VERSION, "chunk_size": self.chunk_size, "overlap": self.overlap,
+                "next_segment": 0, "segments": [], "files": {}}
+
+    def _read_manifest(self) -> dict:
+        path = self.index_dir / MANIFEST_NAME
+        if not path.exists():
+            return self._empty_manifest()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  ⚠️  RAG index manifest hỏng ({e}), xây lại chỉ mục")
+            return self._empty_manifest()
+        if (manifest.get("version") != INDEX_VERSION or manifest.get("chunk_size") != self.chunk_size
+                or manifest.get("overlap") != self.overlap):
+            print("  ⚠️  RAG index khác phiên bản / tham số chunk, xây lại chỉ mục")
+            return self._empty_manifest()
+        return manifest
+
+    @contextmanager
+    def _locked(self, exclusive: bool = True):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(self.index_dir / LOCK_NAME, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_manifest(self):
+        # Ghi file tạm rồi os.replace: tiến trình dừng giữa chừng vẫn để lại manifest cũ còn nguyên vẹn
+        tmp_path = self.index_dir / (MANIFEST_NAME + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_dir / MANIFEST_NAME)
+
+    # ----- mở chỉ mục -----
+    def open(self) -> "PersistentRAGIndex":
+        """Chỉ đọc manifest và mmap các segment, không đụng tới tài liệu."""
+        # Khóa chia sẻ: process khác không thể xóa segment giữa lúc đọc manifest và mmap
+        with self._locked(exclusive=False):
+            self._reload()
+        return self
+
+    def _reload(self):
+        self.manifest = self._read_manifest()
+        try:
+            self._open_segments()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"  ⚠️  Không mở được segment RAG ({e}), xây lại chỉ mục")
+            self.manifest = self._empty_manifest()
+            self._open_segments()
+
+    def _open_segments(self):
+        segments = tuple(Segment(self.index_dir, meta) for meta in self.manifest["segments"])
+        base = 0
+        live_lengths, dead_ids = [], []
+        for segment in segments:
+            segment.base = base
+            live_lengths.append(segment.lengths[segment.live])
+            dead_ids.append(np.flatnonzero(~segment.live) + base)
+            base += len(segment.chunks)
+        live_lengths = np.concatenate(live_lengths) if live_lengths else np.zeros(0, dtype=np.int32)
+        avg_length = max(float(live_lengths.mean()), 1.0) if len(live_lengths) else 1.0
+        for segment in segments:
+            segment.length_norm = (self.k1 * (1.0 - self.b + self.b * np.asarray(segment.lengths, dtype=np.float32)
+                                              / avg_length)).astype(np.float32)
+        # Truy vấn đang chạy vẫn dùng trọn snapshot cũ
+        self._snapshot = IndexSnapshot(
+            segments=segments,
+            dead_ids=np.concatenate(dead_ids) if dead_ids else np.zeros(0, dtype=np.int64),
+            num_live=len(live_lengths),
+            total_chunks=base,
+        )
+
+    # ----- cập nhật tăng dần -----
+    def update(self, compact: bool = None) -> dict:
+        """
+        Đồng bộ chỉ mục với docs_dir. Trả về số file added / changed / removed / unchanged.
+        compact=None: gộp segment khi vượt RAG_INDEX_MAX_SEGMENTS hoặc RAG_INDEX_COMPACT_DEAD_RATIO.
+        """
+        with self._locked():
+            # Process khác có thể đã cập nhật chỉ mục kể từ lần open(): luôn sửa trên manifest mới nhất
+            self._reload()
+            return self._update(compact)
+
+    def _update(self, compact: bool = None) -> dict:
+        self.docs_dir.mkdir(parents=True, exist_ok=True)
+        files = self.manifest["files"]
+        segments = {meta["name"]: meta for meta in self.manifest["segments"]}
+        counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+        dirty = False
+        pending = []
+
+        current = {path.relative_to(self.docs_dir).as_posix(): path for path in sorted(self.docs_dir.rglob("*.txt"))}
+        for rel, path in current.items():
+            stat = path.stat()
+            entry = files.get(rel)
+            if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                counts["unchanged"] += 1
+                continue
+            try:
+                data = path.read_bytes()
+            except OSError as e:
+                print(f"  ⚠️  Error loading {path}: {e}")
+                continue
+            digest = hashlib.sha1(data).hexdigest()
+            if entry and entry["sha1"] == digest:
+                # Chỉ đổi mtime (copy lại, touch): giữ nguyên chunk đã index
+                entry["mtime_ns"] = stat.st_mtime_ns
+                counts["unchanged"] += 1
+                dirty = True
+                continue
+            if entry:
+                self._tombstone(segments, rel, entry)
+                counts["changed"] += 1
+            else:
+                counts["added"] += 1
+            pending.append((rel, data, {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": digest}))
+
+        for rel in sorted(set(files) - set(current)):
+            self._tombstone(segments, rel, files.pop(rel))
+            counts["removed"] += 1
+            dirty = True
+
+        # Segment mà mọi file đều đã chết thì bỏ luôn, không cần gộp
+        alive = [meta for meta in self.manifest["segments"] if len(meta["dead"]) < len(meta["files"])]
+        if len(alive) < len(self.manifest["segments"]):
+            self.manifest["segments"] = alive
+            dirty = True
+        # Gộp các segment cũ trước khi thêm segment mới, để extra đã có (embedding) được mang theo nguyên vẹn
+        if compact or (compact is None and self._needs_compaction(new_segments=1 if pending else 0)):
+            self._compact()
+            dirty = True
+        if pending:
+            self._add_segment(pending)
+            dirty = True
+        if dirty:
+            self._write_manifest()
+            self._open_segments()
+            self._remove_orphans()
+        return counts
+
+    def _tombstone(self, segments: dict, rel: str, entry: dict):
+        meta = segments[entry["segment"]]
+        local = meta["files"].index(rel)
+        if local not in meta["dead"]:
+            meta["dead"].append(local)
+
+    def _new_segment_name(self) -> str:
+        name = f"seg_{self.manifest['next_segment']:06d}"
+        self.manifest["next_segment"] += 1
+        return name
+
+    def _add_segment(self, pending: list):
+        name = self._new_segment_name()
+        rel_files, texts, chunks = [], [], []
+        for local, (rel, data, _) in enumerate(pending):
+            rel_files.append(rel)
+            text = data.decode("utf-8", errors="replace")
+            for chunk, start, end in chunk_spans(text, self.chunk_size, self.overlap):
+                texts.append(chunk)
+                chunks.append((local, start, end))
+        term_docs, lengths = _collect_postings(texts)
+        term_parts = {token: [(np.asarray(ids, dtype=np.int32), np.asarray(tfs, dtype=np.int64))]
+                      for token, (ids, tfs) in term_docs.items()}
+        meta = Segment.write(self.index_dir, name, rel_files, np.asarray(chunks, dtype=np.int64), lengths, term_parts)
+        self.manifest["segments"].append(meta)
+        for rel, _, file_meta in pending:
+            self.manifest["files"][rel] = {**file_meta, "segment": name}
+
+    def _needs_compaction(self, new_segments: int = 0) -> bool:
+        metas = self.manifest["segments"]
+        if len(metas) + new_segments > cfg.RAG_INDEX_MAX_SEGMENTS:
+            return True
+        total = sum(meta["num_chunks"] for meta in metas)
+        dead = sum(meta["file_chunks"][local] for meta in metas for local in meta["dead"])
+        return bool(total) and dead / total > cfg.RAG_INDEX_COMPACT_DEAD_RATIO
+
+    def _compact(self):
+        """Gộp mọi segment thành một, bỏ chunk chết; posting được đánh lại id, không đọc lại tài liệu."""
+        metas = self.manifest["segments"]
+        if not metas:
+            return
+        segments = [Segment(self.index_dir, meta) for meta in metas]
+        name = self._new_segment_name()
+        # Chỉ giữ extra mà mọi segment đều có; thiếu ở đâu thì chủ của nó (vd. VectorIndex) sẽ tính lại
+        extra_keys = set.intersection(*(set(segment.extras) for segment in segments))
+        extras = {key: [] for key in extra_keys}
+        files, chunk_rows, lengths = [], [], []
+        term_parts: Dict[str, List[Tuple[np.ndarray, np.ndarray]]] = {}
+        base = 0
+        for segment in segments:
+            file_map = np.full(len(segment.files), -1, dtype=np.int64)
+            for local, rel in enumerate(segment.files):
+                if local not in segment.dead:
+                    file_map[local] = len(files)
+                    files.append(rel)
+            live = segment.live
+            new_ids = np.cumsum(live) - 1 + base
+            rows = np.array(segment.chunks[live])
+            if len(rows):
+                rows[:, 0] = file_map[rows[:, 0]]
+            chunk_rows.append(rows)
+            lengths.append(np.asarray(segment.lengths[live]))
+            for key in extra_keys:
+                extras[key].append(np.asarray(segment.extras[key][live]))
+            for token, term in segment.vocab.items():
+                start, end = int(segment.offsets[term]), int(segment.offsets[term + 1])
+                ids = np.asarray(segment.doc_ids[start:end])
+                keep = live[ids]
+                if keep.any():
+                    term_parts.setdefault(token, []).append(
+                        (new_ids[ids[keep]].astype(np.int32), np.asarray(segment.tfs[start:end])[keep]))
+            base += int(live.sum())
+        chunks = np.concatenate(chunk_rows) if chunk_rows else np.zeros((0, 3), dtype=np.int64)
+        meta = Segment.write(self.index_dir, name, files, chunks, np.concatenate(lengths), term_parts,
+                             {key: np.concatenate(parts) for key, parts in extras.items()})
+        self.manifest["segments"] = [meta] if files else []
+        for rel in files:
+            self.manifest["files"][rel]["segment"] = name
+        print(f"  🗜️  RAG index: gộp {len(segments)} segment → {name} ({len(chunks)} chunks)")
+
+    def _remove_orphans(self):
+        """Xóa file của segment không còn trong manifest (sau compaction hoặc lần ghi bị ngắt)."""
+        keep = {meta["name"] for meta in self.manifest["segments"]}
+        for path in self.index_dir.glob("seg_*"):
+            if path.name.split(".", 1)[0] not in keep:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    # Windows không cho xóa file đang mmap; lần update sau sẽ thử lại
+                    print(f"  ⚠️  Không xóa được {path.name}: {e}")
+
+    # ----- truy vấn -----
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        return self._snapshot
+
+    @property
+    def segments(self) -> Tuple[Segment, ...]:
+        return self._snapshot.segments
+
+    @property
+    def dead_ids(self) -> np.ndarray:
+        """Id toàn cục (theo thứ tự segment) của các chunk đã tombstone."""
+        return self._snapshot.dead_ids
+
+    def attach(self, segment_name: str, arrays: Dict[str, np.ndarray]):
+        """
+        Lưu thêm mảng theo hàng chunk cho một segment đang có (vd. embedding) và mở lại chỉ mục.
+        Bỏ qua nếu segment đã bị process khác gộp mất; bên gọi xem lại `segments` sau đó.
+        """
+        with self._locked():
+            self._reload()
+            meta = next((meta for meta in self.manifest["segments"] if meta["name"] == segment_name), None)
+            if meta is None:
+                return
+            for key, array in arrays.items():
+                # Ghi file tạm rồi os.replace: không ghi đè file mà process khác đang mmap
+                tmp_path = self.index_dir / f"{segment_name}.{key}.npy.tmp"
+                with open(tmp_path, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp_path, self.index_dir / f"{segment_name}.{key}.npy")
+            meta["extras"] = sorted(set(meta.get("extras", [])) | set(arrays))
+            self._write_manifest()
+            self._open_segments()
+
+    def segment_texts(self, segment: Segment) -> List[str]:
+        """Nội dung mọi chunk của segment (kể cả chunk chết, để giữ đúng thứ tự hàng), đọc mỗi file nguồn một lần."""
+        texts = []
+        cache_file, data = None, b""
+        for local_file, start, end in np.asarray(segment.chunks):
+            if local_file != cache_file:
+                cache_file = local_file
+                try:
+                    data = (self.docs_dir / segment.files[local_file]).read_bytes()
+                except OSError:
+                    # File đã bị xóa: chunk này là chunk chết, nội dung không còn quan trọng
+                    data = b""
+            texts.append(data[start:end].decode("utf-8", errors="replace"))
+        return texts
+
+    def chunk(self, doc_id: int, snapshot: IndexSnapshot = None) -> Tuple[str, str]:
+        """(đường dẫn tương đối của file nguồn, nội dung) của chunk có id toàn cục `doc_id` trong `snapshot`."""
+        segments = (snapshot or self._snapshot).segments
+        segment = next(s for s in segments if s.base <= doc_id < s.base + len(s.chunks))
+        local_file, start, end = (int(v) for v in segment.chunks[doc_id - segment.base])
+        rel = segment.files[local_file]
+        return rel, self._read_chunk(rel, start, end)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[float, str, str]]:
+        """[(điểm, đường dẫn tương đối của file nguồn, nội dung chunk)] giảm dần theo điểm."""
+        snapshot = self._snapshot
+        return [(score, *self.chunk(doc_id, snapshot)) for score, doc_id in self.search_ids(query, top_k, snapshot)]
+
+    def search_ids(self, query: str, top_k: int, snapshot: IndexSnapshot = None) -> List[Tuple[float, int]]:
+        """[(điểm BM25, id toàn cục của chunk trong `snapshot`)] giảm dần theo điểm."""
+        segments, dead_ids, num_live, total_chunks = snapshot or self._snapshot
+        if not segments or not num_live or top_k <= 0:
+            return []
+        terms = []
+        for token in set(tokenize(query)):
+            parts = [(segment, posting) for segment in segments
+                     for posting in (segment.posting(token),) if posting is not None]
+            if parts:
+                terms.append((sum(len(ids) for _, (ids, _) in parts), parts))
+        if not terms:
+            return []
+
+        accumulator = np.zeros(total_chunks, dtype=np.float32)
+        for df, parts in terms:
+            idf = _idf(num_live, min(df, num_live))
+            for segment, (ids, tfs) in parts:
+                tfs = tfs.astype(np.float32)
+                accumulator[segment.base + ids] += idf * tfs * (self.k1 + 1.0) / (tfs + segment.length_norm[ids])
+        accumulator[dead_ids] = 0.0
+        candidates = np.flatnonzero(accumulator)
+        return _top_k(candidates, accumulator[candidates], top_k)
+
+    def _read_chunk(self, rel: str, start: int, end: int) -> str:
+        try:
+            with open(self.docs_dir / rel, "rb") as f:
+                f.seek(start)
+                return f.read(end - start).decode("utf-8", errors="replace")
+        except OSError as e:
+            print(f"  ⚠️  Không đọc được chunk từ {rel}: {e}")
+            return ""
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "segments": len(snapshot.segments),
+            "files": len(self.manifest["files"]),
+            "chunks": snapshot.num_live,
+            "dead_chunks": len(snapshot.dead_ids),
+        }
@@ -0,0 +1,149 @@
+"""
+RAG Vector
+Truy hồi theo nghĩa cho SimpleRAG (llm_settings.RAG_BACKEND = "vector" / "hybrid"), bắt được câu hỏi diễn đạt khác
+tài liệu mà BM25 bỏ sót. Embedding của từng chunk do model embedding local chạy CPU tính theo batch lúc index,
+lưu cạnh segment của PersistentRAGIndex (float32, hoặc int8 + scale mỗi hàng) và được mang theo khi gộp segment.
+Khi mở, các segment được ghép thành một ma trận liền khối: một truy vấn là một phép nhân ma trận-vector
+rồi argpartition. "hybrid" trộn thứ hạng BM25 và vector bằng Reciprocal Rank Fusion.
+
+sentence-transformers là phụ thuộc tùy chọn, chỉ cần khi bật backend này.
+"""
+from collections import namedtuple
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from settings import llm_settings as cfg
+from modules.rag_index import PersistentRAGIndex
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+EMBEDDING_KEY = "emb"
+SCALE_KEY = "emb_scale"
+
+# Ma trận embedding cùng snapshot BM25 mà nó được ghép từ đó: id của hai bên luôn khớp nhau
+DenseSnapshot = namedtuple("DenseSnapshot", "index matrix scale")
+
+
+class SentenceEmbedder:
+    """Model sentence-transformers local trên CPU; vector đầu ra đã chuẩn hóa L2 nên tích vô hướng là cosine."""
+    def __init__(self, model_dir=None, batch_size: int = None):
+        if SentenceTransformer is None:
+            raise ImportError("RAG_BACKEND vector/hybrid cần sentence-transformers (pip install sentence-transformers)")
+        self.model_dir = str(model_dir or cfg.RAG_EMBED_MODEL_DIR)
+        self.batch_size = batch_size or cfg.RAG_EMBED_BATCH_SIZE
+        self.model = SentenceTransformer(self.model_dir, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                 convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+
+    def encode_passages(self, texts: List[str]) -> np.ndarray:
+        return self._encode([cfg.RAG_EMBED_PASSAGE_PREFIX + text for text in texts]).reshape(-1, self.dim)
+
+    def encode_query(self, text: str) -> np.ndarray:
+        return self._encode([cfg.RAG_EMBED_QUERY_PREFIX + text])[0]
+
+
+def quantize(embeddings: np.ndarray, dtype: str = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (ma trận, scale mỗi hàng). int8: đối xứng theo hàng, nhỏ hơn float32 4 lần, sai số cosine ~1e-3;
+    NumPy không có GEMV int8 nên mỗi truy vấn phải ép ma trận sang float32 (xem tools/bench_rag.py).
+    """
+    dtype = dtype or cfg.RAG_VECTOR_DTYPE
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype != "int8":
+        return embeddings, np.ones(len(embeddings), dtype=np.float32)
+    scale = np.abs(embeddings).max(axis=1) / 127.0 if len(embeddings) else np.zeros(0, dtype=np.float32)
+    scale = np.maximum(scale, 1e-12).astype(np.float32)
+    return np.round(embeddings / scale[:, None]).astype(np.int8), scale
+
+
+def dense_top_k(matrix: np.ndarray, scale: np.ndarray, query: np.ndarray, top_k: int,
+                dead_ids: np.ndarray = None) -> List[Tuple[float, int]]:
+    """[(cosine, hàng)] giảm dần: một phép nhân ma trận-vector, argpartition rồi chỉ sắp xếp top_k."""
+    if not len(matrix) or top_k <= 0:
+        return []
+    scores = (matrix @ query.astype(np.float32)) * scale
+    if dead_ids is not None and len(dead_ids):
+        scores[dead_ids] = -np.inf
+    top_k = min(top_k, len(scores))
+    top = np.argpartition(scores, len(scores) - top_k)[-top_k:]
+    top = top[np.argsort(scores[top])[::-1]]
+    return [(float(scores[i]), int(i)) for i in top if np.isfinite(scores[i])]
+
+
+def reciprocal_rank_fusion(rankings: Sequence[List[Tuple[float, int]]], top_k: int,
+                           k: int = None) -> List[Tuple[float, int]]:
+    """Trộn các danh sách [(điểm, id)] đã xếp hạng: score = Σ 1 / (k + hạng), không cần chuẩn hóa BM25 với cosine."""
+    k = cfg.RAG_RRF_K if k is None else k
+    fused = {}
+    for ranking in rankings:
+        for rank, (_, doc_id) in enumerate(ranking, 1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(((score, doc_id) for doc_id, score in fused.items()), reverse=True)[:top_k]
+
+
+class VectorIndex:
+    """Embedding theo segment của một PersistentRAGIndex; sync() sau mỗi lần store.update()."""
+    def __init__(self, store: PersistentRAGIndex, embedder: SentenceEmbedder, dtype: str = None):
+        self.store = store
+        self.embedder = embedder
+        self.dtype = dtype or cfg.RAG_VECTOR_DTYPE
+        self._snapshot = DenseSnapshot(store.snapshot, np.zeros((0, embedder.dim), dtype=np.float32),
+                                       np.zeros(0, dtype=np.float32))
+
+    def sync(self) -> int:
+        """Tính embedding cho segment chưa có (segment mới, hoặc chỉ mục tạo trước khi bật vector). Trả về số chunk."""
+        embedded = 0
+        # attach() mở lại chỉ mục theo manifest mới nhất, có thể có segment do process khác vừa thêm: lặp tới khi đủ
+        while True:
+            missing = [segment for segment in self.store.segments if not self._has_embedding(segment)]
+            if not missing:
+                break
+            for segment in missing:
+                texts = self.store.segment_texts(segment)
+                embeddings = np.zeros((0, self.embedder.dim), dtype=np.float32)
+                if texts:
+                    embeddings = np.concatenate([
+                        self.embedder.encode_passages(texts[i:i + self.embedder.batch_size])
+                        for i in range(0, len(texts), self.embedder.batch_size)
+                    ])
+                matrix, scale = quantize(embeddings, self.dtype)
+                self.store.attach(segment.name, {EMBEDDING_KEY: matrix, SCALE_KEY: scale})
+                embedded += len(texts)
+        self._build_matrix()
+        return embedded
+
+    def _has_embedding(self, segment) -> bool:
+        stored = segment.extras.get(EMBEDDING_KEY)
+        return stored is not None and stored.shape[1:] == (self.embedder.dim,) and stored.dtype == np.dtype(self.dtype)
+
+    def _build_matrix(self):
+        index = self.store.snapshot
+        segments = index.segments
+        if segments:
+            matrix = np.ascontiguousarray(np.concatenate([segment.extras[EMBEDDING_KEY] for segment in segments]))
+            scale = np.concatenate([segment.extras[SCALE_KEY] for segment in segments]).astype(np.float32)
+        else:
+            matrix = np.zeros((0, self.embedder.dim), dtype=np.float32)
+            scale = np.zeros(0, dtype=np.float32)
+        self._snapshot = DenseSnapshot(index, matrix, scale)
+
+    @property
+    def snapshot(self) -> DenseSnapshot:
+        return self._snapshot
+
+    def search_ids(self, query: str, top_k: int, snapshot: DenseSnapshot = None) -> List[Tuple[float, int]]:
+        """[(cosine, id toàn cục của chunk trong snapshot.index)] giảm dần."""
+        index, matrix, scale = snapshot or self._snapshot
+        return dense_top_k(matrix, scale, self.embedder.encode_query(query), top_k, index.dead_ids)
+
+    def stats(self) -> dict:
+        matrix = self._snapshot.matrix
+        return {"vectors": len(matrix), "dim": self.embedder.dim, "dtype": self.dtype,
+                "matrix_bytes": int(matrix.nbytes)}
@@ -0,0 +1,83 @@
+"""
+CPU Resources
+Ngân sách thread intra-op và CPU affinity riêng cho từng stage (VAD, STT, streaming STT, TTS, pipeline worker).
+"""
+import os
+import threading
+from typing import List, Optional
+
+from settings import server_settings as cfg
+from settings import stt_settings
+
+STAGES = ("vad", "stt", "streaming_stt", "tts", "pipeline")
+
+# Ghi đè lúc chạy (tools/bench_threads.py thử nhiều cách chia)
+_overrides = {}
+
+
+def available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def process_cores() -> int:
+    """Số core dành cho process hiện tại khi nhiều server process (launcher.py) chạy chung máy."""
+    return max(1, available_cores() // max(1, cfg.SERVER_PROCESSES))
+
+
+def set_threads(stage: str, threads: int):
+    if stage not in STAGES:
+        raise ValueError(f"Stage không hợp lệ: {stage}")
+    _overrides[stage] = threads
+
+
+def threads_for(stage: str) -> int:
+    """Số thread intra-op (với "pipeline": số lượt pipeline chạy song song) của stage."""
+    if stage in _overrides:
+        return _overrides[stage]
+    if stage == "vad":
+        return cfg.VAD_THREADS or 1
+    if stage == "stt":
+        return cfg.STT_THREADS or stt_settings.NUM_THREADS
+    if stage == "streaming_stt":
+        return cfg.STREAMING_STT_THREADS or stt_settings.STREAMING_NUM_THREADS
+    if stage == "pipeline":
+        if cfg.PIPELINE_MAX_WORKERS:
+            return cfg.PIPELINE_MAX_WORKERS
+        threads_per_job = cfg.PIPELINE_THREADS_PER_JOB or threads_for("stt")
+        return max(1, process_cores() // max(1, threads_per_job))
+    if stage == "tts":
+        return cfg.TTS_THREADS or max(1, process_cores() // threads_for("pipeline"))
+    raise ValueError(f"Stage không hợp lệ: {stage}")
+
+
+def cores_for(stage: str) -> Optional[List[int]]:
+    return cfg.CPU_AFFINITY.get(stage) or None
+
+
+def pin_current_thread(stage: str):
+    """Ghim thread hiện tại vào core của stage. Thread con (pool của onnxruntime/OpenMP) tạo sau đó kế thừa affinity."""
+    cores = cores_for(stage)
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        # Trên Linux, affinity theo TID chỉ áp dụng cho thread này
+        os.sched_setaffinity(threading.get_native_id(), cores)
+    except OSError as e:
+        print(f"⚠️  Không ghim được stage '{stage}' vào core {cores}: {e}")
+
+
+def apply_torch_threads():
+    """Torch chỉ còn dùng cho TTS (VAD chạy onnxruntime) nên số thread torch = ngân sách TTS."""
+    import torch
+    torch.set_num_threads(threads_for("tts"))
+
+
+def plan() -> dict:
+    return {
+        "cores": available_cores(),
+        "processes": cfg.SERVER_PROCESSES,
+        **{stage: {"threads": threads_for(stage), "cores": cores_for(stage)} for stage in STAGES},
+    }
@@ -0,0 +1,120 @@
+import os
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# ===== Pipeline Worker Pool =====
+# Chạy VoiceAssistantPipeline.process ngoài event loop của FastAPI
+PIPELINE_EXECUTOR = os.getenv("PIPELINE_EXECUTOR", "thread")  # Options: thread, process
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "0"))  # 0 = tự tính theo số core
+PIPELINE_THREADS_PER_JOB = 0  # Số core một lượt STT/TTS chiếm, 0 = số thread của STT (STT_THREADS)
+PIPELINE_MAX_QUEUE = int(os.getenv("PIPELINE_MAX_QUEUE", "8"))  # Số job được phép chờ, vượt quá sẽ bị từ chối
+
+# ===== Batched VAD =====
+# Gom frame từ tất cả kết nối thành một lần chạy Silero
+VAD_BATCH_WINDOW_MS = 5  # Thời gian chờ gom frame trước mỗi batch
+VAD_MAX_BATCH = 256      # Số frame tối đa trong một batch
+
+# ===== Energy Pre-Gate =====
+# Bỏ qua Silero cho các frame chắc chắn là im lặng (RMS thấp hơn noise floor của kết nối)
+VAD_GATE_ENABLED = True
+VAD_GATE_CALIBRATION_FRAMES = 10   # Số frame đầu dùng để đo noise floor (luôn chạy Silero)
+VAD_GATE_RATIO = 2.0               # Frame có RMS < floor * RATIO được coi là im lặng
+VAD_GATE_MIN_RMS = 0.002           # Dưới mức này luôn là im lặng (digital silence)
+VAD_GATE_MAX_RMS = 0.02            # Trên mức này luôn chạy Silero, dù floor cao đến đâu
+VAD_GATE_ZCR_UNVOICED = 0.3        # Frame nhỏ nhưng ZCR cao (phụ âm xát "s", "x") vẫn chạy Silero
+VAD_GATE_HANGOVER_FRAMES = 5       # Sau một frame qua gate, luôn chạy Silero thêm N frame
+VAD_GATE_FLOOR_ADAPT = 0.05        # Tốc độ cập nhật noise floor trên các frame bị gate
+
+# ===== Utterance Archive =====
+# Lưu lại các câu nói lên đĩa (tùy chọn, chạy nền, không nằm trên đường xử lý chính)
+ARCHIVE_UTTERANCES = os.getenv("ARCHIVE_UTTERANCES", "0") == "1"
+ARCHIVE_DIR = "audio_files"
+ARCHIVE_MAX_FILES = 500   # Giữ tối đa N file, xóa file cũ nhất khi vượt quá
+ARCHIVE_QUEUE_SIZE = 32   # Hàng đợi ghi; khi đầy thì bỏ qua câu mới thay vì chặn
+
+# ===== Trace Capture =====
+# Ghi từng phiên WebSocket (audio vào, lệnh điều khiển, phản hồi, timing) ra file nhị phân để replay bằng
+# tools/replay_trace.py. Audio vào lưu nguyên dạng nhận (ADPCM/PCM16), audio ra chỉ lưu số byte.
+TRACE_CAPTURE = os.getenv("TRACE_CAPTURE", "0") == "1"
+TRACE_DIR = "traces"
+TRACE_MAX_FILES = 200                       # Giữ tối đa N phiên đã đóng, xóa trace cũ nhất khi vượt quá
+TRACE_MAX_SESSION_BYTES = 32 * 1024 * 1024  # Một phiên dài hơn thì dừng ghi (~1 giờ audio ADPCM)
+TRACE_FLUSH_BYTES = 64 * 1024               # Gom record trong bộ nhớ rồi giao cho thread ghi theo khối
+TRACE_QUEUE_SIZE = 256
+
+# ===== Utterance Buffer =====
+MAX_UTTERANCE_SEC = 15  # Câu nói dài hơn sẽ bị ép kết thúc (chống VAD kẹt mở do tiếng TV)
+
+# ===== Transport Codec =====
+# Thiết bị chọn codec khi kết nối (ws://.../ws?codec=adpcm) hoặc gửi text "CODEC:ADPCM"
+TRANSPORT_CODECS = ("pcm16", "adpcm")
+DEFAULT_TRANSPORT_CODEC = os.getenv("DEFAULT_TRANSPORT_CODEC", "pcm16")
+
+# ===== Adaptive Endpointing =====
+# Đơn vị: frame VAD 30 ms. Quyết định hết lượt dựa trên xu hướng xác suất VAD, năng lượng,
+# độ dài câu và (nếu có) transcript streaming.
+ENDPOINT_MIN_SILENCE_FRAMES = 8        # ~250 ms, cho câu lệnh ngắn kết thúc dứt khoát ("chào cậu")
+ENDPOINT_BASE_SILENCE_FRAMES = 14      # ~420 ms, mặc định cho câu bình thường
+ENDPOINT_MAX_SILENCE_FRAMES = 34       # ~1 s, trần cho trẻ nói chậm, ngập ngừng
+ENDPOINT_SHORT_UTTERANCE_FRAMES = 40   # Câu có ít hơn ~1.2 s tiếng nói được coi là câu ngắn
+ENDPOINT_PROVISIONAL_FRAMES = 6        # Điểm kết thúc tạm thời (dùng cho xử lý suy đoán)
+ENDPOINT_SHARP_DROP_BONUS = 3          # Bớt frame khi xác suất rơi dứt khoát
+ENDPOINT_HESITATION_PENALTY = 8        # Thêm frame khi xác suất lơ lửng / còn năng lượng (ậm ừ, thở)
+ENDPOINT_INCOMPLETE_PENALTY = 12       # Thêm frame khi transcript kết thúc bằng từ nối ("và", "thì"...)
+ENDPOINT_COMPLETE_BONUS = 3            # Bớt frame khi transcript kết thúc bằng tiểu từ cuối câu ("nhé", "không"...)
+ENDPOINT_RESIDUAL_ENERGY_RATIO = 0.3   # Năng lượng khoảng lặng / năng lượng tiếng nói vượt mức này là ngập ngừng
+# Tinh chỉnh riêng theo thiết bị (device_id gửi lúc kết nối: ws://.../ws?device_id=...)
+ENDPOINT_DEVICE_OVERRIDES = {
+    # "robot-lop1a": {"base_silence_frames": 18, "max_silence_frames": 40},
+}
+
+# ===== Barge-in =====
+# VAD vẫn chạy trong lúc robot đang trả lời; người dùng nói đủ lâu thì hủy phản hồi đang phát.
+# Thiết bị cần tiếp tục gửi audio mic trong lúc phát loa để tính năng này có tác dụng.
+BARGE_IN_ENABLED = os.getenv("BARGE_IN_ENABLED", "1") == "1"
+BARGE_IN_MIN_FRAMES = 8   # ~240 ms tiếng nói liên tục mới ngắt lời (tránh tiếng ho, gõ bàn, tiếng loa dội lại)
+
+# ===== Speculative LLM =====
+# Khi có điểm kết thúc tạm thời (ENDPOINT_PROVISIONAL_FRAMES) và transcript streaming, chạy trước
+# LLM (+ đoạn TTS đầu) rồi giữ lại kết quả; chỉ gửi cho thiết bị nếu transcript cuối không đổi.
+# Cần STT_MODE = "streaming". Mỗi lần đoán sai là một lần gọi API bị bỏ đi.
+SPECULATIVE_LLM_ENABLED = os.getenv("SPECULATIVE_LLM_ENABLED", "0") == "1"
+SPECULATIVE_CHARS_PER_TOKEN = 4   # Ước lượng số token bị lãng phí từ số ký tự đã sinh
+# Số câu đầu được TTS trước khi xác nhận; các câu sau chỉ đọc khi transcript cuối trùng khớp (0 = chỉ LLM)
+SPECULATIVE_TTS_SENTENCES = int(os.getenv("SPECULATIVE_TTS_SENTENCES", "1"))
+
+# ===== Model Loading =====
+# Mọi model được tải từ thư mục local, không gọi mạng lúc khởi động (trừ khi ALLOW_MODEL_DOWNLOAD=1)
+VAD_MODEL_PATH = ROOT_DIR / "models" / "silero_vad" / "silero_vad.onnx"
+ALLOW_MODEL_DOWNLOAD = os.getenv("ALLOW_MODEL_DOWNLOAD", "0") == "1"
+MODEL_LOAD_PARALLEL = True   # Tải VAD / STT / TTS / LLM song song trên nhiều thread
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"  # Chạy thử từng model trước khi báo /ready
+WARMUP_TTS_TEXT = "Xin chào cậu."
+
+# ===== Multi-worker Launcher (launcher.py) =====
+# Process cha tải trước các model này rồi fork worker, trọng số được chia sẻ copy-on-write
+LAUNCHER_PRELOAD_MODELS = ("tts", "vad")
+LAUNCHER_WORKERS = int(os.getenv("LAUNCHER_WORKERS", "0"))  # 0 = cores / số thread mỗi lượt pipeline
+LAUNCHER_HOST = os.getenv("LAUNCHER_HOST", "0.0.0.0")
+LAUNCHER_PORT = int(os.getenv("LAUNCHER_PORT", "8000"))
+# Số server process chia nhau các core của máy; launcher đặt = số worker trước khi fork.
+# Ngân sách thread tự tính (pipeline, TTS) của mỗi process chỉ dùng phần core của nó
+SERVER_PROCESSES = int(os.getenv("SERVER_PROCESSES", "1"))
+
+# ===== CPU Resources =====
+# Số thread intra-op riêng cho từng stage (thay cho torch.set_num_threads(1) toàn process). 0 = tự chọn:
+#   VAD 1 thread, STT = stt_settings.NUM_THREADS, streaming STT = stt_settings.STREAMING_NUM_THREADS,
+#   pipeline worker = số core / số thread một lượt (PIPELINE_MAX_WORKERS), TTS = số core / số pipeline worker.
+#   "Số core" ở đây là phần của một server process: core của máy / SERVER_PROCESSES.
+# Tìm cách chia tốt nhất cho máy hiện tại: python tools/bench_threads.py
+VAD_THREADS = int(os.getenv("VAD_THREADS", "1"))
+STT_THREADS = int(os.getenv("STT_THREADS", "0"))
+STREAMING_STT_THREADS = int(os.getenv("STREAMING_STT_THREADS", "0"))
+TTS_THREADS = int(os.getenv("TTS_THREADS", "0"))
+# Ghim thread của từng stage vào các core cố định (chỉ Linux). Stage: vad, stt, streaming_stt, tts, pipeline
+CPU_AFFINITY = {
+    # "vad": [0],
+    # "streaming_stt": [1],
+    # "pipeline": [2, 3, 4, 5, 6, 7],
+}
@@ -0,0 +1,115 @@
+"""
+Session Manager
+Trạng thái hội thoại riêng cho từng thiết bị (session_id = device_id), giữ trong bộ nhớ có giới hạn:
+phiên không hoạt động quá TTL bị xóa, vượt số phiên / dung lượng thì xóa phiên dùng lâu nhất (LRU).
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+from settings import llm_settings as cfg
+
+# Ước lượng phần bộ nhớ cố định của một message (dict + timestamp) ngoài nội dung văn bản
+_MESSAGE_OVERHEAD_BYTES = 256
+
+
+def _message_size(message: Dict) -> int:
+    return len((message.get("content") or "").encode("utf-8")) + _MESSAGE_OVERHEAD_BYTES
+
+
+class Session:
+    """Lịch sử gần nhất và thời điểm hoạt động cuối của một thiết bị."""
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.created_at = time.time()
+        self.last_active = time.monotonic()
+        self.messages: List[Dict] = []
+        self.size_bytes = 0
+        self.turns = 0
+
+
+class SessionManager:
+    """
+    Các phiên sắp theo thứ tự dùng gần nhất (OrderedDict), nên phiên hết hạn và phiên LRU luôn nằm ở đầu.
+    An toàn khi gọi từ nhiều pipeline worker thread cùng lúc.
+    """
+    def __init__(self, ttl_sec: float = None, max_sessions: int = None, max_memory_bytes: int = None,
+                 max_messages: int = None):
+        self.ttl_sec = cfg.SESSION_TTL_SEC if ttl_sec is None else ttl_sec
+        self.max_sessions = max_sessions or cfg.SESSION_MAX_SESSIONS
+        self.max_memory_bytes = max_memory_bytes or cfg.SESSION_MAX_MEMORY_BYTES
+        self.max_messages = max_messages or cfg.MAX_HISTORY_TURNS * 2
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    def _remove(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self._memory_bytes -= session.size_bytes
+
+    def _expire(self, now: float):
+        if self.ttl_sec <= 0:
+            return
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_active < self.ttl_sec:
+                break
+            self._remove(session.session_id)
+            self.expired += 1
+
+    def _enforce_limits(self, keep: str):
+        # Không bao giờ xóa phiên đang được dùng (`keep`), kể cả khi riêng nó đã vượt giới hạn
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions
+                                           or self._memory_bytes > self.max_memory_bytes):
+            oldest = next(iter(self._sessions))
+            if oldest == keep:
+                break
+            self._remove(oldest)
+            self.evicted += 1
+
+    def _touch(self, session_id: str) -> Session:
+        now = time.monotonic()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = self._sessions[session_id] = Session(session_id)
+        else:
+            self._sessions.move_to_end(session_id)
+        session.last_active = now
+        return session
+
+    def append(self, session_id: str, message: Dict):
+        """Thêm một message vào phiên, chỉ giữ `max_messages` message gần nhất."""
+        with self._lock:
+            session = self._touch(session_id)
+            session.messages.append(message)
+            added = _message_size(message)
+            while len(session.messages) > self.max_messages:
+                added -= _message_size(session.messages.pop(0))
+            session.size_bytes += added
+            self._memory_bytes += added
+            if message.get("role") == "assistant":
+                session.turns += 1
+            self._enforce_limits(keep=session_id)
+
+    def history(self, session_id: str) -> List[Dict]:
+        """Bản sao lịch sử của phiên (rỗng nếu phiên mới hoặc đã bị xóa)."""
+        with self._lock:
+            return list(self._touch(session_id).messages)
+
+    def drop(self, session_id: str):
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": self._memory_bytes,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
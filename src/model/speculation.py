@@ -0,0 +1,117 @@
+"""
+Speculative Response
+Chạy pipeline trên transcript tạm thời trong lúc chờ xác nhận kết thúc câu, giữ lại kết quả cho đến khi được xác nhận.
+"""
+import asyncio
+import re
+
+from settings import server_settings as cfg
+from modules.events import ResponseDelta, AudioChunk, Error
+
+
+def normalize_transcript(text: str) -> str:
+    """So sánh transcript không phân biệt hoa thường, dấu câu và khoảng trắng."""
+    return " ".join(re.findall(r"\w+", (text or "").lower(), flags=re.UNICODE))
+
+
+class SpeculativeResponse:
+    """Gom các sự kiện của một lần chạy pipeline suy đoán vào hàng đợi, chưa gửi gì cho thiết bị."""
+    # Bộ đếm chung của tất cả kết nối
+    total_started = 0
+    total_hits = 0
+    total_misses = 0      # Transcript cuối khác transcript đã đoán
+    total_aborted = 0     # Người dùng nói tiếp trước khi xác nhận kết thúc câu
+    total_cancelled = 0   # Đã xác nhận nhưng phản hồi bị hủy giữa chừng (barge-in, mất kết nối)
+    total_wasted_chars = 0
+    total_wasted_audio_sec = 0.0  # Audio TTS đã tổng hợp cho các lần đoán bị bỏ (chi phí CPU)
+
+    def __init__(self, stream, transcript: str, speak=None, tts_sentences: int = None):
+        """
+        `stream` là async iterator sự kiện pipeline, vd. pipeline_pool.events(..., commit_history=False,
+        tts_sentences=N): chỉ N câu đầu có audio. Khi phát lại, các câu sau được đọc bằng `speak(text)`
+        (async iterator sự kiện, vd. pipeline_pool.stream("speak", text=text)).
+        """
+        self.transcript = transcript
+        self.speak = speak
+        self.tts_sentences = tts_sentences
+        self.generated_chars = 0
+        self.generated_audio_sec = 0.0
+        self.confirmed = False
+        # Lần chạy suy đoán lỗi (pool đầy, lỗi LLM...): không dùng làm phản hồi, handler chạy pipeline như thường
+        self.failed = False
+        self._discarded = False
+        self._items = asyncio.Queue()
+        self._task = asyncio.create_task(self._collect(stream))
+        SpeculativeResponse.total_started += 1
+
+    async def _collect(self, stream):
+        try:
+            async for event in stream:
+                if isinstance(event, ResponseDelta):
+                    self.generated_chars += len(event.text)
+                elif isinstance(event, AudioChunk):
+                    self.generated_audio_sec += len(event.pcm) / 2 / event.sample_rate
+                elif isinstance(event, Error):
+                    self.failed = True
+                self._items.put_nowait(event)
+        except Exception as e:
+            self.failed = True
+            self._items.put_nowait(Error(repr(e)))
+        finally:
+            self._items.put_nowait(None)
+
+    def matches(self, final_transcript: str) -> bool:
+        """Dùng được làm phản hồi: transcript cuối trùng transcript đã đoán và lần chạy chưa lỗi."""
+        return not self.failed and normalize_transcript(final_transcript) == normalize_transcript(self.transcript)
+
+    def confirm(self):
+        """Transcript cuối trùng khớp: kết quả đã sinh được dùng làm phản hồi thật."""
+        self.confirmed = True
+        SpeculativeResponse.total_hits += 1
+
+    async def discard(self, aborted: bool = False):
+        """
+        Hủy lần chạy suy đoán (worker pool dừng pipeline) và ghi nhận phần đã sinh là lãng phí.
+        Cũng dùng khi phản hồi đã xác nhận bị hủy giữa chừng; gọi nhiều lần chỉ tính một lần.
+        """
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        if self._discarded:
+            return
+        self._discarded = True
+        if self.confirmed:
+            SpeculativeResponse.total_cancelled += 1
+        elif aborted:
+            SpeculativeResponse.total_aborted += 1
+        else:
+            SpeculativeResponse.total_misses += 1
+        SpeculativeResponse.total_wasted_chars += self.generated_chars
+        SpeculativeResponse.total_wasted_audio_sec += self.generated_audio_sec
+
+    async def events(self):
+        """Phát lại các sự kiện đã gom rồi tiếp tục theo thời gian thực; đọc nốt các câu chưa được TTS."""
+        sentences = 0
+        while True:
+            event = await self._items.get()
+            if event is None:
+                return
+            yield event
+            if isinstance(event, ResponseDelta):
+                sentences += 1
+                if self.speak and self.tts_sentences is not None and sentences > self.tts_sentences:
+                    async for spoken in self.speak(event.text):
+                        yield spoken
+
+    @classmethod
+    def global_stats(cls) -> dict:
+        return {
+            "started": cls.total_started,
+            "hits": cls.total_hits,
+            "misses": cls.total_misses,
+            "aborted": cls.total_aborted,
+            "cancelled": cls.total_cancelled,
+            "hit_rate": (cls.total_hits / cls.total_started) if cls.total_started else 0.0,
+            "wasted_chars": cls.total_wasted_chars,
+            "wasted_tokens_est": cls.total_wasted_chars // cfg.SPECULATIVE_CHARS_PER_TOKEN,
+            "wasted_audio_sec": round(cls.total_wasted_audio_sec, 2),
+        }
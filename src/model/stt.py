@@ -7,6 +7,20 @@ import soundfile as sf
 import sherpa_onnx
 from pathlib import Path
 from settings import stt_settings as cfg
+from modules.resources import threads_for
+
+def find_model_file(model_dir: Path, patterns):
+    for pattern in patterns:
+        if '*' in pattern:
+            files = list(model_dir.glob(pattern))
+            if files:
+                return str(files[0])
+        else:
+            file_path = model_dir / pattern
+            if file_path.exists():
+                return str(file_path)
+    raise FileNotFoundError(f"Model file not found for patterns: {patterns}")
+
 
 class STTEngine:
     def __init__(self):
@@ -14,16 +28,7 @@ class STTEngine:
         self._initialize_model()
 
     def _find_model_file(self, patterns):
-        for pattern in patterns:
-            if '*' in pattern:
-                files = list(cfg.MODEL_DIR.glob(pattern))
-                if files:
-                    return str(files[0])
-            else:
-                file_path = cfg.MODEL_DIR / pattern
-                if file_path.exists():
-                    return str(file_path)
-        raise FileNotFoundError(f"Model file not found for patterns: {patterns}")
+        return find_model_file(cfg.MODEL_DIR, patterns)
 
     def _initialize_model(self):
         tokens = self._find_model_file(cfg.TOKENS_FILE_PATTERNS)
@@ -36,7 +41,7 @@ class STTEngine:
             encoder=encoder,
             decoder=decoder,
             joiner=joiner,
-            num_threads=cfg.NUM_THREADS,
+            num_threads=threads_for("stt"),
             sample_rate=cfg.SAMPLE_RATE,
             feature_dim=cfg.FEATURE_DIM,
             decoding_method=cfg.DECODING_METHOD,
@@ -57,6 +62,23 @@ class STTEngine:
 
         if wav.ndim > 1:
             wav = wav[:, 0]
+        return self._decode(wav, sr)
+
+    def transcribe_pcm(self, audio, sample_rate: int = cfg.SAMPLE_RATE):
+        """Nhận dạng trực tiếp từ bộ nhớ: bytes PCM16 mono hoặc mảng NumPy (int16 / float)."""
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            wav = np.frombuffer(audio, dtype=np.int16).astype(np.float32) / 32768.0
+        else:
+            wav = np.asarray(audio)
+            if wav.dtype == np.int16:
+                wav = wav.astype(np.float32) / 32768.0
+            else:
+                wav = wav.astype(np.float32, copy=False)
+        if wav.ndim > 1:
+            wav = wav[:, 0]
+        return self._decode(wav, sample_rate)
+
+    def _decode(self, wav, sr):
         if sr != cfg.SAMPLE_RATE:
             print(f"DEBUG: Resampling from {sr} to {cfg.SAMPLE_RATE}")
             new_len = int(len(wav) * cfg.SAMPLE_RATE / sr)
@@ -74,7 +96,8 @@ class STTEngine:
         res = stream.result
         return res.text
 
-    def transcribe(self, audio_input_path):
-        """Alias kept for compatibility with pipeline.py"""
-        return self.transcribe_from_file(audio_input_path)
-
+    def transcribe(self, audio_input, sample_rate: int = cfg.SAMPLE_RATE):
+        """Alias kept for compatibility with pipeline.py (nhận đường dẫn file hoặc PCM trong bộ nhớ)"""
+        if isinstance(audio_input, (str, Path)):
+            return self.transcribe_from_file(audio_input)
+        return self.transcribe_pcm(audio_input, sample_rate)
@@ -21,4 +21,10 @@ DECODING_METHOD = "greedy_search"  # Options: greedy_search, modified_beam_searc
 PROVIDER = "cpu"  # Options: cpu, cuda, coreml
 
 # ===== Input/Output =====
-DEFAULT_INPUT_AUDIO = ROOT_DIR / "data" / "ref1.wav"
\ No newline at end of file
+DEFAULT_INPUT_AUDIO = ROOT_DIR / "data" / "ref1.wav"
+# ===== Streaming STT (OnlineRecognizer) =====
+STT_MODE = "offline"  # Options: offline (giải mã sau khi hết câu), streaming (giải mã trong lúc nói)
+STREAMING_MODEL_DIR = ROOT_DIR / "models" / "Zipformer-streaming"
+STREAMING_NUM_THREADS = 2
+STREAMING_MAX_BATCH = 32          # Số stream tối đa giải mã chung một lần decode_streams
+STREAMING_TAIL_PADDING_SEC = 0.3  # Đệm im lặng cuối câu để encoder streaming xả hết frame
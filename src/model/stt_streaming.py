@@ -0,0 +1,116 @@
+"""
+Streaming Speech-to-Text
+Model: Streaming ZipFormer với sherpa_onnx.OnlineRecognizer, được nạp từng frame từ vòng VAD
+"""
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+import sherpa_onnx
+from settings import stt_settings as cfg
+from modules.stt import find_model_file
+from modules.resources import pin_current_thread, threads_for
+
+
+class StreamingSTTSession:
+    """Một câu nói đang được nhận dạng. Mọi lệnh gọi sherpa_onnx chạy trên thread giải mã của engine."""
+    def __init__(self, engine: "StreamingSTTEngine"):
+        self._engine = engine
+        self.stream = engine.recognizer.create_stream()
+        self._pending = deque()  # PCM16 bytes chờ đưa vào stream
+        self._finish_future = None
+        self.partial_text = ""
+
+    def feed(self, pcm16):
+        """Không chặn: thêm một frame PCM16 (bytes/memoryview), thread giải mã sẽ xử lý."""
+        self._pending.append(bytes(pcm16))
+        self._engine._schedule(self)
+
+    def finish(self) -> Future:
+        """Kết thúc câu nói; Future trả về transcript cuối cùng."""
+        if self._finish_future is None:
+            self._finish_future = Future()
+            self._engine._schedule(self)
+        return self._finish_future
+
+    def _drain_pending(self):
+        if not self._pending:
+            return
+        chunks = []
+        while self._pending:
+            chunks.append(self._pending.popleft())
+        samples = np.frombuffer(b"".join(chunks), dtype=np.int16).astype(np.float32) / 32768.0
+        self.stream.accept_waveform(cfg.SAMPLE_RATE, samples)
+
+
+class StreamingSTTEngine:
+    def __init__(self):
+        self.recognizer = None
+        self._initialize_model()
+        self._lock = threading.Condition()
+        self._dirty = []
+        self._thread = threading.Thread(target=self._decode_loop, name="stt-streaming", daemon=True)
+        self._thread.start()
+
+    def _initialize_model(self):
+        model_dir = cfg.STREAMING_MODEL_DIR
+        self.recognizer = sherpa_onnx.OnlineRecognizer.from_transducer(
+            tokens=find_model_file(model_dir, cfg.TOKENS_FILE_PATTERNS),
+            encoder=find_model_file(model_dir, cfg.ENCODER_FILE_PATTERNS),
+            decoder=find_model_file(model_dir, cfg.DECODER_FILE_PATTERNS),
+            joiner=find_model_file(model_dir, cfg.JOINER_FILE_PATTERNS),
+            num_threads=threads_for("streaming_stt"),
+            sample_rate=cfg.SAMPLE_RATE,
+            feature_dim=cfg.FEATURE_DIM,
+            decoding_method=cfg.DECODING_METHOD,
+            provider=cfg.PROVIDER,
+        )
+        print("✅ Streaming STT model initialized successfully")
+
+    def create_session(self) -> StreamingSTTSession:
+        return StreamingSTTSession(self)
+
+    def _schedule(self, session: StreamingSTTSession):
+        with self._lock:
+            if session not in self._dirty:
+                self._dirty.append(session)
+            self._lock.notify()
+
+    def _decode_loop(self):
+        pin_current_thread("streaming_stt")
+        while True:
+            with self._lock:
+                while not self._dirty:
+                    self._lock.wait()
+                sessions, self._dirty = self._dirty, []
+            try:
+                self._decode_sessions(sessions)
+            except Exception as e:
+                print(f"❌ Streaming STT decode error: {e}")
+                for session in sessions:
+                    if session._finish_future and not session._finish_future.done():
+                        session._finish_future.set_exception(e)
+
+    def _decode_sessions(self, sessions):
+        finishing = []
+        for session in sessions:
+            session._drain_pending()
+            if session._finish_future is not None and not session._finish_future.done():
+                tail = np.zeros(int(cfg.STREAMING_TAIL_PADDING_SEC * cfg.SAMPLE_RATE), dtype=np.float32)
+                session.stream.accept_waveform(cfg.SAMPLE_RATE, tail)
+                session.stream.input_finished()
+                finishing.append(session)
+
+        # Giải mã theo batch các stream đã đủ frame, lặp tới khi không còn stream nào sẵn sàng
+        while True:
+            ready = [s.stream for s in sessions if self.recognizer.is_ready(s.stream)]
+            if not ready:
+                break
+            for start in range(0, len(ready), cfg.STREAMING_MAX_BATCH):
+                self.recognizer.decode_streams(ready[start:start + cfg.STREAMING_MAX_BATCH])
+
+        for session in sessions:
+            session.partial_text = self.recognizer.get_result(session.stream).strip()
+        for session in finishing:
+            session._finish_future.set_result(session.partial_text)
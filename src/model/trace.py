@@ -0,0 +1,266 @@
+"""
+Session Trace
+Ghi lại một phiên WebSocket (frame audio vào, lệnh điều khiển, phản hồi, timing) ra file nhị phân gọn, có timestamp,
+để replay lại với tools/replay_trace.py. TraceReplyLLM thay LLM bằng câu trả lời đã ghi khi replay.
+
+Định dạng: MAGIC, sau đó các record <kind u8><t f64 giây từ đầu phiên><len u32><payload>.
+"""
+import difflib
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from datetime import datetime
+from pathlib import Path
+
+from settings import server_settings as cfg
+from modules.speculation import normalize_transcript
+
+MAGIC = b"PTRACE\x01\x00"
+_RECORD = struct.Struct("<BdI")
+_COUNT = struct.Struct("<I")
+
+# Loại record
+SESSION = 0     # JSON: device_id, codec, started_at...
+AUDIO_IN = 1    # payload nguyên dạng thiết bị gửi (ADPCM hoặc PCM16)
+TEXT_IN = 2     # lệnh text từ thiết bị
+TEXT_OUT = 3    # text gửi về thiết bị (PROCESSING_START, mã cảm xúc, TTS_END, BARGE_IN...)
+AUDIO_OUT = 4   # số byte PCM16 của một khối audio TTS đã gửi (không lưu audio ra)
+TIMING = 5      # JSON {"stage", "value"} từ pipeline
+EVENT = 6       # JSON {"event": ...}: quyết định của server (endpoint, barge_in...)
+TURN = 7        # JSON: transcript, các câu trả lời, cảm xúc và timing LLM của một lượt
+
+KIND_NAMES = {
+    SESSION: "session", AUDIO_IN: "audio_in", TEXT_IN: "text_in", TEXT_OUT: "text_out",
+    AUDIO_OUT: "audio_out", TIMING: "timing", EVENT: "event", TURN: "turn",
+}
+_JSON_KINDS = (SESSION, TIMING, EVENT, TURN)
+_TEXT_KINDS = (TEXT_IN, TEXT_OUT)
+
+TraceRecord = namedtuple("TraceRecord", "kind t payload")
+
+
+class TraceSession:
+    """Bộ ghi của một kết nối. Record được gom trong bộ nhớ và giao cho TraceSink ghi đĩa theo từng khối."""
+    def __init__(self, sink: "TraceSink", path: Path, header: dict):
+        self.path = path
+        self.bytes_recorded = 0
+        self.truncated = False
+        self._sink = sink
+        self._start = time.perf_counter()
+        self._buffer = bytearray(MAGIC)
+        self._record_json(SESSION, header)
+
+    def _record(self, kind: int, payload: bytes):
+        if self.truncated:
+            return
+        size = _RECORD.size + len(payload)
+        if self.bytes_recorded + size > cfg.TRACE_MAX_SESSION_BYTES:
+            # Phiên quá dài: dừng ghi, phần đã ghi vẫn replay được
+            self.truncated = True
+            return
+        self._buffer += _RECORD.pack(kind, time.perf_counter() - self._start, len(payload))
+        self._buffer += payload
+        self.bytes_recorded += size
+        if len(self._buffer) >= cfg.TRACE_FLUSH_BYTES:
+            self.flush()
+
+    def _record_json(self, kind: int, obj: dict):
+        self._record(kind, json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    def audio_in(self, data: bytes):
+        self._record(AUDIO_IN, bytes(data))
+
+    def text_in(self, text: str):
+        self._record(TEXT_IN, text.encode("utf-8"))
+
+    def text_out(self, text: str):
+        self._record(TEXT_OUT, text.encode("utf-8"))
+
+    def audio_out(self, num_bytes: int):
+        self._record(AUDIO_OUT, _COUNT.pack(num_bytes))
+
+    def timing(self, stage: str, value: float):
+        self._record_json(TIMING, {"stage": stage, "value": value})
+
+    def event(self, name: str, **fields):
+        self._record_json(EVENT, {"event": name, **fields})
+
+    def turn(self, **fields):
+        self._record_json(TURN, fields)
+
+    def flush(self, final: bool = False):
+        if self._buffer or final:
+            self._sink.submit(self.path, bytes(self._buffer), final)
+            self._buffer.clear()
+
+    def close(self):
+        self.flush(final=True)
+
+
+class TraceSink:
+    """Ghi các khối trace ra đĩa trên một thread nền dùng chung, giới hạn số file như AudioArchiveSink."""
+    def __init__(self, folder: str = None, max_files: int = None, queue_size: int = None):
+        self.folder = Path(folder or cfg.TRACE_DIR)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.max_files = max_files or cfg.TRACE_MAX_FILES
+        self.sessions = 0
+        self.dropped = 0
+        self.written_bytes = 0
+        # Chỉ file của phiên đã đóng mới vào danh sách xoay vòng, không xóa trace đang ghi
+        self._files = deque(sorted(str(p) for p in self.folder.glob("trace_*.ptrace")))
+        self._queue = queue.Queue(maxsize=queue_size or cfg.TRACE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._writer_loop, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def open_session(self, device_id: str, **header) -> TraceSession:
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+        safe_device = "".join(ch for ch in device_id if ch.isalnum() or ch in "-_") or "device"
+        path = self.folder / f"trace_{timestamp}_{safe_device}_{uuid.uuid4().hex[:8]}.ptrace"
+        self.sessions += 1
+        return TraceSession(self, path, {"device_id": device_id, "started_at": time.time(), **header})
+
+    def submit(self, path: Path, data: bytes, final: bool = False):
+        """Không chặn. Mỗi khối chỉ chứa record trọn vẹn nên bỏ một khối khi hàng đợi đầy không làm hỏng file."""
+        try:
+            self._queue.put_nowait((path, data, final))
+        except queue.Full:
+            self.dropped += 1
+            print("⚠️  Trace queue full, chunk dropped")
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, data, final = item
+            try:
+                if data:
+                    with open(path, "ab") as f:
+                        f.write(data)
+                    self.written_bytes += len(data)
+                if final and path.exists():
+                    self._files.append(str(path))
+                    self._rotate()
+            except Exception as e:
+                print(f"Error writing trace {path}: {e}")
+
+    def _rotate(self):
+        while len(self._files) > self.max_files:
+            oldest = self._files.popleft()
+            try:
+                os.remove(oldest)
+            except OSError as e:
+                print(f"⚠️  Failed to remove old trace {oldest}: {e}")
+
+    def stats(self) -> dict:
+        return {"sessions": self.sessions, "written_bytes": self.written_bytes,
+                "dropped": self.dropped, "queued": self._queue.qsize()}
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+def trace_files(path) -> list:
+    """File .ptrace hoặc mọi file .ptrace trong thư mục."""
+    path = Path(path)
+    return sorted(path.glob("*.ptrace")) if path.is_dir() else [path]
+
+
+def read_trace(path):
+    """Yield TraceRecord(kind, t, payload); payload JSON/text đã được giải mã, AUDIO_OUT là số byte."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: không phải file trace")
+        while True:
+            head = f.read(_RECORD.size)
+            if len(head) < _RECORD.size:
+                return
+            kind, t, size = _RECORD.unpack(head)
+            payload = f.read(size)
+            if len(payload) < size:
+                # File bị cắt giữa chừng (server dừng đột ngột)
+                return
+            if kind in _JSON_KINDS:
+                payload = json.loads(payload)
+            elif kind in _TEXT_KINDS:
+                payload = payload.decode("utf-8")
+            elif kind == AUDIO_OUT:
+                payload = _COUNT.unpack(payload)[0]
+            yield TraceRecord(kind, t, payload)
+
+
+def load_turns(path) -> list:
+    """Các lượt hội thoại (record TURN) trong một file hoặc thư mục trace, theo thứ tự ghi."""
+    turns = []
+    for trace_path in trace_files(path):
+        turns += [record.payload for record in read_trace(trace_path) if record.kind == TURN]
+    return turns
+
+
+class TraceReplyLLM:
+    """
+    Thay LLMEngine khi replay trace (llm_settings.LLM_STUB_TRACE): trả lại đúng các câu đã ghi cho transcript tương ứng,
+    kèm độ trễ emotion/RAG/LLM đã ghi, để thay đổi ở VAD, STT, TTS được đo trên cùng lưu lượng thật mà không gọi API.
+    Transcript không khớp chính xác (STT đã thay đổi) thì dùng lượt có transcript gần nhất.
+    """
+    def __init__(self, path, replay_latency: bool = True):
+        self.turns = load_turns(path)
+        if not self.turns:
+            raise ValueError(f"Không có lượt hội thoại nào trong trace {path}")
+        self.replay_latency = replay_latency
+        self._by_text = {normalize_transcript(turn["input_text"]): turn for turn in self.turns}
+        self.hits = 0
+        self.fuzzy_hits = 0
+        print(f"  🧪 LLM stub: {len(self.turns)} lượt từ trace {path}")
+
+    def _lookup(self, text: str) -> dict:
+        key = normalize_transcript(text)
+        turn = self._by_text.get(key)
+        if turn is not None:
+            self.hits += 1
+            return turn
+        self.fuzzy_hits += 1
+        closest = difflib.get_close_matches(key, list(self._by_text), n=1, cutoff=0.0)
+        return self._by_text[closest[0]] if closest else self.turns[0]
+
+    def _sleep(self, seconds: float):
+        if self.replay_latency and seconds > 0:
+            time.sleep(seconds)
+
+    def commit_turn(self, session_id: str, user_text: str, reply: str, emotion_code=None):
+        pass
+
+    def chat(self, text: str, session_id: str = "default", use_rag: bool = True, commit: bool = True):
+        turn = self._lookup(text)
+        timings = turn.get("timings", {})
+        self._sleep(sum(timings.get(stage, 0.0) for stage in ("emotion", "rag", "llm_total")))
+        reply = turn["response_text"]
+        return reply, {"user_chat": text, "bot_chat": reply, "emotion": turn.get("emotion")}
+
+    def chat_stream(self, text: str, session_id: str = "default", use_rag: bool = True, commit: bool = True):
+        """Cùng chuỗi sự kiện với LLMEngine.chat_stream; các câu được trả về theo nhịp đã ghi."""
+        turn = self._lookup(text)
+        timings = turn.get("timings", {})
+        for stage in ("emotion", "rag"):
+            if stage in timings:
+                self._sleep(timings[stage])
+                yield "timing", {"stage": stage, "value": timings[stage]}
+        yield "emotion", turn.get("emotion")
+
+        sentences = turn.get("sentences") or [turn["response_text"]]
+        first_token = timings.get("llm_first_token", 0.0)
+        # Phần còn lại của thời gian LLM chia đều cho các câu
+        per_sentence = max(0.0, timings.get("llm_total", first_token) - first_token) / len(sentences)
+        self._sleep(first_token)
+        yield "timing", {"stage": "llm_first_token", "value": first_token}
+        for sentence in sentences:
+            self._sleep(per_sentence)
+            yield "sentence", sentence
+        yield "timing", {"stage": "llm_total", "value": timings.get("llm_total", first_token)}
+        yield "done", {"user_chat": text, "bot_chat": turn["response_text"], "emotion": turn.get("emotion")}
@@ -4,7 +4,9 @@ Model: ZipVoice
 """
 import sys
 import json
+import uuid
 from pathlib import Path
+import numpy as np
 import torch
 import soundfile as sf
 from settings import tts_settings as cfg
@@ -81,7 +83,7 @@ class TTSEngine:
             print("  ✓ Model ZipVoice chính đã được tải lên GPU.")
 
             # --- 4. Khởi tạo Vocoder ---
-            self.vocoder = Vocos.from_pretrained("charactr/vocos-mel-24khz")
+            self.vocoder = self._load_vocoder()
             self.vocoder.to(self.device)
             self.vocoder.eval()
             print("  ✓ Vocoder đã được tải lên GPU.")
@@ -98,6 +100,7 @@ class TTSEngine:
             raise
 
         cfg.OUTPUT_AUDIO_DIR.mkdir(parents=True, exist_ok=True)
+        self._prompt_cache = {}
 
     def _validate_setup(self):
         if not cfg.ZIPVOICE_CODE_DIR.exists():
@@ -105,6 +108,22 @@ class TTSEngine:
         if not cfg.MODEL_DIR.exists():
             raise FileNotFoundError(f"Thư mục model ZipVoice không tìm thấy: {cfg.MODEL_DIR}")
 
+    def _load_vocoder(self):
+        """Vocos từ VOCOS_MODEL_DIR (không cần mạng); chỉ tải từ HuggingFace khi được cho phép."""
+        config_path = cfg.VOCOS_MODEL_DIR / "config.yaml"
+        weights_path = cfg.VOCOS_MODEL_DIR / "pytorch_model.bin"
+        if config_path.exists() and weights_path.exists():
+            vocoder = Vocos.from_hparams(str(config_path))
+            vocoder.load_state_dict(torch.load(str(weights_path), map_location="cpu"))
+            return vocoder
+        if not cfg.ALLOW_MODEL_DOWNLOAD:
+            raise FileNotFoundError(
+                f"Không tìm thấy vocoder tại {cfg.VOCOS_MODEL_DIR} (cần config.yaml + pytorch_model.bin). "
+                f"Tải {cfg.VOCOS_REPO_ID} về thư mục này hoặc đặt ALLOW_MODEL_DOWNLOAD=1"
+            )
+        print(f"  ⚠️  Tải vocoder từ HuggingFace: {cfg.VOCOS_REPO_ID}")
+        return Vocos.from_pretrained(cfg.VOCOS_REPO_ID)
+
     def _find_checkpoint(self) -> Path:
         for ext in cfg.CHECKPOINT_EXTENSIONS:
             files = list(cfg.MODEL_DIR.glob(f"*{ext}"))
@@ -112,13 +131,12 @@ class TTSEngine:
                 return files[0]
         raise FileNotFoundError(f"Không tìm thấy file checkpoint trong '{cfg.MODEL_DIR}'")
 
-    @torch.inference_mode()
-    def synthesize(self, text: str, output_path: str = None, ref_audio: str = None, prompt_text: str = None) -> Path:
-        output_wav_path = Path(output_path) if output_path else cfg.OUTPUT_AUDIO_DIR / "output.wav"
-        ref_audio_path = ref_audio or cfg.DEFAULT_REF_AUDIO
-        prompt_text = prompt_text or cfg.DEFAULT_PROMPT_TEXT
-        
-        print(f"🔊 Đang tổng hợp giọng nói trên '{self.device}': '{text[:40]}...'")
+    def _prepare_prompt(self, ref_audio_path, prompt_text):
+        """Chuẩn bị audio prompt + token prompt, cache lại vì giọng tham chiếu hầu như không đổi."""
+        cache_key = (str(ref_audio_path), prompt_text)
+        cached = self._prompt_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
         # --- 1. Chuẩn bị Audio Prompt ---
         prompt_wav = load_prompt_wav(str(ref_audio_path), sampling_rate=self.sampling_rate)
@@ -127,19 +145,28 @@ class TTSEngine:
         prompt_features = self.feature_extractor.extract(prompt_wav, sampling_rate=self.sampling_rate).to(self.device)
         prompt_features = prompt_features.unsqueeze(0) * 0.1 # feat_scale
 
-        # --- 2. Chuẩn bị Text ---
-        text = add_punctuation(text)
         prompt_text = add_punctuation(prompt_text)
-        tokens_str = self.tokenizer.texts_to_tokens([text])[0]
         prompt_tokens_str = self.tokenizer.texts_to_tokens([prompt_text])[0]
         prompt_tokens = self.tokenizer.tokens_to_token_ids([prompt_tokens_str])
+
+        self._prompt_cache[cache_key] = (prompt_features, prompt_rms, prompt_tokens)
+        return self._prompt_cache[cache_key]
+
+    def _generate_chunks(self, text: str, ref_audio: str = None, prompt_text: str = None):
+        """Generator: lần lượt trả về waveform (tensor) của từng đoạn text ngay khi vocoder xong."""
+        ref_audio_path = ref_audio or cfg.DEFAULT_REF_AUDIO
+        prompt_text = prompt_text or cfg.DEFAULT_PROMPT_TEXT
+        prompt_features, prompt_rms, prompt_tokens = self._prepare_prompt(ref_audio_path, prompt_text)
+
+        # --- 2. Chuẩn bị Text ---
+        text = add_punctuation(text)
+        tokens_str = self.tokenizer.texts_to_tokens([text])[0]
         
         # Chia text thành các đoạn nhỏ để tránh OOM và cải thiện chất lượng
         chunked_tokens_str = chunk_tokens_punctuation(tokens_str, max_tokens=100)
         chunked_tokens = self.tokenizer.tokens_to_token_ids(chunked_tokens_str)
         
         # --- 3. Tổng hợp đặc trưng âm thanh (acoustic features) ---
-        wav_chunks = []
         for tokens_chunk in chunked_tokens:
             batch_tokens = [tokens_chunk]
             batch_prompt_tokens = prompt_tokens * len(batch_tokens)
@@ -162,7 +189,16 @@ class TTSEngine:
                 wav = self.vocoder.decode(pred_features[i].unsqueeze(0)).squeeze(1).clamp(-1, 1)
                 if prompt_rms < 0.1:
                     wav = wav * prompt_rms / 0.1
-                wav_chunks.append(wav)
+                yield wav
+
+    @torch.inference_mode()
+    def synthesize(self, text: str, output_path: str = None, ref_audio: str = None, prompt_text: str = None) -> Path:
+        # Mỗi lần gọi một file riêng: các job chạy song song trong pool không ghi đè output của nhau
+        output_wav_path = Path(output_path) if output_path else cfg.OUTPUT_AUDIO_DIR / f"output_{uuid.uuid4().hex}.wav"
+        
+        print(f"🔊 Đang tổng hợp giọng nói trên '{self.device}': '{text[:40]}...'")
+
+        wav_chunks = list(self._generate_chunks(text, ref_audio, prompt_text))
         
         # --- 5. Nối các đoạn audio và lưu file ---
         final_wav = cross_fade_concat(wav_chunks, fade_duration=0.1, sample_rate=self.sampling_rate)
@@ -173,6 +209,53 @@ class TTSEngine:
         print(f"✅ File âm thanh đã được tạo: {output_wav_path}")
         return output_wav_path
 
+    def _to_output_rate(self, wav: torch.Tensor, sample_rate: int) -> np.ndarray:
+        samples = wav.cpu().squeeze().numpy().astype(np.float32)
+        if sample_rate != self.sampling_rate and len(samples):
+            new_len = int(len(samples) * sample_rate / self.sampling_rate)
+            samples = np.interp(
+                np.linspace(0, 1, new_len),
+                np.linspace(0, 1, len(samples)),
+                samples
+            ).astype(np.float32)
+        return samples
+
+    @staticmethod
+    def _to_pcm16(samples: np.ndarray) -> bytes:
+        return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+    @torch.inference_mode()
+    def synthesize_stream(self, text: str, ref_audio: str = None, prompt_text: str = None,
+                          sample_rate: int = None, fade_duration: float = 0.1):
+        """
+        Generator: yield PCM16 mono (bytes) của từng đoạn ngay sau khi vocoder xong.
+        Phần đuôi `fade_duration` giây của mỗi đoạn được giữ lại để cross-fade với đoạn kế tiếp.
+        """
+        sample_rate = sample_rate or cfg.OUTPUT_SAMPLE_RATE
+        fade_len = int(fade_duration * sample_rate)
+        tail = None
+
+        print(f"🔊 Đang stream giọng nói trên '{self.device}': '{text[:40]}...'")
+        for wav in self._generate_chunks(text, ref_audio, prompt_text):
+            wav = remove_silence(wav, self.sampling_rate, only_edge=(not cfg.REMOVE_LONG_SIL))
+            samples = self._to_output_rate(wav, sample_rate)
+            if tail is not None:
+                overlap = min(len(tail), len(samples))
+                if overlap:
+                    fade_in = np.linspace(0.0, 1.0, overlap, dtype=np.float32)
+                    samples = samples.copy()
+                    samples[:overlap] = tail[len(tail) - overlap:] * (1.0 - fade_in) + samples[:overlap] * fade_in
+                    tail = tail[:len(tail) - overlap]
+                if len(tail):
+                    yield self._to_pcm16(tail)
+            if len(samples) > fade_len:
+                yield self._to_pcm16(samples[:len(samples) - fade_len])
+                tail = samples[len(samples) - fade_len:]
+            else:
+                tail = samples
+        if tail is not None and len(tail):
+            yield self._to_pcm16(tail)
+
 
 if __name__ == '__main__':
     print("\n" + "="*80)
@@ -1,9 +1,14 @@
+import os
 from pathlib import Path
 
 # ===== Model Paths =====
 ROOT_DIR = Path(__file__).resolve().parent.parent
 ZIPVOICE_CODE_DIR = ROOT_DIR / "ZipVoice"
 MODEL_DIR = ROOT_DIR / "models" / "ZipVoice"
+# Vocoder tải từ thư mục local (config.yaml + pytorch_model.bin của charactr/vocos-mel-24khz)
+VOCOS_MODEL_DIR = ROOT_DIR / "models" / "vocos-mel-24khz"
+VOCOS_REPO_ID = "charactr/vocos-mel-24khz"  # Chỉ dùng khi ALLOW_MODEL_DOWNLOAD=1 và thiếu thư mục local
+ALLOW_MODEL_DOWNLOAD = os.getenv("ALLOW_MODEL_DOWNLOAD", "0") == "1"
 
 # ===== Audio Files =====
 REF_AUDIO_DIR = ROOT_DIR / "data"
@@ -0,0 +1,248 @@
+"""
+Batched Silero VAD Service
+Gom frame từ nhiều kết nối WebSocket thành một lần chạy ONNX, giữ state recurrent riêng cho từng kết nối.
+EnergyGate lọc trước các frame im lặng rõ ràng để không phải chạy Silero.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from settings import server_settings as cfg
+from modules.resources import pin_current_thread
+
+
+class SileroBatchRunner:
+    """Chạy trực tiếp ONNX session của Silero với batch gồm state của nhiều kết nối."""
+    def __init__(self, session, sample_rate: int):
+        self.session = session
+        self.sample_rate = sample_rate
+        self._sr = np.array(sample_rate, dtype=np.int64)
+        input_names = {i.name for i in session.get_inputs()}
+        # Silero v5 dùng một tensor "state" + context 64 mẫu, v4 dùng cặp "h"/"c"
+        self.is_v5 = "state" in input_names
+        self.context_size = 64 if sample_rate == 16000 else 32
+
+    def new_state(self) -> dict:
+        if self.is_v5:
+            return {
+                "state": np.zeros((2, 1, 128), dtype=np.float32),
+                "context": np.zeros((1, self.context_size), dtype=np.float32),
+            }
+        return {
+            "h": np.zeros((2, 1, 64), dtype=np.float32),
+            "c": np.zeros((2, 1, 64), dtype=np.float32),
+        }
+
+    def run(self, frames: np.ndarray, states: list) -> np.ndarray:
+        """frames: (B, N) float32, states: B dict state (được cập nhật tại chỗ). Trả về B xác suất."""
+        batch = frames.shape[0]
+        if self.is_v5:
+            context = np.concatenate([s["context"] for s in states], axis=0)
+            x = np.concatenate([context, frames], axis=1)
+            state = np.concatenate([s["state"] for s in states], axis=1)
+            out, new_state = self.session.run(None, {"input": x, "state": state, "sr": self._sr})
+            for i, s in enumerate(states):
+                s["state"] = new_state[:, i:i + 1]
+                s["context"] = x[i:i + 1, -self.context_size:]
+        else:
+            h = np.concatenate([s["h"] for s in states], axis=1)
+            c = np.concatenate([s["c"] for s in states], axis=1)
+            out, hn, cn = self.session.run(None, {"input": frames, "sr": self._sr, "h": h, "c": c})
+            for i, s in enumerate(states):
+                s["h"] = hn[:, i:i + 1]
+                s["c"] = cn[:, i:i + 1]
+        return np.asarray(out, dtype=np.float32).reshape(batch, -1)[:, -1]
+
+
+class EnergyGate:
+    """Pre-gate RMS/zero-crossing với noise floor riêng của từng kết nối."""
+    # Bộ đếm chung của tất cả kết nối
+    total_gated = 0
+    total_inferred = 0
+
+    def __init__(self):
+        self.enabled = cfg.VAD_GATE_ENABLED
+        self.noise_floor = None
+        self.gated = 0
+        self.inferred = 0
+        self._calibration = []
+        self._hangover = 0
+
+    @staticmethod
+    def frame_features(frames: np.ndarray):
+        """frames: (K, N) float32 → (rms, zcr) dạng vector K phần tử."""
+        rms = np.sqrt(np.mean(np.square(frames), axis=1))
+        signs = np.signbit(frames)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / max(1, frames.shape[1] - 1)
+        return rms, zcr
+
+    def silent_mask(self, frames: np.ndarray, bypass: bool = False, features=None) -> np.ndarray:
+        """Trả về mask True cho các frame được bỏ qua Silero (coi như xác suất tiếng nói = 0).
+        `features` là (rms, zcr) đã tính sẵn bằng frame_features() nếu có."""
+        count = frames.shape[0]
+        mask = np.zeros(count, dtype=bool)
+        if self.enabled and not bypass:
+            rms, zcr = features if features is not None else self.frame_features(frames)
+            if self.noise_floor is None:
+                self._calibrate(rms)
+            else:
+                threshold = min(max(self.noise_floor * cfg.VAD_GATE_RATIO, cfg.VAD_GATE_MIN_RMS), cfg.VAD_GATE_MAX_RMS)
+                unvoiced = (zcr > cfg.VAD_GATE_ZCR_UNVOICED) & (rms > cfg.VAD_GATE_MIN_RMS)
+                mask = (rms < threshold) & ~unvoiced
+                mask = self._apply_hangover(mask)
+                self._adapt_floor(rms[mask])
+
+        gated = int(np.count_nonzero(mask))
+        self.gated += gated
+        self.inferred += count - gated
+        EnergyGate.total_gated += gated
+        EnergyGate.total_inferred += count - gated
+        return mask
+
+    def _calibrate(self, rms: np.ndarray):
+        self._calibration.extend(rms.tolist())
+        if len(self._calibration) >= cfg.VAD_GATE_CALIBRATION_FRAMES:
+            # Lấy phân vị thấp để tiếng nói lúc hiệu chuẩn không đẩy floor lên
+            self.noise_floor = float(np.percentile(self._calibration, 20))
+            self._calibration = []
+
+    def _apply_hangover(self, mask: np.ndarray) -> np.ndarray:
+        for i in range(mask.shape[0]):
+            if not mask[i]:
+                self._hangover = cfg.VAD_GATE_HANGOVER_FRAMES
+            elif self._hangover > 0:
+                mask[i] = False
+                self._hangover -= 1
+        return mask
+
+    def _adapt_floor(self, gated_rms: np.ndarray):
+        if gated_rms.size == 0:
+            return
+        level = float(np.mean(gated_rms))
+        if level < self.noise_floor:
+            # Giảm nhanh khi phòng yên tĩnh hơn, tăng chậm để tiếng nói không kéo floor lên
+            self.noise_floor = 0.5 * (self.noise_floor + level)
+        else:
+            self.noise_floor += cfg.VAD_GATE_FLOOR_ADAPT * (level - self.noise_floor)
+
+    def stats(self) -> dict:
+        return {"gated": self.gated, "inferred": self.inferred, "noise_floor": self.noise_floor}
+
+    @classmethod
+    def global_stats(cls) -> dict:
+        total = cls.total_gated + cls.total_inferred
+        return {
+            "gated": cls.total_gated,
+            "inferred": cls.total_inferred,
+            "gated_ratio": (cls.total_gated / total) if total else 0.0,
+        }
+
+
+class VADStream:
+    """State VAD của một kết nối, mọi lần suy luận đi qua BatchedVADService."""
+    def __init__(self, service: "BatchedVADService"):
+        self._service = service
+        self.state = service.runner.new_state()
+
+    async def prob(self, frame: np.ndarray) -> float:
+        return await self._service.infer(self, frame)
+
+    def reset(self):
+        self.state = self._service.runner.new_state()
+
+
+class BatchedVADService:
+    """Gom frame đang chờ của mọi kết nối và chạy một batch Silero sau mỗi vài ms."""
+    def __init__(self, vad_model, sample_rate: int, window_ms: float = None, max_batch: int = None):
+        """`vad_model` là onnxruntime.InferenceSession hoặc model ONNX của silero (có thuộc tính .session)."""
+        session = getattr(vad_model, "session", None)
+        if session is None and hasattr(vad_model, "get_inputs"):
+            session = vad_model
+        if session is None:
+            raise ValueError("❌ BatchedVADService cần Silero VAD bản ONNX (torch.hub.load(..., onnx=True))")
+        self.runner = SileroBatchRunner(session, sample_rate)
+        self.window = (window_ms if window_ms is not None else cfg.VAD_BATCH_WINDOW_MS) / 1000.0
+        self.max_batch = max_batch or cfg.VAD_MAX_BATCH
+        self._pending = []  # (stream, frame, future)
+        self._wakeup = None
+        self._task = None
+        # Một thread riêng cho ONNX để event loop không bị chặn trong lúc suy luận
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="vad", initializer=pin_current_thread, initargs=("vad",)
+        )
+        self.total_batches = 0
+        self.total_frames = 0
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._batch_loop())
+        print(f"✅ Batched VAD service started (window={self.window * 1000:.1f}ms, max_batch={self.max_batch})")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=False)
+
+    def create_stream(self) -> VADStream:
+        return VADStream(self)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.total_batches,
+            "frames": self.total_frames,
+            "avg_batch_size": (self.total_frames / self.total_batches) if self.total_batches else 0.0,
+            "pending": len(self._pending),
+        }
+
+    async def infer(self, stream: VADStream, frame: np.ndarray) -> float:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((stream, frame, future))
+        self._wakeup.set()
+        return await future
+
+    def _take_batch(self) -> list:
+        # Mỗi stream chỉ một frame trong một batch vì state recurrent phải cập nhật tuần tự
+        batch, rest, seen = [], [], set()
+        for item in self._pending:
+            if len(batch) < self.max_batch and id(item[0]) not in seen:
+                seen.add(id(item[0]))
+                batch.append(item)
+            else:
+                rest.append(item)
+        self._pending = rest
+        return batch
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            if len(self._pending) < self.max_batch:
+                await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            batch = [item for item in self._take_batch() if not item[2].cancelled()]
+            if self._pending:
+                self._wakeup.set()
+            if not batch:
+                continue
+
+            frames = np.stack([item[1] for item in batch]).astype(np.float32, copy=False)
+            states = [item[0].state for item in batch]
+            try:
+                probs = await loop.run_in_executor(self._executor, self.runner.run, frames, states)
+            except Exception as e:
+                print(f"❌ Batched VAD inference failed: {e}")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.total_batches += 1
+            self.total_frames += len(batch)
+            for (_, _, future), prob in zip(batch, probs):
+                if not future.done():
+                    future.set_result(float(prob))
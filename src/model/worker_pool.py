@@ -0,0 +1,220 @@
+"""
+Bounded Worker Pool cho Voice Assistant Pipeline
+Chạy STT → LLM → TTS trên thread/process pool để event loop không bị chặn
+"""
+import asyncio
+import os
+import threading
+import zlib
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from settings import server_settings as cfg
+from modules.resources import pin_current_thread, threads_for
+
+# Pipeline riêng của từng process worker (chỉ dùng ở chế độ "process")
+_worker_pipeline = None
+
+
+def _init_process_worker():
+    global _worker_pipeline
+    pin_current_thread("pipeline")
+    from modules.model_loader import load_pipeline
+    _worker_pipeline = load_pipeline()
+
+
+def _run_in_process_worker(method: str, kwargs: dict):
+    return getattr(_worker_pipeline, method)(**kwargs)
+
+
+# Đánh dấu item / kết thúc / lỗi khi chuyển item của generator từ worker về event loop
+_STREAM_ITEM = "__item__"
+_STREAM_END = "__end__"
+_STREAM_ERROR = "__error__"
+
+
+def _produce_stream(generator, put, cancel_event=None):
+    try:
+        for item in generator:
+            if cancel_event is not None and cancel_event.is_set():
+                # Phía server đã hủy (barge-in): đóng generator để pipeline dừng LLM/TTS
+                generator.close()
+                break
+            put((_STREAM_ITEM, item))
+    except Exception as e:
+        put((_STREAM_ERROR, e))
+    else:
+        put((_STREAM_END, None))
+
+
+def _stream_in_process_worker(method: str, kwargs: dict, out_queue, cancel_event):
+    def put(item):
+        if item[0] == _STREAM_ERROR:
+            # Exception có thể không pickle được, chỉ gửi mô tả lỗi
+            item = (_STREAM_ERROR, RuntimeError(repr(item[1])))
+        out_queue.put(item)
+    _produce_stream(getattr(_worker_pipeline, method)(**kwargs), put, cancel_event)
+
+
+class PipelineBusyError(RuntimeError):
+    """Pool đã đủ job đang chạy và hàng đợi đã đầy"""
+
+
+def recommended_max_workers() -> int:
+    """Số worker tối đa để các lượt STT/TTS chạy song song không giành core của nhau."""
+    return threads_for("pipeline")
+
+
+class PipelineWorkerPool:
+    """Gửi các job pipeline sang thread/process pool có giới hạn và theo dõi độ sâu hàng đợi."""
+    def __init__(self, pipeline=None, mode: str = None, max_workers: int = None, max_queue: int = None):
+        self.mode = mode or cfg.PIPELINE_EXECUTOR
+        self.max_workers = max_workers or cfg.PIPELINE_MAX_WORKERS or recommended_max_workers()
+        self.max_queue = cfg.PIPELINE_MAX_QUEUE if max_queue is None else max_queue
+        self._pipeline = pipeline
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+
+        self._manager = None
+        self._readers = None
+        if self.mode == "process":
+            # Queue của Manager dùng để chuyển item từ generator trong process worker về
+            self._manager = multiprocessing.get_context("spawn").Manager()
+            # Mỗi stream đang chạy giữ một thread chờ out_queue.get(); dùng executor riêng đủ cho mọi job được nhận
+            # để không chiếm default executor của event loop (STT, lưu audio, ...)
+            self._readers = ThreadPoolExecutor(
+                max_workers=self.max_workers + self.max_queue, thread_name_prefix="pipeline-stream",
+            )
+            # Mỗi worker process giữ SessionManager (lịch sử hội thoại) của riêng nó, nên mỗi process có executor
+            # riêng và mọi job cùng session_id luôn chạy ở cùng một process (xem _executor_for)
+            self._executors = [
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_process_worker,
+                )
+                for _ in range(self.max_workers)
+            ]
+            self._round_robin = itertools.cycle(self._executors)
+        elif self.mode == "thread":
+            if pipeline is None:
+                raise ValueError("❌ Chế độ 'thread' cần một VoiceAssistantPipeline đã khởi tạo")
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="pipeline",
+                initializer=pin_current_thread, initargs=("pipeline",),
+            )
+            self._executors = [self._executor]
+        else:
+            raise ValueError(f"❌ PIPELINE_EXECUTOR không hợp lệ: {self.mode}")
+        print(f"✅ Pipeline worker pool: mode={self.mode}, max_workers={self.max_workers}, max_queue={self.max_queue}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = self._pending
+            rejected = self._rejected
+        return {
+            "mode": self.mode,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "running": min(pending, self.max_workers),
+            "queued": max(0, pending - self.max_workers),
+            "rejected": rejected,
+        }
+
+    def _acquire(self):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise PipelineBusyError(
+                    f"Pipeline pool đang quá tải ({self._pending} job, giới hạn {self.max_workers + self.max_queue})"
+                )
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _executor_for(self, kwargs: dict):
+        """Chế độ "process": cùng session_id → cùng process (băm ổn định giữa các lần chạy), job không có
+        session_id chia vòng tròn. Hai phiên trùng process thì xếp hàng nhau dù process khác đang rảnh."""
+        session_id = kwargs.get("session_id")
+        if session_id is None:
+            with self._lock:
+                return next(self._round_robin)
+        return self._executors[zlib.crc32(str(session_id).encode("utf-8")) % len(self._executors)]
+
+    def _run_local(self, method: str, kwargs: dict):
+        return getattr(self._pipeline, method)(**kwargs)
+
+    async def run(self, method: str = "process", **kwargs):
+        """Chạy `pipeline.<method>(**kwargs)` trong pool, raise PipelineBusyError nếu hàng đợi đầy."""
+        self._acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            if self.mode == "process":
+                return await loop.run_in_executor(self._executor_for(kwargs), _run_in_process_worker, method, kwargs)
+            return await loop.run_in_executor(self._executor, self._run_local, method, kwargs)
+        finally:
+            self._release()
+
+    async def stream(self, method: str = "process_stream", **kwargs):
+        """Chạy generator `pipeline.<method>(**kwargs)` trong pool, yield từng item ngay khi worker tạo ra.
+        Nếu bên gọi dừng sớm (hủy task), worker được báo dừng ở item kế tiếp."""
+        self._acquire()
+        loop = asyncio.get_running_loop()
+        future = None
+        try:
+            if self.mode == "process":
+                out_queue = self._manager.Queue()
+                cancel_event = self._manager.Event()
+                future = loop.run_in_executor(
+                    self._executor_for(kwargs), _stream_in_process_worker, method, kwargs, out_queue, cancel_event
+                )
+                get = lambda: loop.run_in_executor(self._readers, out_queue.get)
+            else:
+                items = asyncio.Queue()
+                cancel_event = threading.Event()
+                put = lambda item: loop.call_soon_threadsafe(items.put_nowait, item)
+                generator = getattr(self._pipeline, method)(**kwargs)
+                future = loop.run_in_executor(self._executor, _produce_stream, generator, put, cancel_event)
+                get = items.get
+
+            while True:
+                marker, item = await get()
+                if marker == _STREAM_END:
+                    break
+                if marker == _STREAM_ERROR:
+                    raise item
+                yield item
+            await future
+        finally:
+            if future is not None and not future.done():
+                # Worker vẫn còn chạy nốt đoạn hiện tại, chỉ giải phóng slot khi nó thực sự dừng
+                cancel_event.set()
+                future.add_done_callback(lambda _: self._release())
+            else:
+                self._release()
+
+    def events(self, **kwargs):
+        """Async iterator các sự kiện có kiểu (modules.events) của một lượt pipeline.process_stream(**kwargs)."""
+        return self.stream("process_stream", **kwargs)
+
+    def prestart(self):
+        """Chế độ "process": khởi động (tải + warm-up model) mọi worker ngay, thay vì ở câu nói đầu tiên.
+        Chặn cho đến khi xong, gọi từ thread nền."""
+        if self.mode != "process":
+            return
+        # Gửi đồng thời một job rỗng cho mỗi executor để process của nó được tạo ngay
+        futures = [executor.submit(os.getpid) for executor in self._executors]
+        pids = {future.result() for future in futures}
+        print(f"✅ {len(pids)} pipeline worker process đã sẵn sàng")
+
+    def shutdown(self):
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self._readers:
+            self._readers.shutdown(wait=False, cancel_futures=True)
+        if self._manager:
+            self._manager.shutdown()
@@ -0,0 +1,134 @@
+# --- Multi-worker launcher cho vad_server ---
+# Tải trọng số nặng (ZipVoice + Vocos, Silero) MỘT lần ở process cha rồi fork N worker uvicorn.
+# Các worker dùng chung trọng số theo copy-on-write thay vì mỗi worker một bản trong RAM.
+#
+#   python launcher.py                 # số worker theo khuyến nghị
+#   python launcher.py --workers 4 --port 8000
+#
+# Chỉ chạy trên Linux/macOS (os.fork). Launcher luôn dùng PIPELINE_EXECUTOR=thread trong mỗi worker.
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+
+# Phải đặt trước khi import settings: mỗi worker chạy pipeline trên thread pool của chính nó
+os.environ["PIPELINE_EXECUTOR"] = "thread"
+# Kiểm tra GPU qua NVML để process cha không khởi tạo CUDA (CUDA không dùng lại được sau fork)
+os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+
+import torch
+import uvicorn
+
+import vad_server
+from modules.worker_pool import recommended_max_workers
+from settings import server_settings as server_cfg
+
+
+def recommended_worker_count() -> int:
+    """Một worker cho mỗi lượt STT/TTS chạy song song được (cores / số thread mỗi lượt)."""
+    return recommended_max_workers()
+
+
+def preload_shared_models():
+    """Tải ở process cha các model an toàn khi fork (không giữ thread nền, không giữ kết nối mạng).
+    STT (thread pool của onnxruntime), streaming STT (thread giải mã) và LLM (gRPC) được tải trong từng worker."""
+    if torch.cuda.is_available():
+        # CUDA context không dùng được sau fork; trên GPU mỗi worker phải tự tải model
+        print("⚠️  Có CUDA: bỏ qua tải trước, mỗi worker tự tải model (không chia sẻ trọng số).")
+        return
+    # Chưa để torch tạo pool OpenMP ở process cha (pool không còn dùng được sau fork);
+    # mỗi worker đặt số thread TTS thật khi tải xong (resources.apply_torch_threads)
+    torch.set_num_threads(1)
+    vad_server.model_loader.preload(server_cfg.LAUNCHER_PRELOAD_MODELS)
+    print(f"✅ Đã tải trước ở process cha: {sorted(vad_server.model_loader.models)}")
+    # Đưa toàn bộ object hiện có vào generation vĩnh viễn: GC của worker không ghi lên header của
+    # chúng nữa, các trang bộ nhớ chứa model không bị copy-on-write vô ích
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(sock: socket.socket, host: str, port: int, pool_workers: int):
+    server_cfg.PIPELINE_MAX_WORKERS = pool_workers
+    config = uvicorn.Config(vad_server.app, host=host, port=port, log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run vad_server with N forked workers sharing preloaded models.")
+    parser.add_argument("--host", type=str, default=server_cfg.LAUNCHER_HOST)
+    parser.add_argument("--port", type=int, default=server_cfg.LAUNCHER_PORT)
+    parser.add_argument("--workers", type=int, default=server_cfg.LAUNCHER_WORKERS,
+                        help="Số worker process (0 = theo khuyến nghị)")
+    args = parser.parse_args()
+
+    recommended = recommended_worker_count()
+    workers = args.workers or recommended
+    # Chia đều số lượt pipeline song song của cả máy cho các worker
+    pool_workers = max(1, recommended // workers)
+    # Từ đây ngân sách thread (TTS, ...) tính trên phần core của một worker, không phải cả máy
+    server_cfg.SERVER_PROCESSES = workers
+    print(f"🖥️  {os.cpu_count()} cores → khuyến nghị {recommended} worker; chạy {workers} worker × {pool_workers} pipeline")
+
+    preload_shared_models()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                run_worker(sock, args.host, args.port, pool_workers)
+            finally:
+                os._exit(0)
+        children[pid] = True
+        print(f"🚀 Worker {pid} started")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        spawn()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        children.pop(pid, None)
+        if not stopping:
+            # Worker chết bất thường: fork lại từ process cha, model đã có sẵn nên khởi động nhanh
+            print(f"⚠️  Worker {pid} exited ({status}), restarting")
+            time.sleep(1)
+            spawn()
+
+    sock.close()
+    print("Launcher stopped.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,30 @@
 # --- START OF FILE main.py ---
 
 import asyncio
-import wave
-from datetime import datetime
+import json
+import time
+import traceback
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-import os
-import torch
-from collections import deque
+from fastapi.responses import JSONResponse, PlainTextResponse
 import numpy as np
 
 # --- IMPORT PIPELINE TỪ THƯ MỤC MODULES ---
-from modules.pipeline import VoiceAssistantPipeline
+from modules.model_loader import ModelLoader
+from modules import resources
+from modules.worker_pool import PipelineWorkerPool, PipelineBusyError
+from modules.vad_service import BatchedVADService, EnergyGate
+from modules.audio_archive import AudioArchiveSink
+from modules.trace import TraceSink, TraceSession
+from modules.audio_buffer import ConnectionAudioBuffers, FrameAssembler
+from modules.adpcm import AdpcmCodec
+from modules.endpointing import AdaptiveEndpointer, EndpointConfig, ENDPOINT_FINAL, ENDPOINT_PROVISIONAL
+from modules.speculation import SpeculativeResponse
+from modules.events import (
+    TranscriptPartial, TranscriptFinal, Emotion, ResponseDelta, AudioChunk, StageTiming, Done, Error,
+    to_client_message,
+)
+from modules.metrics import REGISTRY, RTF_BUCKETS
+from settings import server_settings as server_cfg
 
 # --- Cấu hình ---
 SAMPLE_RATE = 16000
@@ -23,139 +37,455 @@ VAD_FRAME_MS = 30
 VAD_CHUNK_SIZE = (SAMPLE_RATE * VAD_FRAME_MS // 1000) * BIT_DEPTH_BYTES
 VAD_SPEECH_THRESHOLD = 0.5
 VAD_SILENCE_FRAMES_TRIGGER = 1
-VAD_SILENCE_FRAMES_END = 25
+VAD_SILENCE_FRAMES_END = 25  # Cửa sổ im lặng cố định cũ, nay dùng AdaptiveEndpointer (giữ làm mốc so sánh)
 VAD_BUFFER_FRAMES = 5
+MAX_UTTERANCE_FRAMES = server_cfg.MAX_UTTERANCE_SEC * 1000 // VAD_FRAME_MS
 
 app = FastAPI()
 
-print("\n... (các dòng print khởi tạo pipeline) ...\n")
-pipeline = VoiceAssistantPipeline()
-print("\n... (các dòng print pipeline ready) ...\n")
-
-try:
-    torch.set_num_threads(1)
-    vad_model, utils = torch.hub.load(repo_or_dir='snakers4/silero-vad', model='silero_vad', force_reload=False, onnx=True)
-    (get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks) = utils
-    print("Silero VAD model loaded successfully.")
-except Exception as e:
-    print(f"Error loading Silero VAD model: {e}")
-    vad_model = None
-
-def save_audio_to_wav(audio_data: bytes, folder: str = "audio_files") -> str:
-    os.makedirs(folder, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = os.path.join(folder, f"recording_{timestamp}.wav")
+# Model được tải ở startup (local, song song, có warm-up); /ready trả 503 cho đến khi xong.
+# Ở chế độ "process" mỗi worker tự tải pipeline riêng, process chính chỉ cần VAD (+ streaming STT).
+model_loader = ModelLoader(
+    load_pipeline=server_cfg.PIPELINE_EXECUTOR == "thread",
+    vad_frame_samples=VAD_CHUNK_SIZE // BIT_DEPTH_BYTES,
+)
+model_load_error = None
+pipeline_pool = None
+vad_service = None
+# Streaming STT: nhận dạng ngay trong lúc nói, transcript sẵn sàng gần như ngay khi hết câu
+streaming_stt = None
+
+def load_models():
+    """Tải model và dựng các service dùng chung (chặn, chạy trên thread nền hoặc trước khi fork worker)."""
+    global pipeline_pool, vad_service, streaming_stt
+    print(f"CPU resources: {resources.plan()}")
+    if not model_loader.ready:
+        model_loader.load()
+    pipeline_pool = PipelineWorkerPool(model_loader.pipeline)
+    pipeline_pool.prestart()
+    vad_service = BatchedVADService(model_loader.vad_session, SAMPLE_RATE)
+    streaming_stt = model_loader.streaming_stt
+
+def models_ready() -> bool:
+    return model_loader.ready and vad_service is not None and pipeline_pool is not None
+
+# Lưu câu nói ra đĩa là tùy chọn và chạy nền, pipeline nhận audio trực tiếp trong bộ nhớ
+archive_sink = None
+# Ghi trace từng phiên để replay (tools/replay_trace.py), tắt mặc định
+trace_sink = None
+
+def start_sinks():
+    """Tạo các sink ghi đĩa (mỗi sink có thread ghi riêng) trong process sẽ phục vụ request.
+    Gọi ở startup, không phải lúc import: launcher import module này ở process cha rồi mới fork worker,
+    thread tạo trước fork không còn chạy trong worker."""
+    global archive_sink, trace_sink
+    if server_cfg.ARCHIVE_UTTERANCES and archive_sink is None:
+        archive_sink = AudioArchiveSink(sample_rate=SAMPLE_RATE, sample_width=BIT_DEPTH_BYTES, channels=CHANNELS)
+    if server_cfg.TRACE_CAPTURE and trace_sink is None:
+        trace_sink = TraceSink()
+
+# --- Metrics (GET /metrics, định dạng Prometheus) ---
+VAD_FRAME_SECONDS = REGISTRY.histogram(
+    "voice_vad_frame_seconds", "Thời gian chờ xác suất VAD của một frame (gồm cửa sổ gom batch)")
+ENDPOINT_TO_TRANSCRIPT_SECONDS = REGISTRY.histogram(
+    "voice_endpoint_to_transcript_seconds", "Từ lúc xác nhận hết câu đến khi có transcript")
+ENDPOINT_TO_FIRST_AUDIO_SECONDS = REGISTRY.histogram(
+    "voice_endpoint_to_first_audio_seconds", "Từ lúc xác nhận hết câu đến khi gửi byte audio đầu tiên")
+# Các bước bên trong pipeline, nhận qua sự kiện ("timing", {"stage", "value"})
+STAGE_HISTOGRAMS = {
+    "stt": REGISTRY.histogram("voice_stt_seconds", "STT offline trên cả câu"),
+    "emotion": REGISTRY.histogram("voice_emotion_seconds", "Phân tích cảm xúc"),
+    "rag": REGISTRY.histogram("voice_rag_search_seconds", "Tìm kiếm RAG"),
+    "llm_first_token": REGISTRY.histogram("voice_llm_first_token_seconds", "LLM time-to-first-token"),
+    "llm_total": REGISTRY.histogram("voice_llm_total_seconds", "LLM toàn bộ câu trả lời"),
+    "tts_chunk": REGISTRY.histogram("voice_tts_chunk_seconds", "Thời gian tổng hợp một đoạn TTS"),
+    "tts_rtf": REGISTRY.histogram("voice_tts_rtf", "Real-time factor TTS của một câu", RTF_BUCKETS),
+}
+CONNECTED_DEVICES = REGISTRY.gauge("voice_connected_devices", "Số thiết bị đang kết nối WebSocket")
+REGISTRY.gauge("voice_pipelines_active", "Số lượt pipeline đang chạy",
+               lambda: pipeline_pool.stats()["running"] if pipeline_pool else 0)
+REGISTRY.gauge("voice_pipeline_queue_depth", "Số lượt pipeline đang chờ worker",
+               lambda: pipeline_pool.stats()["queued"] if pipeline_pool else 0)
+REGISTRY.gauge("voice_vad_queue_depth", "Số frame đang chờ batch VAD",
+               lambda: vad_service.stats()["pending"] if vad_service else 0)
+REGISTRY.gauge("voice_archive_queue_depth", "Số câu nói đang chờ ghi đĩa",
+               lambda: archive_sink.stats()["queued"] if archive_sink else 0)
+
+async def send_text(websocket: WebSocket, text: str, trace: TraceSession = None):
+    await websocket.send_text(text)
+    if trace:
+        trace.text_out(text)
+
+async def send_audio_block(websocket: WebSocket, pcm: bytes, codec: AdpcmCodec = None, trace: TraceSession = None):
+    """Gửi một khối PCM16 từ TTS, mã hóa ADPCM nếu thiết bị dùng codec ADPCM."""
+    data = codec.encode(pcm) if codec else pcm
+    if trace:
+        trace.audio_out(len(pcm))
+    for offset in range(0, len(data), AUDIO_CHUNK_SIZE):
+        await websocket.send_bytes(data[offset:offset + AUDIO_CHUNK_SIZE])
+
+async def run_pipeline_and_respond(websocket: WebSocket, full_audio_data: bytes, session_id: str,
+                                   codec: AdpcmCodec = None, input_text: str = None, speculation: SpeculativeResponse = None,
+                                   endpoint_time: float = None, trace: TraceSession = None, forward_events: bool = False):
+    """Gửi câu nói vào pipeline (context hội thoại của `session_id`) và chuyển từng sự kiện về thiết bị ngay khi có:
+    mã cảm xúc ngay sau bước phân tích (robot đổi biểu cảm trong lúc LLM còn đang trả lời), audio theo từng đoạn TTS.
+    Chạy như một task riêng để handler vẫn nghe mic và có thể hủy khi người dùng ngắt lời.
+    Nếu có `speculation` đã xác nhận thì phát lại kết quả của nó thay vì chạy pipeline lần nữa; task này sở hữu
+    speculation từ đó, nên hủy task (barge-in, mất kết nối) cũng dừng lần chạy suy đoán trong worker pool.
+    `endpoint_time` (time.perf_counter() lúc xác nhận hết câu) dùng để đo độ trễ đến audio đầu tiên.
+    Với `trace`, các câu trả lời và timing LLM được ghi thành record TURN để LLM stub phát lại khi replay.
+    Với `forward_events`, các sự kiện văn bản (transcript, câu trả lời...) được gửi thêm dạng JSON."""
+    cancelled = False
+    first_audio_sent = False
+    sentences = []
+    llm_timings = {}
+    # Gửi tín hiệu bắt đầu xử lý
+    await send_text(websocket, "PROCESSING_START", trace)
+    if archive_sink:
+        archive_sink.submit(full_audio_data, session_id)
     try:
-        with wave.open(filename, 'wb') as wf:
-            wf.setnchannels(CHANNELS)
-            wf.setsampwidth(BIT_DEPTH_BYTES)
-            wf.setframerate(SAMPLE_RATE)
-            wf.writeframes(audio_data)
-        print(f"Audio received and saved to: {filename}")
-        return filename
+        if not full_audio_data:
+            return
+        # Thiết bị reset decoder ở gói binary đầu tiên của mỗi phản hồi nên encoder cũng bắt đầu lại
+        if codec:
+            codec.reset_encoder()
+        # Chạy pipeline trong worker pool, không chặn event loop
+        print(f"Pipeline pool: {pipeline_pool.stats()}")
+        if speculation:
+            events = speculation.events()
+        else:
+            events = pipeline_pool.events(
+                audio_pcm=full_audio_data, sample_rate=SAMPLE_RATE, input_text=input_text, session_id=session_id,
+            )
+        async for event in events:
+            if forward_events:
+                message = to_client_message(event)
+                if message:
+                    await send_text(websocket, json.dumps(message, ensure_ascii=False), trace)
+
+            if isinstance(event, Emotion):
+                # Gửi mã cảm xúc ("00"/"01"/"10") về client ngay, trước khi audio bắt đầu
+                if event.code:
+                    print (f"Sending emotion details: {event.code}")
+                    await send_text(websocket, event.code, trace)
+            elif isinstance(event, TranscriptFinal):
+                # Transcript từ streaming STT đã được đo ở handler, ở đây chỉ đo khi pipeline tự chạy STT
+                if endpoint_time is not None and input_text is None:
+                    ENDPOINT_TO_TRANSCRIPT_SECONDS.observe(time.perf_counter() - endpoint_time)
+            elif isinstance(event, ResponseDelta):
+                sentences.append(event.text)
+            elif isinstance(event, AudioChunk):
+                await send_audio_block(websocket, event.pcm, codec, trace)
+                if not first_audio_sent and endpoint_time is not None:
+                    ENDPOINT_TO_FIRST_AUDIO_SECONDS.observe(time.perf_counter() - endpoint_time)
+                first_audio_sent = True
+            elif isinstance(event, StageTiming):
+                histogram = STAGE_HISTOGRAMS.get(event.stage)
+                if histogram:
+                    histogram.observe(event.value)
+                if trace:
+                    trace.timing(event.stage, event.value)
+                    if event.stage in ("emotion", "rag", "llm_first_token", "llm_total"):
+                        llm_timings[event.stage] = event.value
+            elif isinstance(event, Done):
+                print(f"Pipeline finished in {event.processing_time:.2f}s")
+                if trace:
+                    trace.turn(
+                        input_text=event.input_text, response_text=event.response_text, emotion=event.emotion,
+                        sentences=sentences, timings=llm_timings,
+                    )
+                if speculation:
+                    # Lần chạy suy đoán không ghi lịch sử, ghi lại sau khi đã phát xong
+                    await pipeline_pool.run(
+                        "commit_turn", session_id=session_id, input_text=event.input_text,
+                        response_text=event.response_text, emotion_code=event.emotion,
+                    )
+            elif isinstance(event, Error):
+                print(f"An error occurred during pipeline processing: {event.message}")
+    except asyncio.CancelledError:
+        # Barge-in: handler đã gửi BARGE_IN, không gửi TTS_END nữa
+        cancelled = True
+        print("Response cancelled by barge-in.")
+        if speculation:
+            await speculation.discard(aborted=True)
+        raise
+    except PipelineBusyError as e:
+        print(f"Pipeline busy, dropping utterance: {e}")
+    # Bắt lỗi chung
     except Exception as e:
-        print(f"Error saving WAV file: {e}")
-        return ""
+        print(f"An error occurred during pipeline processing: {e}")
+    finally:
+        if not cancelled:
+            # Mẫu lẻ cuối cùng encoder còn giữ
+            if codec:
+                tail = codec.flush_encoder()
+                if tail:
+                    await websocket.send_bytes(tail)
+            # Gửi tín hiệu kết thúc TTS
+            await send_text(websocket, "TTS_END", trace)
+            # Firmware reset encoder mic sau TTS_END
+            if codec:
+                codec.reset_decoder()
+            print("Finished streaming response.")
+
+async def cancel_response(response_task: asyncio.Task):
+    """Hủy task phản hồi và chờ nó dừng hẳn (worker pool tự dừng pipeline ở item kế tiếp)."""
+    response_task.cancel()
+    await asyncio.gather(response_task, return_exceptions=True)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    print(f"Client connected from: {websocket.client.host}")
+    if not models_ready():
+        # Model chưa tải / warm-up xong: 1013 = "try again later", thiết bị sẽ tự kết nối lại
+        await websocket.close(code=1013)
+        return
+    device_id = websocket.query_params.get("device_id") or websocket.client.host
+    print(f"Client connected from: {websocket.client.host} (device_id={device_id})")
+
+    # Codec truyền tải: PCM16 thô hoặc IMA ADPCM (1/4 băng thông), thương lượng lúc kết nối
+    transport_codec = websocket.query_params.get("codec", server_cfg.DEFAULT_TRANSPORT_CODEC).lower()
+    if transport_codec not in server_cfg.TRANSPORT_CODECS:
+        transport_codec = server_cfg.DEFAULT_TRANSPORT_CODEC
+    adpcm_codec = AdpcmCodec() if transport_codec == "adpcm" else None
+    print(f"Transport codec: {transport_codec}")
+    trace = trace_sink.open_session(device_id, codec=transport_codec, sample_rate=SAMPLE_RATE) if trace_sink else None
+    # Client đăng ký ?events=1 nhận thêm sự kiện văn bản dạng JSON (transcript, câu trả lời...); firmware không cần
+    forward_events = websocket.query_params.get("events") == "1"
+    last_partial_text = None
     
     is_speaking = False
-    silence_counter = 0
     speech_trigger_counter = 0
-    is_processing = False
+    response_task = None
     
-    pre_buffer = deque(maxlen=VAD_BUFFER_FRAMES) 
-    speech_buffer = []
+    # Bộ đệm cấp phát trước: pre-roll VAD_BUFFER_FRAMES frame + câu nói tối đa MAX_UTTERANCE_FRAMES frame
+    audio_buffers = ConnectionAudioBuffers(VAD_CHUNK_SIZE, VAD_BUFFER_FRAMES, MAX_UTTERANCE_FRAMES)
+    # Payload có kích thước bất kỳ được cắt thành frame VAD_CHUNK_SIZE, phần dư giữ sang message sau
+    frame_assembler = FrameAssembler(VAD_CHUNK_SIZE)
+    vad_stream = vad_service.create_stream()
+    energy_gate = EnergyGate()
+    stt_session = None
+    speculation = None
+    endpointer = AdaptiveEndpointer(EndpointConfig.for_device(device_id), VAD_SPEECH_THRESHOLD)
+
+    def record_frame(frame) -> bool:
+        """Ghi frame vào câu nói hiện tại (và streaming STT); False khi đã chạm giới hạn độ dài."""
+        if not audio_buffers.utterance.append(frame):
+            return False
+        if stt_session:
+            stt_session.feed(frame)
+        return True
 
+    CONNECTED_DEVICES.inc()
     try:
         while True:
-            data = await websocket.receive_bytes()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
 
-            if is_processing:
+            text_msg = message.get("text")
+            if text_msg is not None:
+                if trace:
+                    trace.text_in(text_msg)
+                # Thiết bị có thể đổi codec bằng text "CODEC:ADPCM" / "CODEC:PCM16"
+                if text_msg.upper().startswith("CODEC:"):
+                    requested = text_msg.split(":", 1)[1].strip().lower()
+                    if requested in server_cfg.TRANSPORT_CODECS:
+                        transport_codec = requested
+                        adpcm_codec = AdpcmCodec() if transport_codec == "adpcm" else None
+                        frame_assembler.reset()
+                    await send_text(websocket, f"CODEC_OK:{transport_codec.upper()}", trace)
                 continue
 
-            if len(data) != VAD_CHUNK_SIZE:
+            payload = message.get("bytes")
+            if not payload:
+                continue
+            if trace:
+                trace.audio_in(payload)
+            responding = response_task is not None and not response_task.done()
+            if responding and not server_cfg.BARGE_IN_ENABLED:
                 continue
 
-            # Chuyển đổi dữ liệu chính xác
-            audio_numpy = np.frombuffer(data, dtype=np.int16)
-            audio_tensor = torch.from_numpy(audio_numpy).float() / 32768.0
-            
-            speech_prob = vad_model(audio_tensor, SAMPLE_RATE).item()
-
-            if speech_prob > VAD_SPEECH_THRESHOLD:
-                silence_counter = 0
-                if not is_speaking:
-                    speech_trigger_counter += 1
-                    if speech_trigger_counter >= VAD_SILENCE_FRAMES_TRIGGER:
-                        print("==> Voice activity detected. Start recording.")
-                        is_speaking = True
-                        speech_buffer.extend(list(pre_buffer))
-                if is_speaking:
-                    speech_buffer.append(data)
-            else:
-                speech_trigger_counter = 0
-                if is_speaking:
-                    silence_counter += 1
-                    speech_buffer.append(data)
-                    # Nếu không còn tiếng nói, kết thúc ghi âm
-                    if silence_counter >= VAD_SILENCE_FRAMES_END:
-                        print("==> Silence detected. End of utterance.")
-                        # Xử lý đoạn âm thanh đã ghi
-                        is_processing = True
-                        # Gửi tín hiệu bắt đầu xử lý
-                        await websocket.send_text("PROCESSING_START")
-                        # Gộp toàn bộ dữ liệu âm thanh
-                        full_audio_data = b"".join(speech_buffer)
-                        input_audio_path = save_audio_to_wav(full_audio_data)
-                        if input_audio_path:
-                            try:
-                                # Chạy pipeline
-                                result = pipeline.process(audio_input_path=input_audio_path)
-                                # Lấy đường dẫn file âm thanh đầu ra
-                                output_audio_path = result.get("output_audio")
-                                output_emotion = result.get("emotion_details")
-                                # Gửi thông tin phân tích cảm xúc về client
-                                if output_emotion:
-                                    print (f"Sending emotion details: {output_emotion}")
-                                    await websocket.send_text(f"{output_emotion}")
-                                
-                                # Check và gửi file âm thanh đầu ra từng phần
-                                if output_audio_path and os.path.exists(output_audio_path):
-                                    with open(output_audio_path, 'rb') as audio_file:
-                                        while True:
-                                            chunk = audio_file.read(AUDIO_CHUNK_SIZE)
-                                            if not chunk: break
-                                            await websocket.send_bytes(chunk)
-                                # Nếu không tìm thấy file âm thanh đầu ra
-                                # Gửi thông báo lỗi
-                                else:
-                                    print("Pipeline did not return a valid audio output path.")
-                            # Bắt lỗi chung
-                            except Exception as e:
-                                print(f"An error occurred during pipeline processing: {e}")
-                            finally:
-                                # Gửi tín hiệu kết thúc TTS
-                                await websocket.send_text("TTS_END")
-                                print("Finished streaming response.")
-                        is_speaking = False
-                        silence_counter = 0
-                        speech_buffer.clear()
-                        pre_buffer.clear()
-                        is_processing = False
+            if adpcm_codec:
+                payload = adpcm_codec.decode(payload)
+
+            for data in frame_assembler.feed(payload):
+                responding = response_task is not None and not response_task.done()
+                # Chuyển đổi dữ liệu chính xác
+                audio_float = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+                frame_2d = audio_float[np.newaxis, :]
+                frame_features = EnergyGate.frame_features(frame_2d)
+
+                # Frame im lặng rõ ràng bỏ qua Silero nhưng vẫn vào pre_buffer.
+                # Khi đang ghi âm thì luôn chạy Silero để không ảnh hưởng việc phát hiện kết thúc câu.
+                if energy_gate.silent_mask(frame_2d, bypass=is_speaking, features=frame_features)[0]:
+                    speech_prob = 0.0
                 else:
-                    pre_buffer.append(data)
+                    # Suy luận theo batch chung với các kết nối khác
+                    vad_start = time.perf_counter()
+                    speech_prob = await vad_stream.prob(audio_float)
+                    VAD_FRAME_SECONDS.observe(time.perf_counter() - vad_start)
+
+                end_of_utterance = False
+                if speech_prob > VAD_SPEECH_THRESHOLD:
+                    if not is_speaking:
+                        speech_trigger_counter += 1
+                        if speech_trigger_counter >= VAD_SILENCE_FRAMES_TRIGGER:
+                            print("==> Voice activity detected. Start recording.")
+                            is_speaking = True
+                            audio_buffers.start_utterance()
+                            endpointer.reset()
+                            if streaming_stt:
+                                stt_session = streaming_stt.create_session()
+                                for frame in audio_buffers.pre_roll.chunks():
+                                    stt_session.feed(frame)
+                    if is_speaking and not record_frame(data):
+                        print(f"==> Utterance reached {server_cfg.MAX_UTTERANCE_SEC}s limit. Forcing end of utterance.")
+                        end_of_utterance = True
+                else:
+                    speech_trigger_counter = 0
+                    if not is_speaking:
+                        audio_buffers.pre_roll.append(data)
+                    elif not record_frame(data):
+                        print(f"==> Utterance reached {server_cfg.MAX_UTTERANCE_SEC}s limit. Forcing end of utterance.")
+                        end_of_utterance = True
+
+                if is_speaking and not end_of_utterance:
+                    partial_text = stt_session.partial_text if stt_session else None
+                    if forward_events and partial_text and partial_text != last_partial_text:
+                        last_partial_text = partial_text
+                        await send_text(websocket, json.dumps(to_client_message(TranscriptPartial(partial_text)),
+                                                              ensure_ascii=False), trace)
+                    decision = endpointer.update(speech_prob, float(frame_features[0][0]), partial_text)
+                    # Nếu không còn tiếng nói, kết thúc ghi âm
+                    if decision == ENDPOINT_FINAL:
+                        print(f"==> Silence detected ({endpointer.silence_run} frames). End of utterance.")
+                        end_of_utterance = True
+                    elif speculation and speech_prob > VAD_SPEECH_THRESHOLD:
+                        # Người dùng nói tiếp: transcript đã đoán không còn đúng
+                        await speculation.discard(aborted=True)
+                        speculation = None
+                    elif (decision == ENDPOINT_PROVISIONAL and server_cfg.SPECULATIVE_LLM_ENABLED
+                          and stt_session and not speculation and not responding):
+                        partial_text = (stt_session.partial_text or "").strip()
+                        if partial_text:
+                            print(f"==> Provisional endpoint. Speculating on: {partial_text}")
+                            # Chỉ TTS trước SPECULATIVE_TTS_SENTENCES câu; phần còn lại đọc sau khi xác nhận
+                            speculation = SpeculativeResponse(
+                                pipeline_pool.events(
+                                    input_text=partial_text, session_id=device_id, commit_history=False,
+                                    tts_sentences=server_cfg.SPECULATIVE_TTS_SENTENCES,
+                                ),
+                                partial_text,
+                                speak=lambda text: pipeline_pool.stream("speak", text=text),
+                                tts_sentences=server_cfg.SPECULATIVE_TTS_SENTENCES,
+                            )
+
+                if responding and is_speaking and endpointer.speech_frames >= server_cfg.BARGE_IN_MIN_FRAMES:
+                    # Người dùng nói chen vào: dừng phát, báo thiết bị xả loa, tiếp tục ghi câu mới
+                    print("==> Barge-in detected. Cancelling current response.")
+                    await cancel_response(response_task)
+                    await send_text(websocket, "BARGE_IN", trace)
+                    responding = False
+
+                if end_of_utterance:
+                    endpoint_time = time.perf_counter()
+                    if trace:
+                        trace.event("endpoint", speech_frames=endpointer.speech_frames)
+                    input_text = None
+                    if stt_session:
+                        input_text = await asyncio.wrap_future(stt_session.finish())
+                        ENDPOINT_TO_TRANSCRIPT_SECONDS.observe(time.perf_counter() - endpoint_time)
+                        stt_session = None
+                    if speculation and not responding and speculation.matches(input_text):
+                        print("==> Speculative response confirmed.")
+                        speculation.confirm()
+                    elif speculation:
+                        await speculation.discard()
+                        speculation = None
+                    if responding:
+                        # Tiếng động ngắn trong lúc robot đang nói, chưa đủ để ngắt lời → bỏ qua
+                        print("==> Short sound during response ignored.")
+                    else:
+                        if input_text is not None:
+                            print(f"==> Streaming transcript: {input_text}")
+                        # Chép một lần ra bytes vì bộ đệm sẽ được dùng lại cho câu tiếp theo
+                        response_task = asyncio.create_task(run_pipeline_and_respond(
+                            websocket, bytes(audio_buffers.utterance.view()), device_id, adpcm_codec, input_text=input_text,
+                            speculation=speculation, endpoint_time=endpoint_time, trace=trace,
+                            forward_events=forward_events,
+                        ))
+                        speculation = None
+                        responding = True
+                    is_speaking = False
+                    audio_buffers.reset()
 
     except WebSocketDisconnect:
-        print(f"Client {websocket.client.host} disconnected.")
+        print(f"Client {websocket.client.host} disconnected. VAD gate: {energy_gate.stats()}")
     except Exception as e:
         import traceback
         print(f"A critical error occurred in websocket connection:")
         traceback.print_exc()
+    finally:
+        CONNECTED_DEVICES.dec()
+        if speculation:
+            await speculation.discard(aborted=True)
+        if response_task is not None and not response_task.done():
+            await cancel_response(response_task)
+        if trace:
+            trace.close()
+        audio_buffers.release()
+
+async def load_models_in_background():
+    global model_load_error
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, load_models)
+    except Exception as e:
+        model_load_error = repr(e)
+        print("❌ Không tải được model:")
+        traceback.print_exc()
+        return
+    vad_service.start()
+
+@app.on_event("startup")
+async def start_services():
+    start_sinks()
+    # Server trả lời HTTP (/ready = 503) ngay trong lúc model đang tải
+    asyncio.get_running_loop().create_task(load_models_in_background())
+
+@app.on_event("shutdown")
+async def shutdown_services():
+    if vad_service:
+        await vad_service.stop()
+    if pipeline_pool:
+        pipeline_pool.shutdown()
+    if archive_sink:
+        archive_sink.close()
+    if trace_sink:
+        trace_sink.close()
 
 @app.get("/")
 def read_root():
-    return {"status": "Voice Assistant Server is running"}
\ No newline at end of file
+    return {"status": "Voice Assistant Server is running"}
+
+@app.get("/ready")
+def read_ready():
+    body = {"ready": models_ready(), "error": model_load_error, "timings": model_loader.timings}
+    return JSONResponse(body, status_code=200 if body["ready"] else 503)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats")
+def read_stats():
+    return {
+        "pipeline_pool": pipeline_pool.stats() if pipeline_pool else None,
+        "vad": vad_service.stats() if vad_service else None,
+        "vad_gate": EnergyGate.global_stats(),
+        "archive": archive_sink.stats() if archive_sink else None,
+        "trace": trace_sink.stats() if trace_sink else None,
+        "audio_buffers": ConnectionAudioBuffers.global_stats(),
+        "speculation": SpeculativeResponse.global_stats(),
+        "resources": resources.plan(),
+    }
\ No newline at end of file
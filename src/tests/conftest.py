@@ -0,0 +1,15 @@
+"""
+Trên máy chạy, src/model được triển khai thành hai package `modules/` và `settings/`;
+test dựng lại đúng bố cục đó để import được module có `from settings import ...`.
+"""
+import sys
+import types
+from pathlib import Path
+
+MODEL_DIR = Path(__file__).resolve().parent.parent / "model"
+
+for _name in ("modules", "settings"):
+    if _name not in sys.modules:
+        _package = types.ModuleType(_name)
+        _package.__path__ = [str(MODEL_DIR)]
+        sys.modules[_name] = _package
@@ -0,0 +1,63 @@
+"""
+Round-trip AdpcmCodec với các khối PCM độ dài lẻ như TTSEngine.synthesize_stream trả về:
+decoder phía thiết bị không được trôi khỏi tín hiệu gốc sau nhiều khối.
+
+    python -m pytest src/tests
+"""
+import math
+import sys
+from pathlib import Path
+
+import pytest
+
+# adpcm.py không phụ thuộc settings nên import thẳng từ thư mục mã nguồn
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "model"))
+
+import adpcm
+from adpcm import AdpcmCodec, _pack_pcm16, _unpack_pcm16
+
+SAMPLE_RATE = 24000
+BLOCK_SIZES = [441, 1023, 7, 2400, 1, 999, 3, 1501]
+
+
+def _tone(num_samples: int):
+    return [int(8000 * math.sin(2 * math.pi * 440 * i / SAMPLE_RATE)
+                + 3000 * math.sin(2 * math.pi * 1250 * i / SAMPLE_RATE)) for i in range(num_samples)]
+
+
+@pytest.fixture(params=["audioop", "table"])
+def backend(request, monkeypatch):
+    if request.param == "audioop" and adpcm.audioop is None:
+        pytest.skip("audioop không khả dụng")
+    if request.param == "table":
+        monkeypatch.setattr(adpcm, "audioop", None)
+    return request.param
+
+
+def test_odd_blocks_round_trip(backend):
+    blocks = BLOCK_SIZES * 4
+    samples = _tone(sum(blocks))
+    encoder, decoder = AdpcmCodec(), AdpcmCodec()
+
+    stream, pos = b"", 0
+    for size in blocks:
+        stream += encoder.encode(_pack_pcm16(samples[pos:pos + size]))
+        pos += size
+    stream += encoder.flush_encoder()
+
+    decoded = list(_unpack_pcm16(decoder.decode(stream)))
+    # Mỗi byte 2 mẫu: tổng số mẫu lẻ thì chỉ có một mẫu đệm ở cuối
+    assert len(decoded) == len(samples) + len(samples) % 2
+    errors = [abs(a - b) for a, b in zip(samples, decoded)]
+    # Bỏ qua đoạn đầu khi step còn nhỏ; sai số phải giữ nguyên mức tới cuối luồng, không tăng dần
+    steady = errors[SAMPLE_RATE // 100:]
+    quarter = len(steady) // 4
+    assert max(steady) < 1500
+    assert sum(steady[-quarter:]) / quarter < 2 * sum(steady[:quarter]) / quarter + 50
+
+
+def test_reset_encoder_drops_pending_sample(backend):
+    codec = AdpcmCodec()
+    assert len(codec.encode(_pack_pcm16(_tone(5)))) == 2
+    codec.reset_encoder()
+    assert codec.flush_encoder() == b""
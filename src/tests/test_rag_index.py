@@ -0,0 +1,157 @@
+"""
+PersistentRAGIndex: cập nhật tăng dần (sửa / thêm / xóa file), tombstone, compaction giữ extras khớp id,
+mở lại từ manifest, và nhiều process cùng cập nhật một index_dir.
+
+    python -m pytest src/tests
+"""
+import multiprocessing
+import zlib
+
+import numpy as np
+import pytest
+
+from modules import rag_index
+from modules.rag_index import PersistentRAGIndex
+
+CHUNK_SIZE = 60
+OVERLAP = 10
+
+DOCS = {
+    "moon.txt": "Mặt trăng là vệ tinh tự nhiên duy nhất của trái đất. " * 3,
+    "cat.txt": "Con mèo là loài vật nuôi, mèo thích bắt chuột và ngủ nhiều. " * 3,
+    "sea/fish.txt": "Cá heo sống ở biển, cá heo rất thông minh và thân thiện. " * 3,
+}
+
+
+def _write(docs_dir, docs):
+    for rel, text in docs.items():
+        path = docs_dir / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+
+
+def _open(tmp_path):
+    return PersistentRAGIndex(tmp_path / "index", tmp_path / "docs", CHUNK_SIZE, OVERLAP).open()
+
+
+def _files(index, hits):
+    return {index.chunk(doc_id)[0] for _, doc_id in hits}
+
+
+def _fingerprint(text: str) -> np.ndarray:
+    """Extra giả lập embedding: xác định hoàn toàn từ nội dung chunk."""
+    return np.array([len(text), zlib.crc32(text.encode("utf-8")) % 100000], dtype=np.float32)
+
+
+def _attach_fingerprints(index):
+    for segment in index.segments:
+        rows = np.stack([_fingerprint(text) for text in index.segment_texts(segment)])
+        index.attach(segment.name, {"fp": rows})
+
+
+@pytest.fixture
+def index(tmp_path):
+    _write(tmp_path / "docs", DOCS)
+    index = _open(tmp_path)
+    counts = index.update()
+    assert counts == {"added": 3, "changed": 0, "removed": 0, "unchanged": 0}
+    return index
+
+
+def test_update_modify_add_delete(tmp_path, index):
+    assert _files(index, index.search_ids("mèo chuột", 5)) == {"cat.txt"}
+    sources = {doc_id: index.chunk(doc_id)[0] for doc_id in range(index.snapshot.total_chunks)}
+    replaced = {doc_id for doc_id, rel in sources.items() if rel in ("moon.txt", "sea/fish.txt")}
+
+    docs = tmp_path / "docs"
+    (docs / "moon.txt").write_text("Mặt trời là ngôi sao ở trung tâm hệ mặt trời.", encoding="utf-8")
+    (docs / "sea" / "fish.txt").unlink()
+    _write(docs, {"dog.txt": "Con chó trung thành, chó thích chạy nhảy."})
+    counts = index.update(compact=False)
+
+    assert counts == {"added": 1, "changed": 1, "removed": 1, "unchanged": 1}
+    assert index.search_ids("trăng", 5) == []
+    assert index.search_ids("heo", 5) == []
+    assert _files(index, index.search_ids("ngôi sao", 5)) == {"moon.txt"}
+    assert _files(index, index.search_ids("chó", 5)) == {"dog.txt"}
+    assert _files(index, index.search_ids("mèo", 5)) == {"cat.txt"}
+    # Chunk cũ vẫn nằm trong segment cho đến khi gộp, nhưng bị dead_ids che đi
+    assert set(index.dead_ids.tolist()) == replaced
+    assert index.stats()["dead_chunks"] == len(replaced)
+
+
+def test_touch_without_change_keeps_chunks(tmp_path, index):
+    path = tmp_path / "docs" / "cat.txt"
+    path.write_text(path.read_text(encoding="utf-8"), encoding="utf-8")
+    before = index.search_ids("mèo", 5)
+    assert index.update()["unchanged"] == 3
+    assert index.search_ids("mèo", 5) == before
+    assert not len(index.dead_ids)
+
+
+def test_compaction_keeps_ids_and_extras_aligned(tmp_path, index):
+    docs = tmp_path / "docs"
+    _write(docs, {"dog.txt": "Con chó trung thành, chó thích chạy nhảy. " * 2})
+    index.update(compact=False)
+    _attach_fingerprints(index)
+    (docs / "cat.txt").unlink()
+    index.update(compact=False)
+    assert len(index.segments) == 2 and len(index.dead_ids)
+
+    index.update(compact=True)
+    assert len(index.segments) == 1
+    assert not len(index.dead_ids)
+    segment = index.segments[0]
+    assert segment.extras["fp"].shape == (len(segment.chunks), 2)
+    for doc_id in range(len(segment.chunks)):
+        rel, text = index.chunk(doc_id)
+        assert rel != "cat.txt"
+        np.testing.assert_array_equal(segment.extras["fp"][doc_id], _fingerprint(text))
+    assert index.search_ids("mèo", 5) == []
+    assert _files(index, index.search_ids("chó", 5)) == {"dog.txt"}
+
+
+def test_reopen_from_manifest_gives_identical_results(tmp_path, index):
+    (tmp_path / "docs" / "moon.txt").unlink()
+    _write(tmp_path / "docs", {"dog.txt": "Con chó trung thành, chó thích chạy nhảy."})
+    index.update(compact=False)
+    queries = ["mèo chuột", "cá heo biển", "chó", "trăng"]
+
+    reopened = _open(tmp_path)
+    assert reopened.stats() == index.stats()
+    np.testing.assert_array_equal(reopened.dead_ids, index.dead_ids)
+    for query in queries:
+        assert reopened.search_ids(query, 5) == index.search_ids(query, 5)
+        assert reopened.search(query, 5) == index.search(query, 5)
+    assert reopened.update() == {"added": 0, "changed": 0, "removed": 0, "unchanged": 3}
+
+
+def _concurrent_writer(tmp_path, worker: int, rounds: int, errors):
+    try:
+        rag_index.cfg.RAG_INDEX_MAX_SEGMENTS = 2
+        for round_ in range(rounds):
+            _write(tmp_path / "docs", {f"w{worker}_{round_ % 3}.txt": f"trăng {worker} {round_} " * (5 + round_)})
+            index = _open(tmp_path)
+            index.update()
+            assert index.search_ids("trăng", 3)
+    except Exception as e:
+        errors.put(repr(e))
+
+
+@pytest.mark.skipif(rag_index.fcntl is None or "fork" not in multiprocessing.get_all_start_methods(),
+                    reason="cần flock và fork")
+def test_concurrent_updates_from_several_processes(tmp_path, index):
+    context = multiprocessing.get_context("fork")
+    errors = context.Queue()
+    workers = [context.Process(target=_concurrent_writer, args=(tmp_path, i, 10, errors)) for i in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(60)
+    assert [process.exitcode for process in workers] == [0] * len(workers)
+    assert errors.empty(), errors.get()
+
+    final = _open(tmp_path)
+    assert final.update()["unchanged"] == 3 + 4 * 3
+    keep = {meta["name"] for meta in final.manifest["segments"]}
+    assert {path.name.split(".", 1)[0] for path in (tmp_path / "index").glob("seg_*")} == keep
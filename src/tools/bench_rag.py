@@ -0,0 +1,136 @@
+"""
+Đo độ trễ truy vấn RAG theo số chunk: chỉ mục BM25 (modules.rag_index) so với cách quét toàn bộ chunk cũ
+(tách token lại mọi chunk ở mỗi truy vấn, điểm = số token trùng). Mặc định dùng corpus tổng hợp có phân bố
+từ kiểu Zipf; --folder dùng chunk thật từ thư mục tài liệu, lặp lại cho đủ kích thước.
+Cột vec đo phần tìm kiếm của modules.rag_vector (nhân ma trận-vector + argpartition) trên embedding ngẫu nhiên
+--dim chiều, float32 và int8; không gồm thời gian model embedding tính vector câu hỏi.
+
+    python tools/bench_rag.py --sizes 1000 10000 50000
+    python tools/bench_rag.py --folder rag_docs --sizes 10000
+"""
+import sys
+import time
+import argparse
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+# Thêm đường dẫn gốc để Python tìm thấy các module settings
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from modules.rag_index import BM25Index, tokenize
+from modules.rag_vector import dense_top_k, quantize
+from settings import llm_settings as cfg
+
+# Âm tiết phổ biến đặt đầu bảng từ để nhận tần suất cao nhất, giống văn bản tiếng Việt thật
+COMMON_SYLLABLES = "là và của có không được cho một những các người này với trong đã thì để khi ra".split()
+ONSETS = ["", "b", "c", "ch", "d", "đ", "g", "h", "k", "kh", "l", "m", "n", "ng", "nh", "ph", "qu", "s", "t", "th",
+          "tr", "v", "x"]
+RHYMES = ["a", "ai", "am", "an", "ang", "anh", "ao", "at", "ay", "e", "em", "en", "i", "im", "in", "inh", "o", "oa",
+          "oi", "om", "on", "ong", "u", "ui", "um", "un", "ung", "uy", "ư", "ương", "ơ", "ơi", "ô", "ông", "ê", "ên"]
+TONES = ["", "́", "̀", "̉", "̃", "̣"]
+
+
+def synthetic_corpus(num_chunks: int, chunk_tokens: int, seed: int):
+    rng = np.random.default_rng(seed)
+    generated = [unicodedata.normalize("NFC", onset + rhyme + tone)
+                 for onset in ONSETS for rhyme in RHYMES for tone in TONES]
+    vocabulary = np.array(COMMON_SYLLABLES + [w for w in generated if w not in COMMON_SYLLABLES])
+    probabilities = 1.0 / np.arange(1, len(vocabulary) + 1) ** 1.1
+    probabilities /= probabilities.sum()
+
+    def sentence(length):
+        return " ".join(vocabulary[rng.choice(len(vocabulary), size=length, p=probabilities)])
+
+    return sentence, [sentence(chunk_tokens) for _ in range(num_chunks)]
+
+
+def folder_corpus(folder: Path, num_chunks: int):
+    step = max(1, cfg.RAG_CHUNK_SIZE - cfg.RAG_CHUNK_OVERLAP)
+    chunks = []
+    for path in sorted(folder.rglob("*.txt")):
+        text = path.read_text(encoding="utf-8")
+        chunks += [text[i:i + cfg.RAG_CHUNK_SIZE] for i in range(0, len(text), step)]
+    if not chunks:
+        raise SystemExit(f"Không có file .txt trong {folder}")
+    return (chunks * (num_chunks // len(chunks) + 1))[:num_chunks]
+
+
+def linear_search(chunks, query: str, top_k: int):
+    """Thuật toán cũ của SimpleRAG.search, giữ lại làm mốc so sánh."""
+    q_tokens = set(tokenize(query))
+    scored = []
+    for chunk in chunks:
+        score = len(q_tokens & set(tokenize(chunk)))
+        if score > 0:
+            scored.append(score)
+    scored.sort(reverse=True)
+    return scored[:top_k]
+
+
+def measure(search, queries) -> np.ndarray:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAG query latency vs corpus size.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000], help="Số chunk cần đo")
+    parser.add_argument("--queries", type=int, default=200, help="Số câu hỏi mỗi kích thước")
+    parser.add_argument("--query-tokens", type=int, default=12, help="Độ dài câu hỏi tổng hợp (token)")
+    parser.add_argument("--chunk-tokens", type=int, default=110, help="Độ dài chunk tổng hợp (~RAG_CHUNK_SIZE ký tự)")
+    parser.add_argument("--folder", type=str, default="", help="Chunk thật từ thư mục .txt thay vì tổng hợp")
+    parser.add_argument("--top-k", type=int, default=cfg.RAG_TOP_K)
+    parser.add_argument("--baseline-max", type=int, default=10000,
+                        help="Chỉ đo cách quét cũ tới kích thước này (rất chậm với corpus lớn)")
+    parser.add_argument("--dim", type=int, default=384, help="Số chiều embedding cho cột vec (0 = bỏ qua)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("\n" + " RAG QUERY LATENCY (ms) ".center(98, "="))
+    print(f"  {'chunks':>8}{'tokens':>9}{'build s':>9}{'bm25 p50':>10}{'p95':>8}{'p99':>8}"
+          f"{'scan p50':>10}{'p95':>8}{'vec f32':>10}{'vec i8':>9}")
+    for size in args.sizes:
+        sentence, chunks = synthetic_corpus(size, args.chunk_tokens, args.seed)
+        if args.folder:
+            chunks = folder_corpus(Path(args.folder), size)
+        rng = np.random.default_rng(args.seed + 1)
+        if args.folder:
+            # Câu hỏi là một đoạn ngắn lấy từ chunk ngẫu nhiên
+            queries = [" ".join(tokenize(chunks[i])[:args.query_tokens]) for i in rng.integers(0, size, args.queries)]
+        else:
+            queries = [sentence(args.query_tokens) for _ in range(args.queries)]
+
+        start = time.perf_counter()
+        index = BM25Index().build(chunks)
+        build_time = time.perf_counter() - start
+        bm25 = measure(lambda q: index.search(q, args.top_k), queries)
+
+        row = (f"  {size:>8}{len(index.postings):>9}{build_time:>9.2f}{np.percentile(bm25, 50):>10.2f}"
+               f"{np.percentile(bm25, 95):>8.2f}{np.percentile(bm25, 99):>8.2f}")
+        if size <= args.baseline_max:
+            scan = measure(lambda q: linear_search(chunks, q, args.top_k), queries[:max(1, args.queries // 10)])
+            row += f"{np.percentile(scan, 50):>10.1f}{np.percentile(scan, 95):>8.1f}"
+        else:
+            row += f"{'-':>10}{'-':>8}"
+        if args.dim:
+            embeddings = rng.normal(size=(size, args.dim)).astype(np.float32)
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+            query_vectors = embeddings[rng.integers(0, size, args.queries)]
+            dense = {}
+            for dtype in ("float32", "int8"):
+                matrix, scale = quantize(embeddings, dtype)
+                dense[dtype] = measure(lambda q: dense_top_k(matrix, scale, q, args.top_k), query_vectors)
+            row += f"{np.percentile(dense['float32'], 50):>10.2f}{np.percentile(dense['int8'], 50):>9.2f}"
+        print(row)
+    print("=" * 98)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Tìm cách chia core tốt nhất giữa số pipeline worker, thread STT và thread TTS trên máy hiện tại.
+Mỗi cấu hình chạy --jobs lượt STT + TTS với --concurrency lượt song song và đo độ trễ / thông lượng.
+
+    python tools/bench_threads.py --audio data/ref1.wav --cores 8
+"""
+import sys
+import time
+import wave
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Thêm đường dẫn gốc để Python tìm thấy các module settings
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from modules import resources
+from settings import stt_settings as stt_cfg
+
+DEFAULT_TEXT = "Hôm nay trời đẹp quá, cậu có muốn nghe tớ kể một câu chuyện không?"
+
+
+def read_pcm16(path: Path) -> bytes:
+    with wave.open(str(path), 'rb') as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1 or wf.getframerate() != stt_cfg.SAMPLE_RATE:
+            raise ValueError(f"{path}: cần WAV PCM16 mono {stt_cfg.SAMPLE_RATE} Hz")
+        return wf.readframes(wf.getnframes())
+
+
+def candidate_splits(cores: int):
+    """(pipeline_workers, stt_threads, tts_threads) với workers × threads không vượt quá số core."""
+    splits = []
+    for workers in range(1, cores + 1):
+        per_worker = cores // workers
+        if per_worker < 1:
+            break
+        for stt_threads in sorted({1, 2, 4, per_worker}):
+            if stt_threads <= per_worker:
+                splits.append((workers, stt_threads, per_worker))
+    return splits
+
+
+def run_config(tts_engine, pcm: bytes, text: str, workers: int, stt_threads: int, tts_threads: int,
+               jobs: int, concurrency: int) -> dict:
+    import torch
+    from modules.stt import STTEngine
+
+    resources.set_threads("stt", stt_threads)
+    resources.set_threads("tts", tts_threads)
+    resources.set_threads("pipeline", workers)
+    stt_engine = STTEngine()
+    torch.set_num_threads(tts_threads)
+
+    def one_job(_):
+        start = time.perf_counter()
+        stt_engine.transcribe_pcm(pcm, stt_cfg.SAMPLE_RATE)
+        stt_done = time.perf_counter()
+        first_audio = None
+        for _chunk in tts_engine.synthesize_stream(text):
+            if first_audio is None:
+                first_audio = time.perf_counter()
+        end = time.perf_counter()
+        return stt_done - start, first_audio - start, end - start
+
+    # Warm-up: không tính lượt đầu
+    one_job(None)
+    # Số lượt thực sự song song bị giới hạn bởi số pipeline worker, giống PipelineWorkerPool
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(workers, concurrency)) as executor:
+        results = list(executor.map(one_job, range(jobs)))
+    wall = time.perf_counter() - start
+
+    stt, first_audio, total = (np.array(col) for col in zip(*results))
+    return {
+        "workers": workers, "stt_threads": stt_threads, "tts_threads": tts_threads,
+        "stt_p50": np.percentile(stt, 50),
+        "first_audio_p50": np.percentile(first_audio, 50),
+        "first_audio_p95": np.percentile(first_audio, 95),
+        "total_p95": np.percentile(total, 95),
+        "throughput": jobs / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CPU thread splits between pipeline workers, STT and TTS.")
+    parser.add_argument("--audio", type=str, default=str(stt_cfg.DEFAULT_INPUT_AUDIO), help="WAV PCM16 mono 16 kHz")
+    parser.add_argument("--text", type=str, default=DEFAULT_TEXT, help="Câu dùng cho TTS")
+    parser.add_argument("--cores", type=int, default=resources.available_cores())
+    parser.add_argument("--jobs", type=int, default=8, help="Số lượt đo cho mỗi cấu hình")
+    parser.add_argument("--concurrency", type=int, default=0, help="Số lượt gửi cùng lúc (0 = bằng số core)")
+    parser.add_argument("--max-configs", type=int, default=0, help="Chỉ thử N cấu hình đầu (0 = tất cả)")
+    args = parser.parse_args()
+
+    from modules.tts import TTSEngine
+
+    pcm = read_pcm16(Path(args.audio))
+    concurrency = args.concurrency or args.cores
+    splits = candidate_splits(args.cores)
+    if args.max_configs:
+        splits = splits[:args.max_configs]
+
+    print(f"Đang tải TTS (dùng chung cho mọi cấu hình), {len(splits)} cấu hình trên {args.cores} core...")
+    tts_engine = TTSEngine()
+
+    rows = []
+    for workers, stt_threads, tts_threads in splits:
+        row = run_config(tts_engine, pcm, args.text, workers, stt_threads, tts_threads, args.jobs, concurrency)
+        rows.append(row)
+        print(f"  workers={workers:<2} stt={stt_threads:<2} tts={tts_threads:<2} "
+              f"stt p50 {row['stt_p50'] * 1000:6.0f} ms | first audio p50 {row['first_audio_p50'] * 1000:6.0f} ms "
+              f"p95 {row['first_audio_p95'] * 1000:6.0f} ms | {row['throughput']:.2f} lượt/s")
+
+    # Ưu tiên độ trễ đến audio đầu tiên (điều người dùng cảm nhận), thông lượng để phân định
+    best = min(rows, key=lambda r: (round(r["first_audio_p95"], 1), -r["throughput"]))
+    print("\n" + " THREAD SPLIT REPORT ".center(60, "="))
+    print(f"  Best for {args.cores} cores (first-audio p95, then throughput):")
+    print(f"    PIPELINE_MAX_WORKERS={best['workers']}  STT_THREADS={best['stt_threads']}  "
+          f"TTS_THREADS={best['tts_threads']}")
+    print(f"    first audio p95 {best['first_audio_p95'] * 1000:.0f} ms, {best['throughput']:.2f} lượt/s")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Tạo / cập nhật chỉ mục RAG trên đĩa (llm_settings.RAG_INDEX_DIR) cho thư mục tài liệu, không cần chạy server.
+Chỉ file mới hoặc đã sửa được đọc lại; server đang chạy sẽ dùng chỉ mục mới ở lần khởi động sau.
+Với RAG_BACKEND vector / hybrid, embedding của segment mới cũng được tính ở đây (theo batch) và lưu cạnh segment,
+server khởi động chỉ việc mở ma trận đã lưu.
+
+    python tools/build_rag_index.py                 # cập nhật tăng dần
+    python tools/build_rag_index.py --compact       # gộp mọi segment, bỏ chunk đã tombstone
+    python tools/build_rag_index.py --query "mặt trăng là gì"
+    python tools/build_rag_index.py --backend bm25  # bỏ qua bước embedding
+"""
+import sys
+import time
+import argparse
+from pathlib import Path
+
+# Thêm đường dẫn gốc để Python tìm thấy các module settings
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from modules.rag_index import PersistentRAGIndex
+from modules.rag_vector import SentenceEmbedder, VectorIndex
+from settings import llm_settings as cfg
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or incrementally update the on-disk RAG index.")
+    parser.add_argument("--docs", type=str, default=str(cfg.RAG_DIR), help="Thư mục tài liệu *.txt")
+    parser.add_argument("--index", type=str, default=str(cfg.RAG_INDEX_DIR), help="Thư mục chỉ mục")
+    parser.add_argument("--compact", action="store_true", help="Gộp mọi segment sau khi cập nhật")
+    parser.add_argument("--backend", type=str, default=cfg.RAG_BACKEND, choices=("bm25", "vector", "hybrid"),
+                        help="vector / hybrid: tính embedding cho segment chưa có")
+    parser.add_argument("--query", type=str, default="", help="Thử một truy vấn sau khi cập nhật")
+    args = parser.parse_args()
+
+    index = PersistentRAGIndex(args.index, args.docs)
+    start = time.perf_counter()
+    index.open()
+    opened = time.perf_counter()
+    counts = index.update(compact=True if args.compact else None)
+    updated = time.perf_counter()
+
+    print(f"📚 {args.docs} → {args.index}")
+    print(f"   open {(opened - start) * 1000:.1f} ms, update {(updated - opened) * 1000:.1f} ms: "
+          f"+{counts['added']} ~{counts['changed']} -{counts['removed']} ={counts['unchanged']} file")
+    print("   " + ", ".join(f"{key} {value}" for key, value in index.stats().items()))
+    if args.backend in ("vector", "hybrid"):
+        start = time.perf_counter()
+        vector = VectorIndex(index, SentenceEmbedder())
+        embedded = vector.sync()
+        stats = vector.stats()
+        print(f"🧭 embed {embedded} chunks trong {time.perf_counter() - start:.2f}s: "
+              f"{stats['vectors']} x {stats['dim']} {stats['dtype']}")
+    if args.query:
+        start = time.perf_counter()
+        hits = index.search(args.query, cfg.RAG_TOP_K)
+        print(f"🔎 \"{args.query}\" ({(time.perf_counter() - start) * 1000:.2f} ms)")
+        for score, source, text in hits:
+            print(f"   {score:6.3f}  {source}: {' '.join(text.split())[:100]}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Đánh giá offline AdaptiveEndpointer so với cửa sổ im lặng cố định (VAD_SILENCE_FRAMES_END = 25)
+trên các file WAV đã ghi. Báo cáo độ trễ tiết kiệm được và số lần cắt sớm (trẻ còn nói tiếp).
+
+    python tools/eval_endpointing.py audio_files/ [--vad-model models/silero_vad/silero_vad.onnx]
+"""
+import sys
+import wave
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Thêm đường dẫn gốc để Python tìm thấy các module settings
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from modules.endpointing import AdaptiveEndpointer, EndpointConfig, ENDPOINT_FINAL
+from modules.vad_service import EnergyGate, SileroBatchRunner
+from modules.model_loader import load_vad_session
+
+SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+FRAME_SAMPLES = SAMPLE_RATE * VAD_FRAME_MS // 1000
+
+
+def read_wav(path: Path) -> np.ndarray:
+    with wave.open(str(path), 'rb') as wf:
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: chỉ hỗ trợ WAV PCM16")
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    samples = pcm[::channels].astype(np.float32) / 32768.0
+    if rate != SAMPLE_RATE and len(samples):
+        new_len = int(len(samples) * SAMPLE_RATE / rate)
+        samples = np.interp(np.linspace(0, 1, new_len), np.linspace(0, 1, len(samples)), samples).astype(np.float32)
+    return samples
+
+
+def frame_probabilities(runner: SileroBatchRunner, samples: np.ndarray):
+    count = len(samples) // FRAME_SAMPLES
+    frames = samples[:count * FRAME_SAMPLES].reshape(count, FRAME_SAMPLES)
+    state = runner.new_state()
+    probs = np.array([runner.run(frames[i:i + 1], [state])[0] for i in range(count)], dtype=np.float32)
+    rms, _ = EnergyGate.frame_features(frames)
+    return probs, rms
+
+
+def evaluate(probs, rms, config: EndpointConfig, threshold: float, fixed_frames: int):
+    """Chạy endpointer trên chuỗi xác suất; trả về danh sách (frame, silence_run, premature)."""
+    endpointer = AdaptiveEndpointer(config, threshold)
+    is_speech = probs > threshold
+    speech_idx = np.flatnonzero(is_speech)
+    results = []
+    speaking = False
+    for t in range(len(probs)):
+        if not speaking:
+            if is_speech[t]:
+                speaking = True
+                endpointer.reset()
+            else:
+                continue
+        if endpointer.update(float(probs[t]), float(rms[t])) != ENDPOINT_FINAL:
+            continue
+        silence_run = endpointer.silence_run
+        silence_start = t - silence_run + 1
+        later = speech_idx[speech_idx > t]
+        # Cắt sớm: trẻ nói tiếp trước khi cửa sổ cố định kịp kết thúc câu
+        premature = bool(len(later) and (later[0] - silence_start) < fixed_frames)
+        results.append((t, silence_run, premature))
+        speaking = False
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate adaptive endpointing against the fixed 750 ms window.")
+    parser.add_argument("inputs", nargs="+", help="WAV files or folders")
+    parser.add_argument("--vad-model", type=str, default=None, help="Path to silero_vad.onnx (default: server_settings.VAD_MODEL_PATH)")
+    parser.add_argument("--device-id", type=str, default=None, help="Dùng ENDPOINT_DEVICE_OVERRIDES của thiết bị này")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--fixed-frames", type=int, default=25, help="Cửa sổ cố định làm mốc (frame 30 ms)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    files = []
+    for item in args.inputs:
+        path = Path(item)
+        files.extend(sorted(path.rglob("*.wav")) if path.is_dir() else [path])
+    if not files:
+        print("Không tìm thấy file WAV nào.")
+        return
+
+    runner = SileroBatchRunner(load_vad_session(args.vad_model), SAMPLE_RATE)
+    config = EndpointConfig.for_device(args.device_id)
+
+    saved_ms, premature_cuts, endpoints = [], 0, 0
+    for path in files:
+        probs, rms = frame_probabilities(runner, read_wav(path))
+        results = evaluate(probs, rms, config, args.threshold, args.fixed_frames)
+        for t, silence_run, premature in results:
+            endpoints += 1
+            if premature:
+                premature_cuts += 1
+            else:
+                saved_ms.append((args.fixed_frames - silence_run) * VAD_FRAME_MS)
+            if args.verbose:
+                status = "PREMATURE" if premature else f"saved {(args.fixed_frames - silence_run) * VAD_FRAME_MS} ms"
+                print(f"  {path.name} @ {t * VAD_FRAME_MS / 1000:.2f}s: silence {silence_run * VAD_FRAME_MS} ms → {status}")
+
+    print("\n" + " ENDPOINTING REPORT ".center(60, "="))
+    print(f"  Files:            {len(files)}")
+    print(f"  Endpoints:        {endpoints}")
+    if endpoints:
+        print(f"  Premature cuts:   {premature_cuts} ({premature_cuts / endpoints * 100:.1f}%)")
+    if saved_ms:
+        arr = np.array(saved_ms)
+        print(f"  Latency saved:    mean {arr.mean():.0f} ms, p50 {np.percentile(arr, 50):.0f} ms, "
+              f"p90 {np.percentile(arr, 90):.0f} ms")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
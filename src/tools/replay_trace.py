@@ -0,0 +1,194 @@
+"""
+Phát lại trace đã ghi (server chạy với TRACE_CAPTURE=1) vào server, giữ nhịp gốc hoặc tăng tốc, rồi so sánh
+độ trễ mỗi lượt với lúc ghi. Mọi trace được phát đồng thời theo đúng khoảng cách thời gian ban đầu.
+Chạy server cần đo với LLM_STUB_TRACE trỏ tới cùng trace để LLM trả lại câu trả lời đã ghi:
+
+    LLM_STUB_TRACE=traces/ python vad_server.py
+    python tools/replay_trace.py traces/ --url ws://localhost:8000/ws --speed 2
+    python tools/replay_trace.py traces/ --summary     # chỉ in số liệu đã ghi trong trace
+"""
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+from urllib.parse import urlencode
+
+import numpy as np
+import websockets
+
+# Thêm đường dẫn gốc để Python tìm thấy các module settings
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT_DIR))
+
+from modules.trace import (
+    SESSION, AUDIO_IN, TEXT_IN, TEXT_OUT, AUDIO_OUT, TIMING, TraceRecord, read_trace, trace_files,
+)
+
+METRICS = (
+    ("processing_start", "last frame → PROCESSING_START"),
+    ("first_audio", "last frame → first audio"),
+    ("tts_end", "last frame → TTS_END"),
+)
+
+
+def turn_latencies(records) -> list:
+    """
+    Độ trễ từng lượt tính từ frame audio cuối cùng nhận trước PROCESSING_START.
+    Dùng chung cho trace ghi ở server và bản ghi phía client lúc replay (cùng kiểu TraceRecord).
+    """
+    turns = []
+    last_audio_in = None
+    turn = None
+    for record in records:
+        if record.kind == AUDIO_IN:
+            last_audio_in = record.t
+        elif record.kind == TEXT_OUT and record.payload == "PROCESSING_START" and last_audio_in is not None:
+            turn = {"ref": last_audio_in, "processing_start": record.t - last_audio_in}
+            turns.append(turn)
+        elif turn is None:
+            continue
+        elif record.kind == AUDIO_OUT:
+            turn.setdefault("first_audio", record.t - turn["ref"])
+        elif record.kind == TEXT_OUT and record.payload == "TTS_END":
+            turn["tts_end"] = record.t - turn["ref"]
+            turn = None
+        elif record.kind == TEXT_OUT and record.payload == "BARGE_IN":
+            turn["barge_in"] = True
+            turn = None
+    return turns
+
+
+def percentiles(values) -> str:
+    if not values:
+        return f"{'-':>7}{'-':>7}"
+    return f"{np.percentile(values, 50) * 1000:>7.0f}{np.percentile(values, 95) * 1000:>7.0f}"
+
+
+def print_comparison(recorded: list, replayed: list = None):
+    header = f"  {'metric (ms, p50 p95)':<32}{'recorded':>14}"
+    if replayed is not None:
+        header += f"{'replayed':>14}{'Δ p50':>9}"
+    print(header)
+    for key, label in METRICS:
+        before = [turn[key] for turn in recorded if key in turn]
+        row = f"  {label:<32}{percentiles(before):>14}"
+        if replayed is not None:
+            after = [turn[key] for turn in replayed if key in turn]
+            delta = (np.percentile(after, 50) - np.percentile(before, 50)) * 1000 if before and after else 0.0
+            row += f"{percentiles(after):>14}{delta:>+9.0f}"
+        print(row)
+
+
+def print_stage_summary(records):
+    """Phân bố timing từng bước pipeline đã ghi (stt, tts_chunk, tts_rtf...)."""
+    stages = {}
+    for record in records:
+        if record.kind == TIMING:
+            stages.setdefault(record.payload["stage"], []).append(record.payload["value"])
+    for stage, values in sorted(stages.items()):
+        unit = "" if stage == "tts_rtf" else " s"
+        print(f"    {stage:<18} n={len(values):<5} p50 {np.percentile(values, 50):.3f}{unit}  "
+              f"p95 {np.percentile(values, 95):.3f}{unit}")
+
+
+async def replay_session(records: list, url: str, speed: float, delay: float, linger: float) -> list:
+    """Gửi AUDIO_IN / TEXT_IN theo thời gian gốc chia `speed`; trả về bản ghi phía client dạng TraceRecord."""
+    header = records[0].payload
+    query = urlencode({"codec": header.get("codec", "pcm16"), "device_id": header.get("device_id", "replay")})
+    # Audio ra của ADPCM là 2 mẫu mỗi byte; quy về số byte PCM16 như trong trace
+    pcm_bytes_per_byte = 4 if header.get("codec") == "adpcm" else 1
+    observed = []
+
+    await asyncio.sleep(delay)
+    async with websockets.connect(f"{url}?{query}", ping_interval=None, max_size=None) as ws:
+        start = time.perf_counter()
+        last_message = [start]
+
+        async def receiver():
+            async for msg in ws:
+                now = time.perf_counter()
+                last_message[0] = now
+                if isinstance(msg, str):
+                    observed.append(TraceRecord(TEXT_OUT, now - start, msg))
+                else:
+                    observed.append(TraceRecord(AUDIO_OUT, now - start, len(msg) * pcm_bytes_per_byte))
+
+        receiving = asyncio.create_task(receiver())
+        try:
+            for record in records:
+                if record.kind not in (AUDIO_IN, TEXT_IN):
+                    continue
+                wait = start + record.t / speed - time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                await ws.send(record.payload)
+                observed.append(TraceRecord(record.kind, time.perf_counter() - start, record.payload))
+            # Chờ phản hồi của lượt cuối: dừng khi server im lặng đủ `linger` giây
+            while time.perf_counter() - last_message[0] < linger and not receiving.done():
+                await asyncio.sleep(0.1)
+        finally:
+            receiving.cancel()
+    return observed
+
+
+async def replay_all(sessions: list, args) -> list:
+    if args.sequential:
+        return [await replay_session(records, args.url, args.speed, 0.0, args.linger) for records in sessions]
+    # Đồng thời: giữ khoảng cách giữa các lần kết nối như lúc ghi
+    first_start = min(records[0].payload["started_at"] for records in sessions)
+    return await asyncio.gather(*(
+        replay_session(records, args.url, args.speed, (records[0].payload["started_at"] - first_start) / args.speed,
+                       args.linger)
+        for records in sessions
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured WebSocket traces against the server.")
+    parser.add_argument("traces", nargs="+", help="File .ptrace hoặc thư mục trace")
+    parser.add_argument("--url", type=str, default="ws://localhost:8000/ws", help="Endpoint WebSocket (không kèm query)")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = nhịp gốc, 2 = nhanh gấp đôi...")
+    parser.add_argument("--linger", type=float, default=5.0, help="Chờ thêm (giây) sau frame cuối cho phản hồi")
+    parser.add_argument("--sequential", action="store_true", help="Phát từng phiên một thay vì đồng thời")
+    parser.add_argument("--summary", action="store_true", help="Chỉ in số liệu đã ghi, không kết nối server")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed phải > 0")
+
+    paths = [path for arg in args.traces for path in trace_files(arg)]
+    sessions = []
+    for path in paths:
+        records = list(read_trace(path))
+        if records and records[0].kind == SESSION:
+            sessions.append(records)
+        else:
+            print(f"⚠️  Bỏ qua {path}: thiếu record SESSION")
+    if not sessions:
+        print("Không có trace nào để phát lại.")
+        return 1
+
+    recorded = [turn for records in sessions for turn in turn_latencies(records)]
+    print(f"🎞️  {len(sessions)} phiên, {len(recorded)} lượt đã ghi")
+
+    replayed = None
+    if not args.summary:
+        print(f"▶️  Replay tới {args.url} với tốc độ x{args.speed:g}...")
+        start = time.perf_counter()
+        observed = asyncio.run(replay_all(sessions, args))
+        replayed = [turn for records in observed for turn in turn_latencies(records)]
+        print(f"   Xong sau {time.perf_counter() - start:.1f}s, {len(replayed)} lượt")
+
+    print("\n" + " TRACE REPLAY REPORT ".center(72, "="))
+    print_comparison(recorded, replayed)
+    barge_ins = sum(1 for turn in recorded if turn.get("barge_in"))
+    print(f"\n  Barge-in: recorded {barge_ins}"
+          + (f", replayed {sum(1 for turn in replayed if turn.get('barge_in'))}" if replayed is not None else ""))
+    print("  Recorded stage timings:")
+    print_stage_summary(record for records in sessions for record in records)
+    print("=" * 72)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())